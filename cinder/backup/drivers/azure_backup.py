@@ -21,6 +21,9 @@ from cinder import exception
 from cinder.i18n import _, _LI
 from cinder.volume.drivers.azure.adapter import Azure
 from cinder.volume.drivers.azure.adapter import CONF
+from cinder.volume.drivers.azure import disktype
+from cinder.volume.drivers.azure import resource_ids
+from cinder.volume.drivers.azure import sharding
 
 LOG = logging.getLogger(__name__)
 BACKUP_PREFIX = 'backup'
@@ -37,34 +40,26 @@ class AzureBackupDriver(driver.BackupDriver):
             self.azure = Azure()
             self.disks = self.azure.compute.disks
             self.snapshots = self.azure.compute.snapshots
+            self.shards = sharding.build_shards(self.azure, Azure, CONF)
+            self.default_shard = list(self.shards.values())[0]
+            self.disk_types = disktype.DiskTypes()
         except Exception as e:
             message = (_("Initialize Azure Adapter failed. reason: %s")
                        % six.text_type(e))
             LOG.exception(message)
             raise exception.BackupDriverException(data=message)
 
-    def _copy_disk(self, disk_name, source_id, azure_type, size=None):
-        disk_dict = {
-            'location': CONF.azure.location,
-            'account_type': azure_type,
-            'creation_data': {
-                'create_option': DiskCreateOption.copy,
-                'source_uri': source_id
-            }
-        }
-        if size:
-            disk_dict['disk_size_gb'] = size
+    def _copy_disk(self, disk_name, source_id, spec, size=None, shard=None,
+                   tags=None):
+        shard = shard or self.default_shard
         try:
-            async_action = self.disks.create_or_update(
-                CONF.azure.resource_group,
-                disk_name,
-                disk_dict
-            )
+            async_action = disktype.create_disk(shard, disk_name, spec, size,
+                                                source_id, tags)
             async_action.result()
         except Exception as e:
             try:
-                self.disks.delete(
-                    CONF.azure.resource_group,
+                shard.disks.delete(
+                    shard.group_for(disk_name),
                     disk_name
                 )
             except Exception:
@@ -77,9 +72,11 @@ class AzureBackupDriver(driver.BackupDriver):
             LOG.exception(message)
             raise exception.BackupDriverException(data=message)
 
-    def _copy_snapshot(self, disk_name, source_id, azure_type, size=None):
+    def _copy_snapshot(self, disk_name, source_id, azure_type, size=None,
+                       shard=None):
+        shard = shard or self.default_shard
         disk_dict = {
-            'location': CONF.azure.location,
+            'location': shard.location,
             'account_type': azure_type,
             'creation_data': {
                 'create_option': DiskCreateOption.copy,
@@ -89,16 +86,16 @@ class AzureBackupDriver(driver.BackupDriver):
         if size:
             disk_dict['disk_size_gb'] = size
         try:
-            async_action = self.snapshots.create_or_update(
-                CONF.azure.resource_group,
+            async_action = shard.snapshots.create_or_update(
+                shard.group_for(disk_name),
                 disk_name,
                 disk_dict
             )
             async_action.result()
         except Exception as e:
             try:
-                self.snapshots.delete(
-                    CONF.azure.resource_group,
+                shard.snapshots.delete(
+                    shard.group_for(disk_name),
                     disk_name
                 )
             except Exception:
@@ -114,6 +111,14 @@ class AzureBackupDriver(driver.BackupDriver):
     def _get_name_from_id(self, prefix, resource_id):
         return '{}-{}'.format(prefix, resource_id)
 
+    def _get_disk_name(self, volume):
+        """Disk of volume, name of pool disk claimed is in provider_id."""
+        return volume.get('provider_id') or self._get_name_from_id(
+            VOLUME_PREFIX, volume['id'])
+
+    def _get_shard(self, name):
+        return self.shards.get(name, self.default_shard)
+
     def backup(self, backup, volume_file, backup_metadata=True):
         """Backup azure volume to azure .
 
@@ -122,63 +127,51 @@ class AzureBackupDriver(driver.BackupDriver):
         volume = self.db.volume_get(self.context,
                                     backup['volume_id'])
         account_type = StorageAccountTypes.standard_lrs
+        # backup placed in shard of volume, its snapshots are there too.
+        shard = self._get_shard(volume.get('provider_location'))
         # backup with --snapshot-id
         if backup['snapshot_id'] is not None:
             src_vref_name = self._get_name_from_id(
                 SNAPSHOT_PREFIX, backup['snapshot_id'])
-            resource_driver = self.snapshots
+            resource_type = resource_ids.SNAPSHOTS
 
         # backup volume
         else:
-            src_vref_name = self._get_name_from_id(
-                VOLUME_PREFIX, volume['id'])
-            resource_driver = self.disks
+            src_vref_name = self._get_disk_name(volume)
+            resource_type = resource_ids.DISKS
 
         disk_name = self._get_name_from_id(
             BACKUP_PREFIX, backup['id'])
-        try:
-            src_vref_obj = resource_driver.get(
-                CONF.azure.resource_group,
-                src_vref_name
-            )
-        except Exception as e:
-            message = (_("Create Back of %(volume)s in Azure"
-                         " failed. reason: %(reason)s")
-                       % dict(volume=src_vref_name,
-                              reason=six.text_type(e)))
-            LOG.exception(message)
-            raise exception.VolumeNotFound(volume_id=volume['id'])
-        else:
-            self._copy_snapshot(disk_name, src_vref_obj.id, account_type)
+        self._copy_snapshot(disk_name,
+                            shard.resource_id(resource_type, src_vref_name),
+                            account_type, shard=shard)
+        return dict(service_metadata=shard.name)
 
     def restore(self, backup, volume_id, volume_file):
         """Restore volume from backup in azure.
 
         only support restore backup from and to azure.
         delete volume disk and then copy backup to volume disk, since
-        managed disk have no restore operation.
+        managed disk have no restore operation. tags of volume disk, e.g.
+        volume tag of a pool disk, are kept.
         """
         target_volume = self.db.volume_get(self.context,
                                            volume_id)
-        azure_type = StorageAccountTypes.premium_lrs \
-            if 'azure_ssd' == target_volume['volume_type']['name'] \
-            else StorageAccountTypes.standard_lrs
+        spec = self.disk_types.get(target_volume['volume_type'])
         size = target_volume['size']
-        disk_name = self._get_name_from_id(
-            VOLUME_PREFIX, target_volume['id'])
+        disk_name = self._get_disk_name(target_volume)
         backup_name = self._get_name_from_id(
             BACKUP_PREFIX, backup['id'])
         # tmp snapshot to store original disk
         tmp_disk_name = TMP_PREFIX + '-' + disk_name
+        shard = self._get_shard(target_volume.get('provider_location'))
+        backup_shard = self._get_shard(backup.get('service_metadata'))
         try:
-            backup_obj = self.snapshots.get(
-                CONF.azure.resource_group,
+            # original disk is deleted below, make sure backup exists first.
+            backup_id = backup_shard.snapshots.get(
+                backup_shard.group_for(backup_name),
                 backup_name
-            )
-            disk_obj = self.disks.get(
-                CONF.azure.resource_group,
-                disk_name
-            )
+            ).id
         except Exception as e:
             message = (_("Restoring Backup of Volume: %(volume)s in Azure"
                          " failed. reason: %(reason)s")
@@ -187,13 +180,26 @@ class AzureBackupDriver(driver.BackupDriver):
             LOG.exception(message)
             raise exception.BackupNotFound(backup_id=backup['id'])
 
+        try:
+            tags = shard.disks.get(shard.group_for(disk_name),
+                                   disk_name).tags
+        except Exception as e:
+            message = (_("Restoring Backup of Volume: %(volume)s in Azure"
+                         " failed. reason: %(reason)s")
+                       % dict(volume=volume_id,
+                              reason=six.text_type(e)))
+            LOG.exception(message)
+            raise exception.BackupDriverException(data=message)
+
         # 1 snapshot volume disk
-        self._copy_snapshot(tmp_disk_name, disk_obj.id, azure_type)
+        self._copy_snapshot(tmp_disk_name,
+                            shard.resource_id(resource_ids.DISKS, disk_name),
+                            StorageAccountTypes.standard_lrs, shard=shard)
 
         try:
             # 2 delete original disk
-            async_action = self.disks.delete(
-                CONF.azure.resource_group,
+            async_action = shard.disks.delete(
+                shard.group_for(disk_name),
                 disk_name
             )
             async_action.result()
@@ -207,15 +213,14 @@ class AzureBackupDriver(driver.BackupDriver):
 
         try:
             # restore from backup
-            self._copy_disk(disk_name, backup_obj.id, azure_type, size)
+            self._copy_disk(disk_name, backup_id, spec, size, shard, tags)
         except Exception as e:
             # roll back
             try:
-                tmp_obj = self.snapshots.get(
-                    CONF.azure.resource_group,
-                    tmp_disk_name
-                )
-                self._copy_disk(disk_name, tmp_obj.id, azure_type, size)
+                self._copy_disk(disk_name,
+                                shard.resource_id(resource_ids.SNAPSHOTS,
+                                                  tmp_disk_name),
+                                spec, size, shard, tags)
             except Exception:
                 message = (_("Restoring Backup of Volume: %(volume)s in Azure"
                              " failed, and the original volume are damaged.")
@@ -236,8 +241,8 @@ class AzureBackupDriver(driver.BackupDriver):
         finally:
             try:
                 # delete tmp disk
-                async_action = self.snapshots.delete(
-                    CONF.azure.resource_group,
+                async_action = shard.snapshots.delete(
+                    shard.group_for(tmp_disk_name),
                     tmp_disk_name
                 )
                 async_action.result()
@@ -252,11 +257,12 @@ class AzureBackupDriver(driver.BackupDriver):
     def delete(self, backup):
         """Delete a saved backup in Azure."""
         disk_name = self._get_name_from_id(BACKUP_PREFIX, backup['id'])
+        shard = self._get_shard(backup.get('service_metadata'))
         LOG.debug("Calling Delete Backup '{}' in Azure ..."
                   .format(disk_name))
         try:
-            async_action = self.snapshots.delete(
-                CONF.azure.resource_group,
+            async_action = shard.snapshots.delete(
+                shard.group_for(disk_name),
                 disk_name
             )
             async_action.result()
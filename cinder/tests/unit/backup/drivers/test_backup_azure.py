@@ -6,6 +6,7 @@ from cinder.backup.drivers import azure_backup
 from cinder import context
 from cinder import exception
 from cinder import test
+from cinder.volume.drivers.azure import disktype
 from cinder.volume.drivers.azure.driver import AzureMissingResourceHttpError
 import cinder.volume.utils
 
@@ -37,11 +38,13 @@ class AzureBackupDriverTestCase(test.TestCase):
         super(AzureBackupDriverTestCase, self).setUp()
         self.cxt = context.get_admin_context()
         self.driver = azure_backup.AzureBackupDriver(self.cxt)
+        self.driver.disk_types = disktype.DiskTypes(lambda type_id: {})
         self.fack_backup = dict(name='backup_name',
                                 id='backup_id',
                                 volume_id='volume_id',
                                 snapshot_id=None,
-                                volume_type=dict(name='azure_hdd'),
+                                volume_type=dict(id='type_id',
+                                                 name='azure_hdd'),
                                 size=1)
         self.stubs.Set(loopingcall, 'FixedIntervalLoopingCall',
                        lambda a: FakeLoopingCall(a))
@@ -65,7 +68,8 @@ class AzureBackupDriverTestCase(test.TestCase):
         self.assertRaises(
             exception.BackupDriverException,
             self.driver._copy_disk,
-            self.fack_backup, 'source', 'type')
+            self.fack_backup, 'source', disktype.DiskSpec(
+                disktype.STANDARD_LRS, None, None, None))
 
     def test_copy_snapshot_raise(self):
         # raise test
@@ -94,9 +98,11 @@ class AzureBackupDriverTestCase(test.TestCase):
         self.driver.snapshots.delete.assert_called()
 
     def test_backup_miss(self):
-        self.driver.disks.get.side_effect = Exception
+        # non exist volume, copy snapshot from it fails.
+        self.driver.db.volume_get = mock.Mock(return_value=self.fack_backup)
+        self.driver.snapshots.create_or_update.side_effect = Exception
         self.assertRaises(
-            exception.VolumeNotFound,
+            exception.BackupDriverException,
             self.driver.backup,
             self.fack_backup, 'vol_file')
 
@@ -105,7 +111,10 @@ class AzureBackupDriverTestCase(test.TestCase):
     def test_backup(self, mo_copy):
         self.driver.db.volume_get = mock.Mock(return_value=self.fack_backup)
         self.driver.backup(self.fack_backup, 'vol_file')
-        mo_copy.assert_called()
+        source_id = mo_copy.call_args[0][1]
+        self.assertTrue(source_id.endswith(
+            '/providers/Microsoft.Compute/disks/volume-backup_id'))
+        self.driver.disks.get.assert_not_called()
 
     def test_restore_miss(self):
         self.driver.db.volume_get = mock.Mock(return_value=self.fack_backup)
@@ -119,8 +128,29 @@ class AzureBackupDriverTestCase(test.TestCase):
                        '_copy_disk')
     def test_restore(self, mo_copy):
         self.driver.db.volume_get = mock.Mock(return_value=self.fack_backup)
+        tags = {'cinder_volume': 'vol_id'}
+        self.driver.disks.get.return_value = mock.Mock(tags=tags)
         self.driver.restore(self.fack_backup, 'vol_id', 'vol_file')
         mo_copy.assert_called()
+        # tags of volume disk are kept.
+        self.assertEqual(tags, mo_copy.call_args[0][5])
+
+    @mock.patch.object(cinder.backup.drivers.azure_backup.AzureBackupDriver,
+                       '_copy_disk')
+    def test_restore_rollback(self, mo_copy):
+        self.driver.db.volume_get = mock.Mock(return_value=self.fack_backup)
+        tags = {'cinder_volume': 'vol_id'}
+        self.driver.disks.get.return_value = mock.Mock(tags=tags)
+        mo_copy.side_effect = [exception.BackupDriverException(data=''),
+                               None]
+        self.assertRaises(exception.BackupDriverException,
+                          self.driver.restore,
+                          self.fack_backup, 'vol_id', 'vol_file')
+        self.assertEqual(2, mo_copy.call_count)
+        self.assertTrue(mo_copy.call_args[0][1].endswith(
+            '/providers/Microsoft.Compute/snapshots/tmp-volume-backup_id'))
+        self.assertEqual([tags, tags],
+                         [i[0][5] for i in mo_copy.call_args_list])
 
 
 class GetBackupDriverTestCase(test.TestCase):
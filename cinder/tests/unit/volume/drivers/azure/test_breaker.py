@@ -0,0 +1,66 @@
+from cinder import test
+from cinder.volume.drivers.azure import breaker
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTestCase(test.TestCase):
+
+    def setUp(self):
+        super(CircuitBreakerTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.circuit = breaker.CircuitBreaker(
+            'disks:read', error_rate=0.5, min_calls=4, window=60,
+            cooldown=30, clock=self.clock)
+
+    def _fail(self, times):
+        for i in range(times):
+            self.assertTrue(self.circuit.allow())
+            self.circuit.record(False)
+
+    def test_get_op_class(self):
+        self.assertEqual(breaker.READ, breaker.get_op_class('get'))
+        self.assertEqual(breaker.READ,
+                         breaker.get_op_class('list_by_resource_group'))
+        self.assertEqual(breaker.WRITE,
+                         breaker.get_op_class('create_or_update'))
+
+    def test_stay_closed_under_min_calls(self):
+        self._fail(3)
+        self.assertEqual(breaker.CLOSED, self.circuit.state)
+
+    def test_open_on_error_rate(self):
+        self.circuit.record(True)
+        self._fail(3)
+        self.assertEqual(breaker.OPEN, self.circuit.state)
+        self.assertFalse(self.circuit.allow())
+
+    def test_half_open_probe_success_close(self):
+        self._fail(4)
+        self.clock.now += 31
+        self.assertTrue(self.circuit.allow())
+        # only one probe at a time.
+        self.assertFalse(self.circuit.allow())
+        self.circuit.record(True)
+        self.assertEqual(breaker.CLOSED, self.circuit.state)
+
+    def test_half_open_probe_failure_reopen(self):
+        self._fail(4)
+        self.clock.now += 31
+        self.assertTrue(self.circuit.allow())
+        self.circuit.record(False)
+        self.assertEqual(breaker.OPEN, self.circuit.state)
+        self.assertEqual(30, self.circuit.retry_after())
+
+    def test_registry_per_endpoint_and_op_class(self):
+        registry = breaker.BreakerRegistry()
+        self.assertIs(registry.get('disks', breaker.READ),
+                      registry.get('disks', breaker.READ))
+        self.assertIsNot(registry.get('disks', breaker.READ),
+                         registry.get('disks', breaker.WRITE))
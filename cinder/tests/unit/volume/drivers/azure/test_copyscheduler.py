@@ -0,0 +1,78 @@
+import threading
+import time
+
+from cinder import test
+from cinder.volume.drivers.azure import copyscheduler
+
+
+class CopySchedulerTestCase(test.TestCase):
+
+    def _start(self, scheduler, source, size, order, release=None):
+        def _copy():
+            order.append(size)
+            if release:
+                release.wait()
+
+        thread = threading.Thread(target=scheduler.run,
+                                  args=(source, size, _copy))
+        thread.start()
+        return thread
+
+    def _wait_queued(self, scheduler, depth):
+        for _i in range(100):
+            if scheduler.stats()['queue_depth'] == depth:
+                return
+            time.sleep(0.01)
+        self.fail('copies not queued')
+
+    def test_run(self):
+        scheduler = copyscheduler.CopyScheduler()
+        self.assertEqual(3, scheduler.run('src', 1, lambda a: a + 1, 2))
+        stats = scheduler.stats()
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertEqual(0, stats['running'])
+
+    def test_run_raise(self):
+        scheduler = copyscheduler.CopyScheduler(max_total=1)
+
+        def _copy():
+            raise ValueError()
+
+        self.assertRaises(ValueError, scheduler.run, 'src', 1, _copy)
+        # slot is released.
+        self.assertEqual(1, scheduler.run('src', 1, lambda: 1))
+
+    def test_small_first(self):
+        scheduler = copyscheduler.CopyScheduler(max_total=1)
+        release = threading.Event()
+        order = []
+        threads = [self._start(scheduler, 'src1', 5, order, release)]
+        self._wait_queued(scheduler, 0)
+        threads.append(self._start(scheduler, 'src2', 10, order))
+        threads.append(self._start(scheduler, 'src3', 1, order))
+        self._wait_queued(scheduler, 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([5, 1, 10], order)
+
+    def test_per_source_limit(self):
+        scheduler = copyscheduler.CopyScheduler(max_total=3,
+                                                max_per_source=1)
+        release = threading.Event()
+        order = []
+        threads = [self._start(scheduler, 'golden', 1, order, release)]
+        self._wait_queued(scheduler, 0)
+        threads.append(self._start(scheduler, 'golden', 1, order))
+        threads.append(self._start(scheduler, 'other', 10, order))
+        # copy of other source runs, second copy of golden waits.
+        self._wait_queued(scheduler, 1)
+        for _i in range(100):
+            if len(order) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual([1, 10], order)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([1, 10, 1], order)
@@ -0,0 +1,48 @@
+from cinder import test
+from cinder.volume.drivers.azure import diskpool
+
+KEY = ('sub:rg', 'Standard_LRS', 10)
+
+
+class DiskPoolTestCase(test.TestCase):
+
+    def setUp(self):
+        super(DiskPoolTestCase, self).setUp()
+        self.now = 0
+        self.pool = diskpool.DiskPool([10], max_free=2, window=100,
+                                      clock=lambda: self.now)
+
+    def test_claim(self):
+        self.assertIsNone(self.pool.claim(KEY))
+        self.pool.add(KEY, 'pool-1')
+        self.assertEqual('pool-1', self.pool.claim(KEY))
+        self.assertEqual(0, self.pool.free(KEY))
+
+    def test_claim_size_not_pooled(self):
+        key = ('sub:rg', 'Standard_LRS', 3)
+        self.pool.add(key, 'pool-1')
+        self.assertIsNone(self.pool.claim(key))
+        self.assertEqual({}, self.pool.deficits())
+
+    def test_deficits_follow_requests(self):
+        self.pool.claim(KEY)
+        self.assertEqual({KEY: 1}, self.pool.deficits())
+        self.pool.add(KEY, 'pool-1')
+        self.assertEqual({}, self.pool.deficits())
+        for _i in range(5):
+            self.pool.claim(KEY)
+        # bounded by max_free.
+        self.assertEqual({KEY: 2}, self.pool.deficits())
+        self.now = 200
+        self.assertEqual({}, self.pool.deficits())
+
+    def test_surpluses(self):
+        for i in range(3):
+            self.pool.add(KEY, 'pool-%s' % i)
+        key = ('sub:rg', 'Standard_LRS', 3)
+        self.pool.add(key, 'pool-3')
+        # above max_free, and size no longer pooled.
+        self.assertEqual({KEY: ['pool-2'], key: ['pool-3']},
+                         self.pool.surpluses())
+        self.assertEqual(2, self.pool.free(KEY))
+        self.assertEqual({}, self.pool.surpluses())
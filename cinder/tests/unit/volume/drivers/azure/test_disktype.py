@@ -0,0 +1,83 @@
+import mock
+from cinder import exception
+from cinder import test
+from cinder.volume.drivers.azure import disktype
+
+
+class DiskTypesTestCase(test.TestCase):
+
+    def test_parse_specs_by_name(self):
+        self.assertEqual(disktype.DiskSpec('Premium_LRS', None, None, None),
+                         disktype.parse_specs('azure_ssd', {}))
+        self.assertEqual(disktype.DiskSpec('Standard_LRS', None, None, None),
+                         disktype.parse_specs('azure_hdd', None))
+        self.assertTrue(disktype.parse_specs(None, None).native)
+
+    def test_parse_specs(self):
+        spec = disktype.parse_specs('ultra', {
+            'azure_sku': 'UltraSSD_LRS', 'azure:disk_iops': '8000',
+            'azure:disk_mbps': '300', 'azure:zone': '1'})
+        self.assertEqual(
+            disktype.DiskSpec('UltraSSD_LRS', 8000, 300, '1'), spec)
+        self.assertFalse(spec.native)
+
+    def test_parse_specs_invalid(self):
+        self.assertRaises(exception.InvalidVolumeType,
+                          disktype.parse_specs, 'type',
+                          {'azure_sku': 'Premium_ZRS_X'})
+        self.assertRaises(exception.InvalidVolumeType,
+                          disktype.parse_specs, 'type',
+                          {'azure:disk_iops': 'fast'})
+        self.assertRaises(exception.InvalidVolumeType,
+                          disktype.parse_specs, 'type',
+                          {'azure:disk_mbps': '-1'})
+
+    def test_get_cached(self):
+        get_specs = mock.Mock(return_value={'azure_sku': 'StandardSSD_LRS'})
+        types = disktype.DiskTypes(get_specs)
+        volume_type = dict(id='type_id', name='ssd')
+        self.assertEqual('StandardSSD_LRS', types.get(volume_type).sku)
+        self.assertEqual('StandardSSD_LRS', types.get(volume_type).sku)
+        get_specs.assert_called_once_with('type_id')
+
+    def test_create_disk_native(self):
+        shard = mock.Mock(location='westus')
+        spec = disktype.DiskSpec('Premium_LRS', None, None, None)
+        disktype.create_disk(shard, 'volume-1', spec, 10, 'source_id')
+        disk_dict = shard.disks.create_or_update.call_args[0][2]
+        self.assertEqual('Premium_LRS', disk_dict['account_type'])
+        self.assertEqual('source_id',
+                         disk_dict['creation_data']['source_uri'])
+        self.assertEqual(10, disk_dict['disk_size_gb'])
+        shard.azure.request.assert_not_called()
+
+    def test_create_disk_rest(self):
+        shard = mock.Mock(location='westus')
+        spec = disktype.DiskSpec('PremiumV2_LRS', 5000, 200, '2')
+        disktype.create_disk(shard, 'volume-1', spec, 10)
+        args = shard.azure.request.call_args[0]
+        self.assertEqual(('disks', 'PUT'), args[:2])
+        self.assertEqual(disktype.DISK_API_VERSION, args[3])
+        body = args[4]
+        self.assertEqual({'name': 'PremiumV2_LRS'}, body['sku'])
+        self.assertEqual(['2'], body['zones'])
+        self.assertEqual({'creationData': {'createOption': 'Empty'},
+                          'diskSizeGB': 10,
+                          'diskIOPSReadWrite': 5000,
+                          'diskMBpsReadWrite': 200}, body['properties'])
+        shard.disks.create_or_update.assert_not_called()
+
+    def test_update_body(self):
+        old = disktype.DiskSpec('PremiumV2_LRS', 3000, 125)
+        new = disktype.DiskSpec('PremiumV2_LRS', 8000, 125)
+        self.assertEqual({'properties': {'diskIOPSReadWrite': 8000}},
+                         disktype.update_body(old, new))
+        self.assertEqual({}, disktype.update_body(old, old))
+
+    def test_update_body_not_in_place(self):
+        self.assertIsNone(disktype.update_body(
+            disktype.DiskSpec('Premium_LRS'),
+            disktype.DiskSpec('UltraSSD_LRS', 8000)))
+        self.assertIsNone(disktype.update_body(
+            disktype.DiskSpec('Premium_LRS', zone='1'),
+            disktype.DiskSpec('Premium_LRS', zone='2')))
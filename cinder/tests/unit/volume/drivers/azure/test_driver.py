@@ -2,10 +2,12 @@ import ddt
 import mock
 from oslo_config import cfg
 from oslo_service import loopingcall
+from oslo_utils import units
 from cinder import db
 from cinder import exception
 from cinder.objects.volume import MetadataObject
 from cinder.tests.unit import test_volume
+from cinder.volume.drivers.azure import disktype
 from cinder.volume.drivers.azure import driver
 from cinder.volume.drivers.azure.driver import AzureMissingResourceHttpError
 import cinder.volume.utils
@@ -52,6 +54,7 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
 
         self.driver = driver.AzureDriver(configuration=self.configuration,
                                          db=db)
+        self.driver.disk_types = disktype.DiskTypes(lambda type_id: {})
         metadata_obj = MetadataObject('os_type', 'fake_type')
         self.fake_vol = FakeObj()
         self.fake_vol.name = 'vol_name'
@@ -59,7 +62,10 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
         self.fake_vol.size = 1
         self.fake_vol.metadata = dict(os_type='fake_type')
         self.fake_vol.volume_metadata = [metadata_obj]
+        self.fake_vol.provider_location = None
+        self.fake_vol.provider_id = None
         volume_type = FakeObj()
+        volume_type.id = 'type_id'
         volume_type.name = 'azure_hdd'
         self.fake_vol.volume_type = volume_type
         self.fake_snap = dict(
@@ -90,8 +96,68 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
 
     def test_get_volume_stats(self):
         ret = self.driver.get_volume_stats()
-        self.assertEqual(self.configuration.azure_total_capacity_gb,
-                         ret['total_capacity_gb'])
+        total = self.configuration.azure_total_capacity_gb
+        self.assertEqual(list(driver.POOL_SKUS),
+                         [i['pool_name'] for i in ret['pools']])
+        self.assertEqual(['Standard_LRS', 'Premium_LRS'],
+                         [i['azure_sku'] for i in ret['pools'][:2]])
+        self.assertEqual(total, ret['pools'][0]['total_capacity_gb'])
+        self.assertEqual(total, ret['pools'][0]['free_capacity_gb'])
+        # capacity shared by pools is reported once.
+        self.assertEqual(total, ret['total_capacity_gb'])
+        self.assertFalse(
+            ret['pools'][0]['consistent_group_snapshot_enabled'])
+
+    def test_get_volume_stats_copy_queue(self):
+        ret = self.driver.get_volume_stats()
+        self.assertEqual(0, ret['copy_queue_depth'])
+        self.assertEqual(0, ret['copy_wait_seconds'])
+
+    def test_get_volume_stats_allocated(self):
+        self.driver.create_volume(self.fake_vol)
+        self.fake_vol.size = 3
+        self.driver.create_cloned_volume(self.fake_vol, self.fake_snap)
+        ret = self.driver.get_volume_stats()
+        standard, premium = ret['pools'][:2]
+        self.assertEqual(3, standard['allocated_capacity_gb'])
+        self.assertEqual(standard['total_capacity_gb'] - 3,
+                         standard['free_capacity_gb'])
+        self.assertEqual(0, premium['allocated_capacity_gb'])
+        self.assertEqual(standard['free_capacity_gb'],
+                         premium['free_capacity_gb'])
+        self.assertEqual(standard['free_capacity_gb'],
+                         ret['free_capacity_gb'])
+        self.driver.delete_volume(self.fake_vol)
+        ret = self.driver.get_volume_stats(refresh=True)
+        self.assertEqual(0, ret['pools'][0]['allocated_capacity_gb'])
+        self.driver.disks.list_by_resource_group.assert_not_called()
+
+    @mock.patch.object(loopingcall, 'FixedIntervalLoopingCall')
+    def test_do_setup(self, mock_timer):
+        self.driver.do_setup(self.context)
+        mock_timer.return_value.start.assert_has_calls([
+            mock.call(interval=CONF.azure.capacity_reconcile_interval),
+            mock.call(interval=CONF.azure.disk_pool_refill_interval)])
+
+    def test_reconcile_capacity(self):
+        disks = []
+        for name, sku, size in (('volume-1', 'Premium_LRS', 10),
+                                ('volume-2', 'Standard_LRS', 5),
+                                ('image-1', 'Standard_LRS', 30)):
+            disk = mock.Mock(account_type=sku, disk_size_gb=size)
+            disk.name = name
+            disks.append(disk)
+        self.driver.disks.list_by_resource_group.return_value = disks
+        self.driver.ledger.record('volume-3', 'Standard_LRS', 7)
+        self.driver._reconcile_capacity()
+        self.assertEqual({'Premium_LRS': 10, 'Standard_LRS': 5},
+                         self.driver.ledger.allocated())
+
+    def test_reconcile_capacity_raise(self):
+        self.driver.ledger.record('volume-3', 'Standard_LRS', 7)
+        self.driver.disks.list_by_resource_group.side_effect = Exception
+        self.driver._reconcile_capacity()
+        self.assertEqual({'Standard_LRS': 7}, self.driver.ledger.allocated())
 
     def test_get_name_from_id(self):
         prefix = 'prefix'
@@ -108,8 +174,41 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
             self.fake_vol, 'source', 'type')
 
     def test_create_volume(self):
-        self.driver.create_volume(self.fake_vol)
+        ret = self.driver.create_volume(self.fake_vol)
         self.driver.disks.create_or_update.assert_called()
+        self.assertEqual(self.driver.default_shard.name,
+                         ret['provider_location'])
+
+    def test_create_volume_extra_specs(self):
+        self.driver.disk_types = disktype.DiskTypes(
+            lambda type_id: {'azure_sku': 'UltraSSD_LRS',
+                             'azure:disk_iops': '4000'})
+        self.driver.create_volume(self.fake_vol)
+        self.driver.disks.create_or_update.assert_not_called()
+        body = self.driver.default_shard.azure.request.call_args[0][4]
+        self.assertEqual(4000, body['properties']['diskIOPSReadWrite'])
+
+    def test_retype(self):
+        specs = {'type_id': {},
+                 'new': {'azure_sku': 'Premium_LRS', 'azure:tier': 'P30'}}
+        self.driver.disk_types = disktype.DiskTypes(specs.get)
+        self.assertTrue(self.driver.retype(
+            self.context, self.fake_vol, dict(id='new', name='fast'), {},
+            'host'))
+        args = self.driver.default_shard.azure.request.call_args[0]
+        self.assertEqual('PATCH', args[1])
+        self.assertEqual({'sku': {'name': 'Premium_LRS'},
+                          'properties': {'tier': 'P30'}}, args[4])
+        self.driver.disks.create_or_update.assert_not_called()
+
+    def test_retype_not_in_place(self):
+        specs = {'type_id': {},
+                 'new': {'azure_sku': 'UltraSSD_LRS', 'azure:zone': '1'}}
+        self.driver.disk_types = disktype.DiskTypes(specs.get)
+        self.assertFalse(self.driver.retype(
+            self.context, self.fake_vol, dict(id='new', name='ultra'), {},
+            'host'))
+        self.driver.default_shard.azure.request.assert_not_called()
 
     def test_create_volume_create_raise(self):
         self.driver.disks.create_or_update.side_effect = Exception
@@ -127,6 +226,68 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
             self.driver.create_volume,
             self.fake_vol)
 
+    def test_create_volume_pool_disk(self):
+        key = (self.driver.default_shard.name, 'Standard_LRS', 1)
+        self.driver.disk_pool = driver.diskpool.DiskPool([1])
+        self.driver.disk_pool.add(key, 'pool-1')
+        ret = self.driver.create_volume(self.fake_vol)
+        self.assertEqual('pool-1', ret['provider_id'])
+        self.driver.disks.update.assert_called_once_with(
+            mock.ANY, 'pool-1', {'tags': {driver.VOLUME_TAG: 'vol_id'}})
+        self.driver.disks.create_or_update.assert_not_called()
+        self.assertEqual({'Standard_LRS': 1}, self.driver.ledger.allocated())
+
+    def test_create_volume_pool_claim_raise(self):
+        key = (self.driver.default_shard.name, 'Standard_LRS', 1)
+        self.driver.disk_pool = driver.diskpool.DiskPool([1])
+        self.driver.disk_pool.add(key, 'pool-1')
+        self.driver.disks.update.side_effect = Exception
+        ret = self.driver.create_volume(self.fake_vol)
+        self.assertNotIn('provider_id', ret)
+        self.driver.disks.create_or_update.assert_called()
+
+    def test_refill_disk_pool(self):
+        free = mock.Mock(account_type='Standard_LRS', disk_size_gb=1,
+                         tags={driver.POOL_TAG: 'free'})
+        free.name = 'pool-0'
+        self.driver.disks.list_by_resource_group.return_value = [free]
+        key = (self.driver.default_shard.name, 'Standard_LRS', 1)
+        self.driver.disk_pool = driver.diskpool.DiskPool([1])
+        for _i in range(3):
+            self.driver.disk_pool.claim(key)
+        self.driver._refill_disk_pool()
+        # pool-0 loaded, 2 created for 3 recent requests.
+        self.assertEqual(3, self.driver.disk_pool.free(key))
+        self.assertEqual(2, self.driver.disks.create_or_update.call_count)
+        body = self.driver.disks.create_or_update.call_args[0][2]
+        self.assertEqual({driver.POOL_TAG: 'free'}, body['tags'])
+
+    def test_refill_disk_pool_shrink(self):
+        disks = []
+        for i, size in enumerate((1, 1, 2)):
+            disk = mock.Mock(account_type='Standard_LRS', disk_size_gb=size,
+                             tags={driver.POOL_TAG: 'free'})
+            disk.name = 'pool-%s' % i
+            disks.append(disk)
+        self.driver.disks.list_by_resource_group.return_value = disks
+        # size 2 is no longer pooled, size 1 keeps at most one.
+        self.driver.disk_pool = driver.diskpool.DiskPool([1], max_free=1)
+        self.driver._refill_disk_pool()
+        deleted = sorted(i[0][1] for i in
+                         self.driver.disks.delete.call_args_list)
+        self.assertEqual(['pool-1', 'pool-2'], deleted)
+        key = (self.driver.default_shard.name, 'Standard_LRS', 1)
+        self.assertEqual(1, self.driver.disk_pool.free(key))
+        self.driver.disks.create_or_update.assert_not_called()
+
+    def test_get_disk_name(self):
+        self.assertEqual('volume-vol_id',
+                         self.driver._get_disk_name(self.fake_vol))
+        self.fake_vol.provider_id = 'pool-1'
+        self.assertEqual('pool-1', self.driver._get_disk_name(self.fake_vol))
+        self.assertEqual('volume-volume_id',
+                         self.driver._get_disk_name(None, 'volume_id'))
+
     def test_delete_volume(self):
         self.driver.delete_volume(self.fake_vol)
         self.driver.disks.delete.assert_called()
@@ -156,6 +317,32 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
         self.assertEqual(snapshot_name,
                          ret['metadata']['azure_snapshot_id'])
 
+    def test_create_snapshot_incremental(self):
+        self.driver.db = mock.Mock()
+        self.driver.db.snapshot_get_all_for_volume.return_value = [
+            dict(id='old', status='available', created_at=1),
+            dict(id='last', status='available', created_at=2),
+            dict(id='failed', status='error', created_at=3),
+            dict(id='snap_id', status='creating', created_at=4)]
+        request = self.driver.default_shard.azure.request
+        ret = self.driver.create_snapshot(self.fake_snap)
+        self.driver.snapshots.create_or_update.assert_not_called()
+        body = request.call_args[0][4]
+        self.assertTrue(body['properties']['incremental'])
+        self.assertTrue(body['properties']['creationData'][
+            'sourceResourceId'].endswith('/disks/volume-volume_id'))
+        self.assertEqual('True', ret['metadata']['azure_incremental'])
+        self.assertEqual('snapshot-last',
+                         ret['metadata']['azure_base_snapshot_id'])
+
+    def test_create_snapshot_first_full(self):
+        self.driver.db = mock.Mock()
+        self.driver.db.snapshot_get_all_for_volume.return_value = [
+            dict(id='snap_id', status='creating', created_at=4)]
+        ret = self.driver.create_snapshot(self.fake_snap)
+        self.driver.snapshots.create_or_update.assert_called()
+        self.assertNotIn('azure_incremental', ret['metadata'])
+
     def test_create_snapshot_raise(self):
         self.driver.snapshots.create_or_update.side_effect = Exception
         self.assertRaises(
@@ -181,8 +368,8 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
             self.fake_snap)
 
     def test_create_volume_from_snapshot_miss(self):
-        # non exist volume, raise not found
-        self.driver.snapshots.get.side_effect = Exception
+        # non exist snapshot, copy disk from it fails.
+        self.driver.disks.create_or_update.side_effect = Exception
         self.assertRaises(
             exception.VolumeBackendAPIException,
             self.driver.create_volume_from_snapshot,
@@ -192,13 +379,65 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
                        '_copy_disk')
     def test_create_volume_from_snapshot(self, mo_copy):
         self.driver.create_volume_from_snapshot(self.fake_vol, self.fake_snap)
-        mo_copy.assert_called()
+        source_id = mo_copy.call_args[0][1]
+        self.assertTrue(source_id.endswith(
+            '/providers/Microsoft.Compute/snapshots/snapshot-snap_id'))
+        self.driver.snapshots.get.assert_not_called()
+
+    @mock.patch.object(cinder.volume.drivers.azure.driver.AzureDriver,
+                       '_copy_disk')
+    def test_revert_to_snapshot(self, mo_copy):
+        tags = {driver.VOLUME_TAG: 'vol_id'}
+        self.driver.disks.get.return_value = mock.Mock(tags=tags)
+        self.driver.revert_to_snapshot(self.context, self.fake_vol,
+                                       self.fake_snap)
+        tmp_name = self.driver.snapshots.create_or_update.call_args[0][1]
+        self.assertEqual('tmp-volume-vol_id', tmp_name)
+        self.driver.disks.delete.assert_called_once()
+        self.assertEqual('volume-vol_id', mo_copy.call_args[0][0])
+        self.assertTrue(mo_copy.call_args[0][1].endswith(
+            '/providers/Microsoft.Compute/snapshots/snapshot-snap_id'))
+        # tags of original disk are kept.
+        self.assertEqual(tags, mo_copy.call_args[0][5])
+        self.assertEqual('tmp-volume-vol_id',
+                         self.driver.snapshots.delete.call_args[0][1])
+
+    @mock.patch.object(cinder.volume.drivers.azure.driver.AzureDriver,
+                       '_copy_disk')
+    def test_revert_to_snapshot_rollback(self, mo_copy):
+        mo_copy.side_effect = [exception.VolumeBackendAPIException(data=''),
+                               None]
+        self.assertRaises(exception.VolumeBackendAPIException,
+                          self.driver.revert_to_snapshot,
+                          self.context, self.fake_vol, self.fake_snap)
+        # original disk is copied back from tmp snapshot.
+        self.assertTrue(mo_copy.call_args[0][1].endswith(
+            '/providers/Microsoft.Compute/snapshots/tmp-volume-vol_id'))
+        self.driver.snapshots.delete.assert_called_once()
+
+    @mock.patch.object(cinder.volume.drivers.azure.driver.AzureDriver,
+                       '_copy_disk')
+    def test_revert_to_snapshot_rollback_fail(self, mo_copy):
+        mo_copy.side_effect = exception.VolumeBackendAPIException(data='')
+        ex = self.assertRaises(exception.VolumeBackendAPIException,
+                               self.driver.revert_to_snapshot,
+                               self.context, self.fake_vol, self.fake_snap)
+        # tmp snapshot is the only copy of original disk.
+        self.assertIn('tmp-volume-vol_id', ex.msg)
+        self.driver.snapshots.delete.assert_not_called()
+
+    def test_revert_to_snapshot_tmp_fail(self):
+        self.driver.snapshots.create_or_update.side_effect = Exception
+        self.assertRaises(exception.VolumeBackendAPIException,
+                          self.driver.revert_to_snapshot,
+                          self.context, self.fake_vol, self.fake_snap)
+        self.driver.disks.delete.assert_not_called()
 
     def test_create_cloned_volume_miss(self):
-        # non exist volume, raise not found
-        self.driver.disks.get.side_effect = Exception
+        # non exist volume, copy disk from it fails.
+        self.driver.disks.create_or_update.side_effect = Exception
         self.assertRaises(
-            exception.VolumeNotFound,
+            exception.VolumeBackendAPIException,
             self.driver.create_cloned_volume,
             self.fake_vol, self.fake_snap)
 
@@ -209,8 +448,8 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
         mo_copy.assert_called()
 
     def test_create_volume_from_image_miss(self):
-        # non exist image, raise not found
-        self.driver.disks.get.side_effect = Exception
+        # non exist image, copy disk from it fails.
+        self.driver.disks.create_or_update.side_effect = Exception
         self.assertRaises(
             exception.VolumeBackendAPIException,
             self.driver.clone_image,
@@ -223,9 +462,51 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
                                 self.fake_snap, '')
         mo_copy.assert_called()
 
+    def test_clone_image_not_in_azure(self):
+        image_meta = dict(id='image_id', properties=dict(os_type='linux'))
+        self.assertEqual((None, False), self.driver.clone_image(
+            self.context, self.fake_vol, '', image_meta, ''))
+        self.driver.disks.create_or_update.assert_not_called()
+
+    @mock.patch('cinder.volume.drivers.azure.upload.PageUploader')
+    def test_copy_image_to_volume(self, mo_uploader):
+        image_service = mock.Mock()
+        image_service.show.return_value = dict(disk_format='raw',
+                                               size=512 * units.Mi)
+        image_service.download.return_value = [b'data']
+        azure = self.driver.default_shard.azure
+        azure.request.return_value.result.return_value = dict(
+            accessSAS='sas_url')
+        self.driver.copy_image_to_volume(self.context, self.fake_vol,
+                                         image_service, 'image_id')
+        self.driver.disks.delete.assert_called_once()
+        calls = [i[0] for i in azure.request.call_args_list]
+        body = calls[0][4]
+        self.assertEqual({'createOption': 'Upload',
+                          'uploadSizeBytes': 512 * units.Mi + 512},
+                         body['properties']['creationData'])
+        self.assertTrue(calls[1][2].endswith('/beginGetAccess'))
+        self.assertTrue(calls[2][2].endswith('/endGetAccess'))
+        # 1 GB volume is larger than image.
+        self.assertEqual({'properties': {'diskSizeGB': 1}}, calls[3][4])
+        mo_uploader.assert_called_once_with('sas_url', mock.ANY,
+                                            retry_policy=mock.ANY,
+                                            skip_zeros=True)
+        mo_uploader.return_value.upload.assert_called_once()
+
+    def test_copy_image_to_volume_unknown_format(self):
+        image_service = mock.Mock()
+        image_service.show.return_value = dict(disk_format='vmdk',
+                                               size=units.Mi)
+        self.assertRaises(exception.ImageUnacceptable,
+                          self.driver.copy_image_to_volume,
+                          self.context, self.fake_vol, image_service,
+                          'image_id')
+        self.driver.disks.delete.assert_not_called()
+
     def test_copy_volume_to_image_miss(self):
-        # non exist volume, raise not found
-        self.driver.disks.get.side_effect = Exception
+        # non exist volume, copy disk from it fails.
+        self.driver.disks.create_or_update.side_effect = Exception
         self.assertRaises(
             exception.VolumeBackendAPIException,
             self.driver.copy_volume_to_image,
@@ -241,3 +522,34 @@ class AzureVolumeDriverTestCase(test_volume.DriverTestCase):
                                          mock.Mock(),
                                          self.fake_snap)
         mo_copy.assert_called()
+
+    @mock.patch.object(cinder.volume.drivers.azure.driver.AzureDriver,
+                       'create_snapshot')
+    def test_create_group_snapshot(self, mo_snap):
+        mo_snap.side_effect = [dict(provider_location='shard'), Exception]
+        snapshots = [mock.Mock(id='snap1'), mock.Mock(id='snap2')]
+        model, updates = self.driver.create_group_snapshot(
+            self.context, mock.Mock(id='group_snap'), snapshots)
+        self.assertEqual(2, mo_snap.call_count)
+        self.assertEqual('error', model['status'])
+        self.assertEqual(dict(id='snap1', status='available',
+                              provider_location='shard'), updates[0])
+        self.assertEqual('error', updates[1]['status'])
+
+    @mock.patch.object(cinder.volume.drivers.azure.driver.AzureDriver,
+                       'create_volume_from_snapshot')
+    def test_create_group_from_src(self, mo_create):
+        mo_create.return_value = dict(provider_location='shard')
+        volumes = [mock.Mock(id='vol1'), mock.Mock(id='vol2')]
+        snapshots = [mock.Mock(id='snap1'), mock.Mock(id='snap2')]
+        model, updates = self.driver.create_group_from_src(
+            self.context, mock.Mock(id='group'), volumes,
+            group_snapshot=mock.Mock(), snapshots=snapshots)
+        self.assertEqual('available', model['status'])
+        mo_create.assert_any_call(volumes[1], snapshots[1])
+        self.assertEqual(['vol1', 'vol2'], [i['id'] for i in updates])
+
+    def test_create_group_from_src_miss(self):
+        self.assertRaises(exception.VolumeBackendAPIException,
+                          self.driver.create_group_from_src,
+                          self.context, mock.Mock(id='group'), [])
@@ -0,0 +1,32 @@
+from azure.mgmt.compute.models import StorageAccountTypes
+from cinder import test
+from cinder.volume.drivers.azure import ledger
+
+
+class CapacityLedgerTestCase(test.TestCase):
+
+    def setUp(self):
+        super(CapacityLedgerTestCase, self).setUp()
+        self.now = 0
+        self.ledger = ledger.CapacityLedger(clock=lambda: self.now)
+
+    def test_record_and_remove(self):
+        self.ledger.record('volume-1', StorageAccountTypes.premium_lrs, 10)
+        self.ledger.record('volume-2', 'Premium_LRS', 5)
+        self.ledger.record('volume-3', 'Standard_LRS', 1)
+        self.assertEqual({'Premium_LRS': 15, 'Standard_LRS': 1},
+                         self.ledger.allocated())
+        # record again is an update, not another disk.
+        self.ledger.record('volume-1', 'Standard_LRS', 20)
+        self.ledger.remove('volume-3')
+        self.ledger.remove('volume-4')
+        self.assertEqual({'Premium_LRS': 5, 'Standard_LRS': 20},
+                         self.ledger.allocated())
+
+    def test_reconcile(self):
+        self.ledger.record('volume-1', 'Standard_LRS', 10)
+        self.now = 50
+        self.ledger.reconcile([('volume-2', 'Premium_LRS', 3),
+                               ('volume-3', 'Premium_LRS', None)])
+        self.assertEqual({'Premium_LRS': 3}, self.ledger.allocated())
+        self.assertEqual(50, self.ledger.reconciled_at)
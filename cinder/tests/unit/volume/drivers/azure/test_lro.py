@@ -0,0 +1,134 @@
+import mock
+from msrestazure.azure_exceptions import CloudError
+
+from cinder import test
+from cinder.volume.drivers.azure import lro
+
+STATUS_URL = 'https://management.azure.com/operations/1'
+VM_URL = 'https://management.azure.com/vm'
+
+
+def fake_response(status_code=200, body=None, headers=None, method='PUT'):
+    response = mock.Mock(status_code=status_code, headers=headers or {},
+                         content='{}' if body else '')
+    response.json.return_value = body
+    response.request.method = method
+    response.request.url = VM_URL
+    return response
+
+
+class FakeVM(object):
+    provisioning_state = 'Creating'
+
+
+class LROEngineTestCase(test.TestCase):
+
+    def setUp(self):
+        super(LROEngineTestCase, self).setUp()
+        self.now = 0
+        self.sleep = mock.Mock(side_effect=self._sleep)
+        # runner is driven by the tests, never spawned.
+        self.spawn = mock.Mock()
+        self.engine = lro.LROEngine(min_interval=1, max_interval=4,
+                                    sleep=self.sleep, clock=lambda: self.now,
+                                    spawn=self.spawn)
+        self.get = mock.Mock()
+        self.deserialize = mock.Mock(return_value='vm')
+
+    def _sleep(self, seconds):
+        self.now += seconds
+
+    def _submit(self, response, output=None):
+        raw = mock.Mock(response=response, output=output)
+        return self.engine.submit('virtual_machines.create_or_update', raw,
+                                  self.get, self.deserialize)
+
+    def test_is_long_running(self):
+        self.assertTrue(lro.is_long_running('virtual_machines', 'start'))
+        self.assertFalse(lro.is_long_running('virtual_machines', 'get'))
+        self.assertFalse(lro.is_long_running('resource_groups',
+                                             'create_or_update'))
+
+    def test_submit_completed_operation(self):
+        op = self._submit(fake_response(200), output='vm')
+        self.assertTrue(op.done())
+        self.assertEqual('vm', op.result())
+        self.assertFalse(self.spawn.called)
+
+    def test_submit_completed_raw_request(self):
+        raw = mock.Mock(response=fake_response(200, body={'a': 1},
+                                               method='POST'),
+                        output=None)
+        op = self.engine.submit('disks.post', raw, self.get,
+                                self.deserialize, 'json')
+        self.assertEqual('vm', op.result())
+        self.deserialize.assert_called_once_with('json', raw.response)
+
+    def test_poll_async_operation(self):
+        response = fake_response(
+            201, headers={lro.ASYNC_HEADER: STATUS_URL})
+        op = self._submit(response, output=FakeVM())
+        self.spawn.assert_called_once_with(self.engine._run)
+        vm_response = fake_response(200, body={'name': 'vm'})
+        self.get.side_effect = [
+            fake_response(200, body={'status': 'InProgress'}),
+            fake_response(200, body={'status': 'Succeeded'}),
+            vm_response]
+        self.engine._run()
+        self.assertEqual('vm', op.result())
+        self.get.assert_has_calls([mock.call(STATUS_URL),
+                                   mock.call(STATUS_URL),
+                                   mock.call(VM_URL)])
+        self.deserialize.assert_called_once_with('FakeVM', vm_response)
+        self.assertEqual(0, self.engine.pending())
+
+    def test_poll_honours_retry_after(self):
+        response = fake_response(
+            202, headers={lro.ASYNC_HEADER: STATUS_URL,
+                          'Retry-After': '10'}, method='POST')
+        op = self._submit(response)
+        self.assertEqual(10, op.next_poll)
+        self.get.return_value = fake_response(
+            200, body={'status': 'Succeeded'})
+        self.engine._run()
+        self.assertIsNone(op.result())
+        self.assertEqual(10, self.now)
+
+    def test_poll_location(self):
+        response = fake_response(
+            202, headers={lro.LOCATION_HEADER: STATUS_URL}, method='DELETE')
+        op = self._submit(response)
+        self.get.side_effect = [fake_response(202), fake_response(204)]
+        self.engine._run()
+        self.assertIsNone(op.result())
+        self.assertEqual(2, self.get.call_count)
+
+    def test_poll_failed_operation(self):
+        response = fake_response(
+            201, headers={lro.ASYNC_HEADER: STATUS_URL})
+        op = self._submit(response, output=FakeVM())
+        self.get.return_value = fake_response(
+            200, body={'status': 'Failed',
+                       'error': {'code': 'Conflict', 'message': 'busy'}})
+        self.engine._run()
+        self.assertRaises(CloudError, op.result)
+
+    def test_poll_transient_error_rescheduled(self):
+        response = fake_response(
+            202, headers={lro.LOCATION_HEADER: STATUS_URL}, method='DELETE')
+        op = self._submit(response)
+        self.get.side_effect = [fake_response(503), fake_response(200)]
+        self.engine._run()
+        self.assertIsNone(op.result())
+
+    def test_resume_operation(self):
+        callback = mock.Mock()
+        op = self.engine.resume('virtual_machines.start', lro.ASYNC,
+                                STATUS_URL, None, None, self.get,
+                                self.deserialize)
+        op.add_done_callback(callback)
+        self.get.return_value = fake_response(
+            200, body={'status': 'Succeeded'})
+        self.engine._run()
+        self.assertIsNone(op.result())
+        callback.assert_called_once_with(op)
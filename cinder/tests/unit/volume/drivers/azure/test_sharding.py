@@ -0,0 +1,89 @@
+import mock
+from oslo_config import cfg
+
+from azure.mgmt.compute.models import StorageAccountTypes
+from cinder import exception
+from cinder import test
+from cinder.volume.drivers.azure import resource_ids
+from cinder.volume.drivers.azure import sharding
+
+CONF = cfg.CONF
+USAGE = sharding.DISK_COUNT_USAGE[StorageAccountTypes.standard_lrs.value]
+
+
+class FakeUsage(object):
+    def __init__(self, name, limit, current_value):
+        self.name = mock.Mock(value=name)
+        self.limit = limit
+        self.current_value = current_value
+
+
+def _fake_shard(name, limit, current, throttle=0):
+    azure = mock.Mock()
+    azure.compute.usage.list.return_value = [
+        FakeUsage(USAGE, limit, current)]
+    azure.retry_policy.throttle_score.return_value = throttle
+    return sharding.Shard(azure, name, 'rg', 'westus')
+
+
+class ShardingTestCase(test.TestCase):
+
+    def test_parse_subscriptions(self):
+        ret = sharding.parse_subscriptions(['sub1:rg1', 'sub2:rg2'])
+        self.assertEqual([('sub1', 'rg1'), ('sub2', 'rg2')], ret)
+
+    def test_parse_subscriptions_invalid(self):
+        self.assertRaises(exception.InvalidConfigurationValue,
+                          sharding.parse_subscriptions, [':rg1'])
+
+    def test_build_shards(self):
+        self.override_config('subscription_id', 'sub0', 'azure')
+        self.override_config('resource_group', 'rg0', 'azure')
+        self.override_config('subscriptions', ['sub1:rg1'], 'azure')
+        azure_cls = mock.Mock()
+        shards = sharding.build_shards('default', azure_cls, CONF)
+        self.assertEqual(['sub0:rg0', 'sub1:rg1'], list(shards.keys()))
+        azure_cls.assert_called_once_with(subscription_id='sub1',
+                                          resource_group='rg1')
+
+    def test_shard_resource_id(self):
+        shard = sharding.Shard(mock.Mock(), 'sub', 'rg', 'westus')
+        self.assertEqual(
+            '/subscriptions/sub/resourceGroups/rg/providers/'
+            'Microsoft.Compute/disks/volume-1',
+            shard.resource_id(resource_ids.DISKS, 'volume-1'))
+
+    def test_jump_hash_consistent(self):
+        keys = ['key-%d' % i for i in range(200)]
+        before = [sharding.jump_hash(k, 4) for k in keys]
+        after = [sharding.jump_hash(k, 5) for k in keys]
+        self.assertEqual(set(range(4)), set(before))
+        for old, new in zip(before, after):
+            self.assertIn(new, (old, 4))
+
+    def test_shard_group_for(self):
+        shard = sharding.Shard(mock.Mock(), 'sub', 'rg', 'westus',
+                               group_count=3)
+        self.assertEqual(['rg', 'rg-1', 'rg-2'], shard.resource_groups)
+        self.assertEqual('rg', shard.group_for())
+        group = shard.group_for('volume-1')
+        self.assertIn(group, shard.resource_groups)
+        self.assertEqual(group, shard.group_for('volume-1'))
+        self.assertEqual(
+            '/subscriptions/sub/resourceGroups/{}/providers/'
+            'Microsoft.Compute/disks/volume-1'.format(group),
+            shard.resource_id(resource_ids.DISKS, 'volume-1'))
+
+    def test_choose_shard_most_headroom(self):
+        shards = [_fake_shard('sub1', 10, 8), _fake_shard('sub2', 10, 2)]
+        self.assertIs(shards[1], sharding.choose_shard(shards, USAGE))
+
+    def test_choose_shard_less_throttled(self):
+        shards = [_fake_shard('sub1', 10, 2, throttle=5),
+                  _fake_shard('sub2', 10, 4)]
+        self.assertIs(shards[1], sharding.choose_shard(shards, USAGE))
+
+    def test_choose_shard_usage_raise(self):
+        shards = [_fake_shard('sub1', 10, 2), _fake_shard('sub2', 10, 4)]
+        shards[0].compute.usage.list.side_effect = Exception
+        self.assertIs(shards[1], sharding.choose_shard(shards, USAGE))
@@ -0,0 +1,47 @@
+import eventlet
+import mock
+
+from cinder import test
+from cinder.volume.drivers.azure import singleflight
+
+
+class SingleFlightTestCase(test.TestCase):
+
+    def setUp(self):
+        super(SingleFlightTestCase, self).setUp()
+        self.flight = singleflight.SingleFlight()
+        self.release = eventlet.event.Event()
+
+    def _slow_get(self, result):
+        self.release.wait()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def test_concurrent_calls_share_one(self):
+        func = mock.Mock(side_effect=self._slow_get)
+        threads = [eventlet.spawn(self.flight.do, 'key', func, ['vm'])
+                   for i in range(3)]
+        eventlet.sleep(0)
+        self.release.send()
+        results = [t.wait() for t in threads]
+        self.assertEqual(1, func.call_count)
+        self.assertEqual([['vm']] * 3, results)
+        # followers get copies, modify one doesn't affect others.
+        self.assertIsNot(results[0], results[1])
+
+    def test_concurrent_calls_share_exception(self):
+        func = mock.Mock(side_effect=self._slow_get)
+        threads = [eventlet.spawn(self.flight.do, 'key', func,
+                                  ValueError('miss')) for i in range(2)]
+        eventlet.sleep(0)
+        self.release.send()
+        for t in threads:
+            self.assertRaises(ValueError, t.wait)
+        self.assertEqual(1, func.call_count)
+
+    def test_sequential_calls_not_shared(self):
+        func = mock.Mock(return_value='vm')
+        self.flight.do('key', func)
+        self.flight.do('key', func)
+        self.assertEqual(2, func.call_count)
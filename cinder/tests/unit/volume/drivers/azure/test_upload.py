@@ -0,0 +1,83 @@
+import mock
+from oslo_utils import units
+import requests
+from cinder import test
+from cinder.volume.drivers.azure import retry
+from cinder.volume.drivers.azure import upload
+
+
+class PageUploaderTestCase(test.TestCase):
+
+    def setUp(self):
+        super(PageUploaderTestCase, self).setUp()
+        self.session = mock.Mock()
+        self.uploader = upload.PageUploader(
+            'https://md.blob/disk?sig=s', workers=2, range_size=1024,
+            session=self.session)
+
+    def test_iter_ranges(self):
+        ranges = list(upload.iter_ranges([b'a' * 700, b'b' * 900, b'c'],
+                                         1024))
+        self.assertEqual([0, 1024], [i[0] for i in ranges])
+        self.assertEqual(1024, len(ranges[0][1]))
+        # 577 bytes left, padded to two pages.
+        self.assertEqual(1024, len(ranges[1][1]))
+        self.assertEqual(b'c' + b'\0' * 447, ranges[1][1][576:])
+
+    def test_upload(self):
+        written = self.uploader.upload([b'x' * 2048, b'y' * 512])
+        self.assertEqual(2560, written)
+        self.assertEqual(3, self.session.put.call_count)
+        url = self.session.put.call_args[0][0]
+        self.assertEqual('https://md.blob/disk?sig=s&comp=page', url)
+        ranges = sorted(i[1]['headers']['x-ms-range']
+                        for i in self.session.put.call_args_list)
+        self.assertEqual(['bytes=0-1023', 'bytes=1024-2047',
+                          'bytes=2048-2559'], ranges)
+
+    def test_upload_failed(self):
+        self.session.put.return_value.raise_for_status.side_effect = \
+            ValueError
+        self.assertRaises(ValueError, self.uploader.upload, [b'x' * 4096])
+
+    def test_put_page_retry(self):
+        policy = mock.Mock()
+        self.uploader.retry_policy = policy
+        self.uploader.put_page(0, b'x' * 512)
+        policy.execute.assert_called_once_with(self.uploader._put, 0,
+                                               b'x' * 512)
+
+    def test_put_page_retry_connection_error(self):
+        self.uploader.retry_policy = retry.RetryPolicy(sleep=mock.Mock())
+        self.session.put.side_effect = [requests.ConnectionError('reset'),
+                                        mock.Mock()]
+        self.uploader.put_page(0, b'x' * 512)
+        self.assertEqual(2, self.session.put.call_count)
+        self.assertEqual(512, self.uploader.written)
+
+    def test_data_runs(self):
+        page = upload.PAGE_SIZE
+        data = bytearray(256 * units.Ki)
+        # data at page 1, a short gap and data at page 4, then a long gap.
+        data[page:page + 1] = b'a'
+        data[4 * page:5 * page] = b'b' * page
+        data[200 * units.Ki:200 * units.Ki + 1] = b'c'
+        runs = upload.data_runs(1024, bytes(data))
+        self.assertEqual([(1024 + page, 4 * page),
+                          (1024 + 200 * units.Ki, page)],
+                         [(i[0], len(i[1])) for i in runs])
+        self.assertEqual(b'b' * page, runs[0][1][3 * page:])
+        self.assertEqual([], upload.data_runs(0, bytes(bytearray(4096))))
+
+    def test_upload_skip_zeros(self):
+        data = b'x' * 512 + b'\0' * 1536 + b'\0' * 2048
+        self.uploader.upload([data])
+        self.assertEqual(1, self.session.put.call_count)
+        self.assertEqual('bytes=0-511', self.session.put.call_args[1][
+            'headers']['x-ms-range'])
+        self.assertEqual(3584, self.uploader.skipped)
+
+    def test_upload_keep_zeros(self):
+        self.uploader.skip_zeros = False
+        self.uploader.upload([b'\0' * 2048])
+        self.assertEqual(2, self.session.put.call_count)
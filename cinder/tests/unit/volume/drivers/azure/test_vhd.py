@@ -0,0 +1,77 @@
+import struct
+
+from oslo_utils import units
+from cinder import test
+from cinder.volume.drivers.azure import vhd
+
+
+def qcow2_image(clusters, size=4096):
+    """qcow2 of 512 bytes clusters, clusters is [(guest index, data)]."""
+    header = struct.pack(vhd.QCOW2_HEADER_FORMAT, vhd.QCOW2_MAGIC, 2, 0, 0,
+                         9, size, 0, 1, 512, 0, 0, 0, 0)
+    image = bytearray(header.ljust(512, b'\0'))
+    image += struct.pack('>Q', 1024).ljust(512, b'\0')
+    l2 = [0] * 64
+    for i, (guest, _data) in enumerate(clusters):
+        l2[guest] = 1536 + i * 512
+    image += struct.pack('>64Q', *l2)
+    for _guest, data in clusters:
+        image += data
+    return bytes(image)
+
+
+class VHDTestCase(test.TestCase):
+
+    def test_footer(self):
+        data = vhd.footer(units.Gi, clock=lambda: vhd.VHD_EPOCH + 10)
+        self.assertEqual(512, len(data))
+        fields = struct.unpack(vhd.FOOTER_FORMAT, data)
+        self.assertEqual(b'conectix', fields[0])
+        self.assertEqual(10, fields[4])
+        self.assertEqual((units.Gi, units.Gi), fields[8:10])
+        self.assertEqual((2080, 16, 63), fields[10:13])
+        self.assertEqual(vhd.FIXED_DISK, fields[13])
+        zeroed = data[:64] + b'\0' * 4 + data[68:]
+        self.assertEqual(~sum(bytearray(zeroed)) & 0xffffffff, fields[14])
+
+    def test_raw(self):
+        size, stream = vhd.to_fixed_vhd('raw', [b'a' * 1000, b'b' * 24], 1024)
+        data = b''.join(stream)
+        self.assertEqual(units.Mi + 512, size)
+        self.assertEqual(size, len(data))
+        self.assertEqual(b'a' * 1000 + b'b' * 24, data[:1024])
+        self.assertEqual(b'conectix', data[units.Mi:units.Mi + 8])
+
+    def test_raw_short(self):
+        _size, stream = vhd.to_fixed_vhd('raw', [b'a' * 10], 1024)
+        self.assertRaises(vhd.ConvertError, b''.join, stream)
+
+    def test_vhd(self):
+        self.assertEqual(units.Mi + 512,
+                         vhd.to_fixed_vhd('vhd', [], units.Mi + 512)[0])
+        self.assertRaises(vhd.ConvertError, vhd.to_fixed_vhd, 'vhd', [],
+                          units.Mi)
+        self.assertRaises(vhd.ConvertError, vhd.to_fixed_vhd, 'vmdk', [],
+                          units.Mi)
+
+    def test_qcow2(self):
+        image = qcow2_image([(1, b'a' * 512), (3, b'b' * 512)])
+        # stream in odd chunks, tables and clusters span them.
+        chunks = [image[i:i + 700] for i in range(0, len(image), 700)]
+        size, stream = vhd.to_fixed_vhd('qcow2', chunks)
+        data = b''.join(stream)
+        self.assertEqual(units.Mi + 512, size)
+        self.assertEqual(size, len(data))
+        self.assertEqual(b'\0' * 512 + b'a' * 512 + b'\0' * 512 +
+                         b'b' * 512 + b'\0' * 2048, data[:4096])
+        self.assertEqual(b'\0' * (units.Mi - 4096), data[4096:units.Mi])
+        self.assertEqual(b'conectix', data[units.Mi:units.Mi + 8])
+
+    def test_qcow2_not_in_guest_order(self):
+        image = qcow2_image([(3, b'b' * 512), (1, b'a' * 512)])
+        _size, stream = vhd.to_fixed_vhd('qcow2', [image])
+        self.assertRaises(vhd.ConvertError, b''.join, stream)
+
+    def test_qcow2_invalid(self):
+        self.assertRaises(vhd.ConvertError, vhd.to_fixed_vhd, 'qcow2',
+                          [b'\0' * 512])
@@ -11,17 +11,30 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+
 import six
 from azure.mgmt.compute import ComputeManagementClient
 from azure.mgmt.resource import ResourceManagementClient
 from azure.common.credentials import UserPassCredentials
+from msrest.pipeline import ClientRawResponse
+from msrestazure.azure_exceptions import CloudError
 from cinder import exception
 from cinder.i18n import _LI
+from cinder.volume.drivers.azure import breaker
+from cinder.volume.drivers.azure import journal
+from cinder.volume.drivers.azure import lro
+from cinder.volume.drivers.azure import offload
+from cinder.volume.drivers.azure import retry
+from cinder.volume.drivers.azure import sharding
+from cinder.volume.drivers.azure import singleflight
 from oslo_config import cfg
 from oslo_log import log as logging
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
+# model name of raw request result, the json body.
+JSON_MODEL = 'json'
 
 volume_opts = [
     cfg.StrOpt('location',
@@ -35,31 +48,252 @@ volume_opts = [
     cfg.StrOpt('username',
                help='Auzre username of subscription'),
     cfg.StrOpt('password',
-               help='Auzre password of user of subscription')
+               help='Auzre password of user of subscription'),
+    cfg.IntOpt('retry_max_attempts',
+               default=4,
+               help='Max attempts of an Azure api call on throttling or '
+                    'server side errors, include the first attempt.'),
+    cfg.FloatOpt('retry_base_delay',
+                 default=1.0,
+                 help='Min delay in seconds between retries of Azure api.'),
+    cfg.FloatOpt('retry_max_delay',
+                 default=30.0,
+                 help='Max delay in seconds between retries of Azure api, '
+                      'unless Azure asks for longer with Retry-After.'),
+    cfg.IntOpt('retry_deadline',
+               default=120,
+               help='Seconds an Azure api call may spend on retries.'),
+    cfg.FloatOpt('retry_budget_ratio',
+                 default=0.1,
+                 help='Retries allowed per Azure api call across the service,'
+                      ' avoid retry storm during Azure incident.'),
+    cfg.FloatOpt('breaker_error_rate',
+                 default=0.5,
+                 help='Error rate of Azure api calls to open the circuit, '
+                      'then calls fail fast instead of waiting timeout.'),
+    cfg.IntOpt('breaker_min_calls',
+               default=10,
+               help='Min calls in window before circuit can be opened.'),
+    cfg.IntOpt('breaker_window',
+               default=60,
+               help='Window in seconds to calculate error rate.'),
+    cfg.IntOpt('breaker_cooldown',
+               default=30,
+               help='Seconds an open circuit fail fast before probing Azure'
+                    ' again.'),
+    cfg.ListOpt('subscriptions',
+                default=[],
+                help='Extra subscriptions to place volumes in, items are '
+                     'subscription_id:resource_group. New volume placed by '
+                     'remaining disk count quota and throttling.'),
+    cfg.IntOpt('resource_group_count',
+               default=1,
+               min=1,
+               help='Resource groups to spread disks of each subscription '
+                    'over, chosen by consistent hash of disk name. Groups '
+                    'are resource_group and resource_group-1 to -N-1. '
+                    'Existing resources are not moved, set it before use.'),
+    cfg.IntOpt('usage_cache_ttl',
+               default=60,
+               help='Seconds to cache compute usage of subscription.'),
+    cfg.IntOpt('sdk_thread_pool_size',
+               default=20,
+               help='Max Azure sdk calls run in native threads at the same '
+                    'time.'),
+    cfg.FloatOpt('lro_min_poll_interval',
+                 default=1.0,
+                 help='Seconds before first poll of long running operation, '
+                      'doubled every poll, Retry-After from Azure overrides '
+                      'it.'),
+    cfg.FloatOpt('lro_max_poll_interval',
+                 default=30.0,
+                 help='Max seconds between polls of long running '
+                      'operation.'),
+    cfg.IntOpt('lro_poll_concurrency',
+               default=10,
+               help='Max long running operations polled at the same time.'),
+    cfg.StrOpt('operation_journal',
+               default='$state_path/azure_operations.sqlite',
+               help='Sqlite file of Azure operations in flight, resumed '
+                    'after service restart instead of sent again. Empty '
+                    'disables it.')
 ]
 
 CONF.register_opts(volume_opts, 'azure')
 
 
+class OperationsProxy(object):
+    """Invoke methods of an sdk operations group through invoker.
+
+    invoker is called as invoker(group_name, method_name, func, *args,
+    **kwargs), where retry and circuit breaker are applied.
+    """
+
+    def __init__(self, name, operations, invoker):
+        self._name = name
+        self._operations = operations
+        self._invoker = invoker
+
+    def __getattr__(self, attr):
+        func = getattr(self._operations, attr)
+        if attr.startswith('_') or not callable(func):
+            return func
+
+        def _invoke(*args, **kwargs):
+            return self._invoker(self._name, attr, func, *args, **kwargs)
+        return _invoke
+
+
+class ClientProxy(object):
+    """Wrap operations groups(disks, snapshots...) of sdk client."""
+
+    def __init__(self, client, invoker):
+        self._mgmt_client = client
+        self._invoker = invoker
+        self._groups = {}
+
+    def __getattr__(self, attr):
+        value = getattr(self._mgmt_client, attr)
+        # only operations group has serializer, leave config etc. alone.
+        if attr.startswith('_') or not hasattr(value, '_serialize'):
+            return value
+        if attr not in self._groups:
+            self._groups[attr] = OperationsProxy(attr, value, self._invoker)
+        return self._groups[attr]
+
+
 class Azure(object):
-    def __init__(self, username=CONF.azure.username,
-                 password=CONF.azure.password,
-                 subscription_id=CONF.azure.subscription_id,
-                 resource_group=CONF.azure.resource_group,
-                 location=CONF.azure.location):
+    def __init__(self, username=None, password=None, subscription_id=None,
+                 resource_group=None, location=None):
+        # resolve defaults at runtime, config is not parsed at import time.
+        username = username or CONF.azure.username
+        password = password or CONF.azure.password
+        subscription_id = subscription_id or CONF.azure.subscription_id
+        resource_group = resource_group or CONF.azure.resource_group
+        location = location or CONF.azure.location
 
         credentials = UserPassCredentials(username, password)
         LOG.info(_LI('Login with Azure username and password.'))
-        self.compute = ComputeManagementClient(credentials,
-                                               subscription_id)
-        self.resource = ResourceManagementClient(credentials,
-                                                 subscription_id)
+        self.retry_policy = retry.RetryPolicy.from_conf(CONF)
+        self.breakers = breaker.BreakerRegistry.from_conf(CONF)
+        self.inflight = singleflight.SingleFlight()
+        self.subscription_id = subscription_id
+        self.lro = lro.get_engine(CONF)
+        self.journal = journal.get_journal(CONF)
+        self.pool = offload.NativePool(CONF.azure.sdk_thread_pool_size,
+                                       None)
+        self.compute = ClientProxy(
+            ComputeManagementClient(credentials, subscription_id),
+            self._invoke)
+        self.resource = ClientProxy(
+            ResourceManagementClient(credentials, subscription_id),
+            self._invoke)
         try:
-            self.resource.resource_groups.create_or_update(
-                CONF.azure.resource_group, {'location': location})
+            for group in sharding.group_names(
+                    resource_group, CONF.azure.resource_group_count):
+                self.resource.resource_groups.create_or_update(
+                    group, {'location': location})
             LOG.info(_LI("Create/Update Resource Group"))
         except Exception as e:
             msg = six.text_type(e)
             ex = exception.VolumeBackendAPIException(reason=msg)
             LOG.exception(msg)
             raise ex
+
+    def _invoke(self, endpoint, method, func, *args, **kwargs):
+        # concurrent get of same resource share one http call, raw response
+        # carries headers and is not shared.
+        if method == 'get' and not kwargs.get('raw'):
+            key = (endpoint, method) + args + tuple(sorted(kwargs.items()))
+            return self.inflight.do(key, self._call, endpoint, method, func,
+                                    *args, **kwargs)
+        return self._call(endpoint, method, func, *args, **kwargs)
+
+    def _call(self, endpoint, method, func, *args, **kwargs):
+        long_running = (lro.is_long_running(endpoint, method) and
+                        'raw' not in kwargs)
+        if long_running:
+            key = journal.make_key(self.subscription_id, endpoint, method,
+                                   args, kwargs)
+            entry = self.journal.find(key)
+            if entry:
+                LOG.info(_LI('Resume operation %s submitted before.'), key)
+                operations = func.__self__
+                return self._track(key, self.lro.resume(
+                    get=functools.partial(self._get_url,
+                                          operations._client),
+                    deserialize=operations._deserialize, **entry))
+
+        # resumed operation above sends nothing, breaker is not involved.
+        circuit = self.breakers.get(endpoint, breaker.get_op_class(method))
+        if not circuit.allow():
+            raise breaker.CircuitOpen(
+                circuit=circuit.name, retry_after=circuit.retry_after())
+        if long_running:
+            # started here, polled by the shared lro engine.
+            kwargs['raw'] = True
+
+        def _sdk_call():
+            return self.pool.execute(func, *args, **kwargs)
+        _sdk_call.__name__ = '{}.{}'.format(endpoint, method)
+
+        try:
+            result = self.retry_policy.execute(_sdk_call)
+        except Exception as e:
+            # not found or bad request means Azure is healthy.
+            circuit.record(not retry.is_transient(e))
+            raise
+        circuit.record(True)
+        if long_running:
+            operations = func.__self__
+            return self._track(key, self.lro.submit(
+                _sdk_call.__name__, result,
+                functools.partial(self._get_url, operations._client),
+                operations._deserialize))
+        return result
+
+    def _track(self, key, op):
+        """Journal operation until it is finished."""
+        if not op.done():
+            self.journal.record(key, op)
+            # a later operation of same key may have replaced the record.
+            op.add_done_callback(
+                lambda op: self.journal.remove(key, op.status_url))
+        return op
+
+    def request(self, endpoint, method, resource_id, api_version, body=None,
+                headers=None):
+        """Send a raw ARM request and return lro future of it.
+
+        for api newer than the pinned sdk, e.g. incremental snapshot.
+        retry, circuit breaker and native thread pool apply like sdk calls.
+        result of the future is the json body of final response.
+        """
+        client = self.compute._client
+        response = self._call(endpoint, method.lower(), self._send, client,
+                              method, resource_id, api_version, body,
+                              headers)
+        return self.lro.submit('{}.{}'.format(endpoint, method.lower()),
+                               ClientRawResponse(None, response),
+                               functools.partial(self._get_url, client),
+                               self._json, JSON_MODEL)
+
+    @staticmethod
+    def _send(client, method, resource_id, api_version, body=None,
+              headers=None):
+        request = getattr(client, method.lower())(
+            resource_id, {'api-version': api_version})
+        headers = dict(headers or {})
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        response = client.send(request, headers, body)
+        if response.status_code >= 400:
+            raise CloudError(response)
+        return response
+
+    @staticmethod
+    def _json(model, response):
+        return response.json()
+
+    def _get_url(self, client, url):
+        """GET operation status url with client of the operations group."""
+        return self.pool.execute(client.send, client.get(url))
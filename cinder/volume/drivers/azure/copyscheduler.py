@@ -0,0 +1,83 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import itertools
+import threading
+import time
+
+# waits kept to report wait time.
+RECENT_WAITS = 100
+
+
+class CopyScheduler(object):
+    """Queue disk copies, limit running ones per source and in total.
+
+    a queued copy starts when its source runs less than max_per_source
+    copies and all sources run less than max_total. among copies can start,
+    smallest size goes first, then the earliest queued.
+    """
+
+    def __init__(self, max_total=10, max_per_source=2, clock=time.time):
+        self.max_total = max_total
+        self.max_per_source = max_per_source
+        self._clock = clock
+        self._counter = itertools.count()
+        self._waiting = []
+        self._running = collections.defaultdict(int)
+        self._total = 0
+        self._waits = collections.deque(maxlen=RECENT_WAITS)
+        self._cond = threading.Condition()
+
+    def _can_start(self, source):
+        return (self._total < self.max_total and
+                self._running.get(source, 0) < self.max_per_source)
+
+    def _next(self):
+        for ticket in sorted(self._waiting):
+            if self._can_start(ticket[2]):
+                return ticket
+        return None
+
+    def run(self, source, size, func, *args, **kwargs):
+        """Run func(*args, **kwargs) as a copy of size GB from source."""
+        queued_at = self._clock()
+        ticket = (size or 0, next(self._counter), source)
+        with self._cond:
+            self._waiting.append(ticket)
+            while self._next() is not ticket:
+                self._cond.wait()
+            self._waiting.remove(ticket)
+            self._running[source] += 1
+            self._total += 1
+            self._waits.append(self._clock() - queued_at)
+            # another copy of other source may start too.
+            self._cond.notify_all()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._cond:
+                self._running[source] -= 1
+                if not self._running[source]:
+                    del self._running[source]
+                self._total -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        """Queue depth, running copies and recent wait seconds."""
+        with self._cond:
+            waits = list(self._waits)
+            return {'queue_depth': len(self._waiting),
+                    'running': self._total,
+                    'avg_wait': sum(waits) / len(waits) if waits else 0,
+                    'max_wait': max(waits) if waits else 0}
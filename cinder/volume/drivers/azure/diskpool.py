@@ -0,0 +1,78 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+import time
+
+
+class DiskPool(object):
+    """Free empty disks created ahead, claimed by create_volume.
+
+    pools are keyed by (shard name, sku, size_gb), only sizes given are
+    pooled. every claim is counted as a request of its key, hit or miss,
+    and a pool is refilled up to the requests of its key in last window
+    seconds, at most max_free disks. free disks above max_free or of
+    sizes no longer pooled are surplus, to be deleted.
+    """
+
+    def __init__(self, sizes, max_free=20, window=600, clock=time.time):
+        self.sizes = frozenset(sizes)
+        self.max_free = max_free
+        self.window = window
+        self._clock = clock
+        self._free = collections.defaultdict(collections.deque)
+        self._requests = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """Take a free disk name of key, None if pool is empty."""
+        if key[2] not in self.sizes:
+            return None
+        with self._lock:
+            self._requests[key].append(self._clock())
+            free = self._free[key]
+            return free.popleft() if free else None
+
+    def add(self, key, name):
+        with self._lock:
+            self._free[key].append(name)
+
+    def free(self, key):
+        with self._lock:
+            return len(self._free[key])
+
+    def deficits(self):
+        """Return {key: disks to create} to meet recent request rate."""
+        since = self._clock() - self.window
+        deficits = {}
+        with self._lock:
+            for key, requests in self._requests.items():
+                while requests and requests[0] < since:
+                    requests.popleft()
+                target = min(self.max_free, len(requests))
+                missing = target - len(self._free[key])
+                if missing > 0:
+                    deficits[key] = missing
+        return deficits
+
+    def surpluses(self):
+        """Take out and return {key: [free disk names]} to delete."""
+        surpluses = {}
+        with self._lock:
+            for key, free in self._free.items():
+                target = self.max_free if key[2] in self.sizes else 0
+                if len(free) > target:
+                    surpluses[key] = [free.pop()
+                                      for _i in range(len(free) - target)]
+        return surpluses
@@ -0,0 +1,196 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+
+from azure.mgmt.compute.models import DiskCreateOption
+from azure.mgmt.compute.models import StorageAccountTypes
+from cinder import exception
+from cinder.i18n import _
+from cinder.volume.drivers.azure import resource_ids
+from cinder.volume import volume_types
+
+# volume type extra specs of disk. sku is unscoped, so CapabilitiesFilter
+# matches it to azure_sku of pools and places volume in pool of its sku.
+SKU_SPEC = 'azure_sku'
+IOPS_SPEC = 'azure:disk_iops'
+MBPS_SPEC = 'azure:disk_mbps'
+ZONE_SPEC = 'azure:zone'
+TIER_SPEC = 'azure:tier'
+# volume type made ssd disks before extra specs.
+SSD_TYPE = 'azure_ssd'
+STANDARD_LRS = StorageAccountTypes.standard_lrs.value
+PREMIUM_LRS = StorageAccountTypes.premium_lrs.value
+PREMIUM_V2_LRS = 'PremiumV2_LRS'
+ULTRA_SSD_LRS = 'UltraSSD_LRS'
+SKUS = (STANDARD_LRS, PREMIUM_LRS, 'StandardSSD_LRS', PREMIUM_V2_LRS,
+        ULTRA_SSD_LRS)
+# skus a disk can't be changed from or to in place.
+FIXED_SKUS = (PREMIUM_V2_LRS, ULTRA_SSD_LRS)
+# first api version with all skus above.
+DISK_API_VERSION = '2022-07-02'
+
+
+class DiskSpec(collections.namedtuple('DiskSpec',
+                                      'sku iops mbps zone tier')):
+    """Sku and provisioned performance of disks of a volume type."""
+    __slots__ = ()
+
+    def __new__(cls, sku, iops=None, mbps=None, zone=None, tier=None):
+        return super(DiskSpec, cls).__new__(cls, sku, iops, mbps, zone, tier)
+
+    @property
+    def native(self):
+        """SDK knows the sku and has no performance fields."""
+        return (self.sku in (STANDARD_LRS, PREMIUM_LRS) and
+                not (self.iops or self.mbps or self.zone or self.tier))
+
+
+def _int_spec(specs, key, type_name):
+    value = specs.get(key)
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise exception.InvalidVolumeType(
+            reason=_("%(key)s of volume type %(type)s must be a positive "
+                     "integer.") % dict(key=key, type=type_name))
+    return value
+
+
+def parse_specs(type_name, specs):
+    """DiskSpec of volume type from its name and extra specs.
+
+    types without azure_sku keep the sku chosen by name, Premium_LRS for
+    azure_ssd and Standard_LRS for others.
+    """
+    specs = specs or {}
+    sku = specs.get(SKU_SPEC)
+    if not sku:
+        sku = PREMIUM_LRS if type_name == SSD_TYPE else STANDARD_LRS
+    elif sku not in SKUS:
+        raise exception.InvalidVolumeType(
+            reason=_("%(key)s %(sku)s of volume type %(type)s is not one of "
+                     "%(skus)s.") % dict(key=SKU_SPEC, sku=sku,
+                                         type=type_name,
+                                         skus=', '.join(SKUS)))
+    return DiskSpec(sku, _int_spec(specs, IOPS_SPEC, type_name),
+                    _int_spec(specs, MBPS_SPEC, type_name),
+                    specs.get(ZONE_SPEC) or None,
+                    specs.get(TIER_SPEC) or None)
+
+
+class DiskTypes(object):
+    """DiskSpec of volume types, extra specs are read once per type."""
+
+    def __init__(self, get_specs=volume_types.get_volume_type_extra_specs):
+        self._get_specs = get_specs
+        self._specs = {}
+        self._lock = threading.Lock()
+
+    def get(self, volume_type):
+        """DiskSpec of volume type object or dict, None is no type."""
+        if not volume_type:
+            return parse_specs(None, None)
+        type_id = volume_type['id']
+        with self._lock:
+            spec = self._specs.get(type_id)
+        if spec is None:
+            spec = parse_specs(volume_type['name'],
+                               self._get_specs(type_id))
+            with self._lock:
+                self._specs[type_id] = spec
+        return spec
+
+
+def create_disk(shard, disk_name, spec, size=None, source_id=None,
+                tags=None, upload_size=None):
+    """Send creation of disk of spec, empty or copied from source_id.
+
+    disk of upload_size bytes is created to be uploaded to. disks the SDK
+    can express are created by it, others by REST with a newer api
+    version. return the long running operation.
+    """
+    if spec.native and not upload_size:
+        creation_data = {'create_option': DiskCreateOption.empty}
+        if source_id:
+            creation_data = {'create_option': DiskCreateOption.copy,
+                             'source_uri': source_id}
+        disk_dict = {
+            'location': shard.location,
+            'account_type': spec.sku,
+            'creation_data': creation_data
+        }
+        if size:
+            disk_dict['disk_size_gb'] = size
+        if tags:
+            disk_dict['tags'] = tags
+        return shard.disks.create_or_update(shard.group_for(disk_name),
+                                            disk_name, disk_dict)
+    creation_data = {'createOption': 'Empty'}
+    if source_id:
+        creation_data = {'createOption': 'Copy',
+                         'sourceResourceId': source_id}
+    elif upload_size:
+        creation_data = {'createOption': 'Upload',
+                         'uploadSizeBytes': upload_size}
+    properties = {'creationData': creation_data}
+    if size:
+        properties['diskSizeGB'] = size
+    if spec.iops:
+        properties['diskIOPSReadWrite'] = spec.iops
+    if spec.mbps:
+        properties['diskMBpsReadWrite'] = spec.mbps
+    if spec.tier:
+        properties['tier'] = spec.tier
+    body = {
+        'location': shard.location,
+        'sku': {'name': spec.sku},
+        'properties': properties
+    }
+    if spec.zone:
+        body['zones'] = [spec.zone]
+    if tags:
+        body['tags'] = tags
+    return shard.azure.request(
+        'disks', 'PUT', shard.resource_id(resource_ids.DISKS, disk_name),
+        DISK_API_VERSION, body)
+
+
+def update_body(old, new):
+    """PATCH body to change disk of spec old to spec new in place.
+
+    only changed properties are sent, empty body is nothing to change.
+    None if Azure can't change it in place, e.g. zone or ultra sku change.
+    """
+    if old.zone != new.zone:
+        return None
+    body = {}
+    if old.sku != new.sku:
+        if old.sku in FIXED_SKUS or new.sku in FIXED_SKUS:
+            return None
+        body['sku'] = {'name': new.sku}
+    properties = {}
+    for field, name in (('iops', 'diskIOPSReadWrite'),
+                        ('mbps', 'diskMBpsReadWrite'),
+                        ('tier', 'tier')):
+        value = getattr(new, field)
+        if value and value != getattr(old, field):
+            properties[name] = value
+    if properties:
+        body['properties'] = properties
+    return body
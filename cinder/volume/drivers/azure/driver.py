@@ -11,25 +11,79 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_service import loopingcall
+from oslo_utils import units
+from oslo_utils import uuidutils
 import six
 from azure.common import AzureMissingResourceHttpError
 from azure.mgmt.compute.models import DiskCreateOption
-from azure.mgmt.compute.models import StorageAccountTypes
+from cinder import context as cinder_context
 from cinder import exception
 from cinder.i18n import _, _LE, _LI, _LW
 from cinder.image import image_utils
+from cinder.objects import fields
 from cinder.volume import driver
 from cinder.volume.drivers.azure.adapter import Azure
 from cinder.volume.drivers.azure.adapter import volume_opts as ad_opts
+from cinder.volume.drivers.azure import copyscheduler
+from cinder.volume.drivers.azure import diskpool
+from cinder.volume.drivers.azure import disktype
+from cinder.volume.drivers.azure import ledger
+from cinder.volume.drivers.azure import resource_ids
+from cinder.volume.drivers.azure import sharding
+from cinder.volume.drivers.azure import upload
+from cinder.volume.drivers.azure import vhd
 
 LOG = logging.getLogger(__name__)
 
 volume_opts = [
     cfg.IntOpt('azure_total_capacity_gb',
-               help='Total capacity in Azuer, in GB',
-               default=500000)
+               help='Total capacity of disks in Azure, in GB, shared by '
+                    'pools of all disk skus. Volume types choose pool of '
+                    'a sku by extra spec azure_sku, e.g. Premium_LRS.',
+               default=500000),
+    cfg.IntOpt('capacity_reconcile_interval',
+               default=3600,
+               help='Seconds between full listings of disks to correct '
+                    'allocated capacity, which is tracked incrementally.'),
+    cfg.ListOpt('disk_pool_sizes',
+                default=[],
+                help='Volume sizes in GB to keep empty disks created ahead '
+                     'for, per sku. Empty disables the disk pool.'),
+    cfg.IntOpt('disk_pool_max',
+               default=20,
+               help='Max free disks of each sku and size in disk pool.'),
+    cfg.IntOpt('disk_pool_window',
+               default=600,
+               help='Seconds of recent volume creations a pool is sized '
+                    'by, a pool keeps as many free disks as requests in '
+                    'this window.'),
+    cfg.IntOpt('disk_pool_refill_interval',
+               default=30,
+               help='Seconds between refills of disk pool.'),
+    cfg.IntOpt('copy_max_concurrency',
+               default=10,
+               help='Max disk copies run at the same time, others are '
+                    'queued, small volumes first.'),
+    cfg.IntOpt('copy_max_per_source',
+               default=2,
+               help='Max disk copies from the same source disk, snapshot '
+                    'or image disk run at the same time.'),
+    cfg.IntOpt('upload_workers',
+               default=8,
+               help='Page ranges written at the same time when uploading an '
+                    'image to a volume, each buffers up to 4 MB.'),
+    cfg.IntOpt('upload_sas_duration',
+               default=86400,
+               help='Seconds the write access to a disk uploaded to is '
+                    'granted for.'),
+    cfg.BoolOpt('upload_skip_zeros',
+                default=True,
+                help='Skip all zero pages when uploading an image to a '
+                     'volume, new disks read zeros there already.')
 ]
 
 CONF = cfg.CONF
@@ -38,6 +92,15 @@ VHD_EXT = 'vhd'
 IMAGE_PREFIX = 'image'
 SNAPSHOT_PREFIX = 'snapshot'
 VOLUME_PREFIX = 'volume'
+POOL_PREFIX = 'pool'
+TMP_PREFIX = 'tmp'
+# tag of free disks in disk pool, and of volume claimed a pool disk.
+POOL_TAG = 'cinder_pool'
+VOLUME_TAG = 'cinder_volume'
+# first api version with incremental snapshot.
+SNAPSHOT_API_VERSION = '2019-03-01'
+# disk skus reported as pools.
+POOL_SKUS = disktype.SKUS
 
 
 class AzureDriver(driver.VolumeDriver):
@@ -55,11 +118,155 @@ class AzureDriver(driver.VolumeDriver):
             self.disks = self.azure.compute.disks
             self.snapshots = self.azure.compute.snapshots
             self.images = self.azure.compute.images
+            self.shards = sharding.build_shards(self.azure, Azure, CONF)
+            self.default_shard = list(self.shards.values())[0]
         except Exception as e:
             message = (_("Initialize Azure Adapter failed. reason: %s")
                        % six.text_type(e))
             LOG.exception(message)
             raise exception.VolumeBackendAPIException(data=message)
+        self.ledger = ledger.CapacityLedger()
+        self.disk_types = disktype.DiskTypes()
+        self.reconcile_timer = None
+        self.disk_pool = diskpool.DiskPool(
+            [int(i) for i in CONF.azure.disk_pool_sizes],
+            CONF.azure.disk_pool_max, CONF.azure.disk_pool_window)
+        self.pool_timer = None
+        self._pool_loaded = False
+        self.copy_scheduler = copyscheduler.CopyScheduler(
+            CONF.azure.copy_max_concurrency, CONF.azure.copy_max_per_source)
+
+    def do_setup(self, context):
+        # allocated capacity is tracked by ledger, full listing only here.
+        self.reconcile_timer = loopingcall.FixedIntervalLoopingCall(
+            self._reconcile_capacity)
+        self.reconcile_timer.start(
+            interval=CONF.azure.capacity_reconcile_interval)
+        # runs without pooled sizes too, to delete disks pooled before.
+        self.pool_timer = loopingcall.FixedIntervalLoopingCall(
+            self._refill_disk_pool)
+        self.pool_timer.start(interval=CONF.azure.disk_pool_refill_interval)
+
+    def _list_disks(self):
+        """(shard, disk) of all groups, raise if any listing failed."""
+        for shard in self.shards.values():
+            for group in shard.resource_groups:
+                for disk in shard.disks.list_by_resource_group(group):
+                    yield shard, disk
+
+    def _reconcile_capacity(self):
+        """Rebuild capacity ledger by listing volume disks of all groups."""
+        prefix = VOLUME_PREFIX + '-'
+        try:
+            disks = [(i.name, i.account_type, i.disk_size_gb)
+                     for _shard, i in self._list_disks()
+                     if i.name.startswith(prefix) or
+                     VOLUME_TAG in (i.tags or {})]
+        except Exception as e:
+            LOG.warning(_LW("Unable to list disks, keep capacity ledger. "
+                            "reason: %s"), six.text_type(e))
+            return
+        self.ledger.reconcile(disks)
+
+    def _load_disk_pool(self):
+        """Put free pool disks created by last service run back in pool."""
+        for shard, disk in self._list_disks():
+            if (disk.tags or {}).get(POOL_TAG) == 'free':
+                key = (shard.name, ledger.sku_name(disk.account_type),
+                       disk.disk_size_gb)
+                self.disk_pool.add(key, disk.name)
+        self._pool_loaded = True
+
+    def _refill_disk_pool(self):
+        """Create free disks of pools below recent request rate.
+
+        free disks above disk_pool_max or of sizes no longer in
+        disk_pool_sizes are deleted.
+        """
+        try:
+            if not self._pool_loaded:
+                self._load_disk_pool()
+        except Exception as e:
+            LOG.warning(_LW("Unable to load disk pool, retry next refill. "
+                            "reason: %s"), six.text_type(e))
+            return
+        self._shrink_disk_pool()
+        for key, count in self.disk_pool.deficits().items():
+            shard_name, azure_type, size = key
+            shard = self.shards.get(shard_name, self.default_shard)
+            spec = disktype.DiskSpec(azure_type)
+            # send all creations first, Azure runs them in parallel.
+            pending = []
+            for _i in range(count):
+                disk_name = self._get_name_from_id(
+                    POOL_PREFIX, uuidutils.generate_uuid())
+                try:
+                    pending.append((disk_name, disktype.create_disk(
+                        shard, disk_name, spec, size,
+                        tags={POOL_TAG: 'free'})))
+                except Exception as e:
+                    LOG.warning(_LW("Unable to create pool disk %(disk)s. "
+                                    "reason: %(reason)s"),
+                                dict(disk=disk_name,
+                                     reason=six.text_type(e)))
+                    break
+            for disk_name, async_action in pending:
+                try:
+                    async_action.result()
+                except Exception as e:
+                    LOG.warning(_LW("Unable to create pool disk %(disk)s. "
+                                    "reason: %(reason)s"),
+                                dict(disk=disk_name,
+                                     reason=six.text_type(e)))
+                else:
+                    self.disk_pool.add(key, disk_name)
+
+    def _shrink_disk_pool(self):
+        """Delete surplus free disks, ones failed are kept for next refill."""
+        def _keep(key, disk_name, e):
+            LOG.warning(_LW("Unable to delete pool disk %(disk)s. reason: "
+                            "%(reason)s"),
+                        dict(disk=disk_name, reason=six.text_type(e)))
+            self.disk_pool.add(key, disk_name)
+
+        # send all deletions first, Azure runs them in parallel.
+        pending = []
+        for key, names in self.disk_pool.surpluses().items():
+            shard = self.shards.get(key[0], self.default_shard)
+            for disk_name in names:
+                try:
+                    pending.append((key, disk_name, shard.disks.delete(
+                        shard.group_for(disk_name), disk_name)))
+                except Exception as e:
+                    _keep(key, disk_name, e)
+        for key, disk_name, async_action in pending:
+            try:
+                async_action.result()
+            except Exception as e:
+                _keep(key, disk_name, e)
+            else:
+                LOG.info(_LI("Deleted surplus pool disk %s."), disk_name)
+
+    def _claim_pool_disk(self, shard, azure_type, volume):
+        """Claim a free pool disk for volume by tagging it, None if miss."""
+        key = (shard.name, ledger.sku_name(azure_type), volume.size)
+        disk_name = self.disk_pool.claim(key)
+        if disk_name is None:
+            return None
+        try:
+            async_action = shard.disks.update(
+                shard.group_for(disk_name), disk_name,
+                {'tags': {VOLUME_TAG: volume.id}})
+            async_action.result()
+        except Exception as e:
+            # still tagged free, back to pool after service restart.
+            LOG.warning(_LW("Unable to claim pool disk %(disk)s. reason: "
+                            "%(reason)s"),
+                        dict(disk=disk_name, reason=six.text_type(e)))
+            return None
+        LOG.info(_LI('Claimed pool disk %(disk)s for volume %(volume)s.'),
+                 dict(disk=disk_name, volume=volume.id))
+        return disk_name
 
     def check_for_setup_error(self):
         pass
@@ -70,78 +277,137 @@ class AzureDriver(driver.VolumeDriver):
         :param refresh: Whether to get refreshed information
         """
 
-        if not self._stats or refresh:
-            backend_name = self.configuration.safe_get('volume_backend_name')
-            if not backend_name:
-                backend_name = self.__class__.__name__
-            # TODO(haifeng) free capacity need to refresh
-            data = {'volume_backend_name': backend_name,
-                    'vendor_name': 'Azure',
-                    'driver_version': self.VERSION,
-                    'storage_protocol': 'vhd',
-                    'reserved_percentage': 0,
-                    'total_capacity_gb':
-                        CONF.azure.azure_total_capacity_gb,
-                    'free_capacity_gb':
-                        CONF.azure.azure_total_capacity_gb}
-            self._stats = data
+        # capacity is from ledger, cheap to build on every call.
+        backend_name = self.configuration.safe_get('volume_backend_name')
+        if not backend_name:
+            backend_name = self.__class__.__name__
+        # pools share one total, free of each is what all skus left.
+        total = CONF.azure.azure_total_capacity_gb
+        allocated = self.ledger.allocated()
+        free = max(total - sum(allocated.values()), 0)
+        pools = []
+        for sku in POOL_SKUS:
+            name = ledger.sku_name(sku)
+            used = allocated.get(name, 0)
+            pools.append({'pool_name': name,
+                          'azure_sku': name,
+                          'total_capacity_gb': total,
+                          'free_capacity_gb': free,
+                          'allocated_capacity_gb': used,
+                          'provisioned_capacity_gb': used,
+                          'reserved_percentage': 0,
+                          # group snapshots are concurrent, not crash
+                          # consistent across member disks.
+                          'consistent_group_snapshot_enabled': False,
+                          'QoS_support': False})
+        copies = self.copy_scheduler.stats()
+        data = {'volume_backend_name': backend_name,
+                'vendor_name': 'Azure',
+                'driver_version': self.VERSION,
+                'storage_protocol': 'vhd',
+                'reserved_percentage': 0,
+                'total_capacity_gb': total,
+                'free_capacity_gb': free,
+                'copy_queue_depth': copies['queue_depth'],
+                'copy_wait_seconds': copies['avg_wait'],
+                'pools': pools}
+        self._stats = data
         return self._stats
 
+    def get_pool(self, volume):
+        """Pool of volume is its disk sku, azure_sku extra spec of type."""
+        return self.disk_types.get(volume.volume_type).sku
+
     def _get_name_from_id(self, prefix, resource_id):
         return '{}-{}'.format(prefix, resource_id)
 
-    def _copy_disk(self, disk_name, source_id, azure_type, size=None):
-        disk_dict = {
-            'location': CONF.azure.location,
-            'account_type': azure_type,
+    def _get_disk_name(self, volume, volume_id=None):
+        """Disk of volume, name of pool disk claimed is in provider_id."""
+        provider_id = volume.get('provider_id') if volume else None
+        return provider_id or self._get_name_from_id(
+            VOLUME_PREFIX, volume_id or volume['id'])
+
+    def _get_shard(self, resource):
+        """Get shard of volume or snapshot from its provider_location."""
+        name = resource.get('provider_location') if resource else None
+        return self.shards.get(name, self.default_shard)
+
+    def _place_volume(self, volume, sku):
+        """Choose shard for new volume by disk count quota.
+
+        skus without disk count quota are placed in the default shard.
+        """
+        usage_name = sharding.DISK_COUNT_USAGE.get(sku)
+        if usage_name is None:
+            return self.default_shard
+        return sharding.choose_shard(
+            list(self.shards.values()), usage_name, 1,
+            CONF.azure.usage_cache_ttl)
+
+    def _copy_disk(self, disk_name, source_id, spec, size=None,
+                   shard=None, tags=None):
+        shard = shard or self.default_shard
+
+        def _copy():
+            async_action = disktype.create_disk(shard, disk_name, spec, size,
+                                                source_id, tags)
+            async_action.result()
+
+        try:
+            # copies of same source are limited, queued ones wait here.
+            self.copy_scheduler.run(source_id, size, _copy)
+        except Exception as e:
+            message = (_("Copy disk %(blob_name)s from %(source_id)s in Azure"
+                         " failed. reason: %(reason)s")
+                       % dict(blob_name=disk_name, source_id=source_id,
+                              reason=six.text_type(e)))
+            LOG.exception(message)
+            raise exception.VolumeBackendAPIException(data=message)
+
+    def _copy_snapshot(self, snapshot_name, source_id, shard=None):
+        shard = shard or self.default_shard
+        snapshot_dict = {
+            'location': shard.location,
             'creation_data': {
                 'create_option': DiskCreateOption.copy,
                 'source_uri': source_id
             }
         }
-        if size:
-            disk_dict['disk_size_gb'] = size
         try:
-            async_action = self.disks.create_or_update(
-                CONF.azure.resource_group,
-                disk_name,
-                disk_dict
+            async_action = shard.snapshots.create_or_update(
+                shard.group_for(snapshot_name),
+                snapshot_name,
+                snapshot_dict
             )
             async_action.result()
         except Exception as e:
-            message = (_("Copy disk %(blob_name)s from %(source_id)s in Azure"
-                         " failed. reason: %(reason)s")
-                       % dict(blob_name=disk_name, source_id=source_id,
+            message = (_("Copy snapshot %(snapshot)s from %(source_id)s in "
+                         "Azure failed. reason: %(reason)s")
+                       % dict(snapshot=snapshot_name, source_id=source_id,
                               reason=six.text_type(e)))
             LOG.exception(message)
             raise exception.VolumeBackendAPIException(data=message)
 
     def create_volume(self, volume):
-        azure_type = StorageAccountTypes.premium_lrs \
-            if 'azure_ssd' == volume.volume_type.name \
-            else StorageAccountTypes.standard_lrs
+        spec = self.disk_types.get(volume.volume_type)
         disk_name = self._get_name_from_id(VOLUME_PREFIX, volume.id)
-        disk_dict = {
-            'location': CONF.azure.location,
-            'account_type': azure_type,
-            'creation_data': {
-                'create_option': DiskCreateOption.empty,
-            },
-            'disk_size_gb': volume.size
-        }
+        shard = self._place_volume(volume, spec.sku)
+        # only plain disks are pooled.
+        pool_disk = spec.native and self._claim_pool_disk(
+            shard, spec.sku, volume)
+        if pool_disk:
+            self.ledger.record(pool_disk, spec.sku, volume.size)
+            return dict(provider_location=shard.name, provider_id=pool_disk)
         LOG.debug("Calling Create Disk '{}' in Azure ..."
                   .format(disk_name))
         try:
-            async_action = self.disks.create_or_update(
-                CONF.azure.resource_group,
-                disk_name,
-                disk_dict
-            )
+            async_action = disktype.create_disk(shard, disk_name, spec,
+                                                volume.size)
             async_action.result()
         except Exception as e:
             try:
-                self.disks.delete(
-                    CONF.azure.resource_group,
+                shard.disks.delete(
+                    shard.group_for(disk_name),
                     disk_name
                 )
             except Exception:
@@ -153,14 +419,17 @@ class AzureDriver(driver.VolumeDriver):
             LOG.exception(message)
             raise exception.VolumeBackendAPIException(data=message)
         LOG.info(_LI('Created Disk : %s in Azure.'), disk_name)
+        self.ledger.record(disk_name, spec.sku, volume.size)
+        return dict(provider_location=shard.name)
 
     def delete_volume(self, volume):
-        disk_name = self._get_name_from_id(VOLUME_PREFIX, volume.id)
+        disk_name = self._get_disk_name(volume)
+        shard = self._get_shard(volume)
         LOG.debug("Calling Delete Disk '{}' in Azure ..."
                   .format(disk_name))
         try:
-            async_action = self.disks.delete(
-                CONF.azure.resource_group,
+            async_action = shard.disks.delete(
+                shard.group_for(disk_name),
                 disk_name
             )
             async_action.result()
@@ -174,6 +443,7 @@ class AzureDriver(driver.VolumeDriver):
                        dict(volume=disk_name, reason=six.text_type(e)))
             LOG.exception(message)
             raise exception.VolumeBackendAPIException(data=message)
+        self.ledger.remove(disk_name)
         LOG.info(_LI("Delete Disk %s in Azure finish."), disk_name)
 
     def remove_export(self, context, volume):
@@ -197,12 +467,15 @@ class AzureDriver(driver.VolumeDriver):
         metadata = volume.get('volume_metadata', [])
         metadata_dict = {item['key']: item['value'] for item in metadata}
         os_type = metadata_dict.get('os_type')
+        shard = self._get_shard(volume)
+        disk_name = self._get_disk_name(volume)
         connection_info = {
             'driver_volume_type': 'local',
             'data': {'volume_name': volume.name,
                      'volume_id': volume.id,
-                     'disk_name':
-                         self._get_name_from_id(VOLUME_PREFIX, volume.id),
+                     'disk_name': disk_name,
+                     'subscription_id': shard.subscription_id,
+                     'resource_group': shard.group_for(disk_name),
                      # 'vhd_uri': vhd_uri,
                      'vhd_size_gb': volume.size,
                      'vhd_name': volume.name,
@@ -219,27 +492,45 @@ class AzureDriver(driver.VolumeDriver):
         pass
 
     def create_snapshot(self, snapshot):
-        disk_name = self._get_name_from_id(
-            VOLUME_PREFIX, snapshot['volume_id'])
+        disk_name = self._get_disk_name(snapshot.get('volume'),
+                                        snapshot['volume_id'])
         snapshot_name = self._get_name_from_id(
             SNAPSHOT_PREFIX, snapshot['id'])
+        # snapshot is placed in same shard with its volume.
+        shard = self._get_shard(snapshot.get('volume'))
+        disk_id = shard.resource_id(resource_ids.DISKS, disk_name)
+        base_name = self._get_base_snapshot_name(snapshot)
         try:
-            source_disk = self.disks.get(
-                CONF.azure.resource_group,
-                disk_name
-            )
-            snapshot_dict = {
-                'location': CONF.azure.location,
-                'creation_data': {
-                    'create_option': DiskCreateOption.copy,
-                    'source_uri': source_disk.id
+            if base_name:
+                # Azure stores only blocks changed since last snapshot of
+                # the disk, each snapshot is still restorable alone.
+                body = {
+                    'location': shard.location,
+                    'properties': {
+                        'creationData': {
+                            'createOption': 'Copy',
+                            'sourceResourceId': disk_id
+                        },
+                        'incremental': True
+                    }
                 }
-            }
-            async_action = self.snapshots.create_or_update(
-                CONF.azure.resource_group,
-                snapshot_name,
-                snapshot_dict
-            )
+                async_action = shard.azure.request(
+                    'snapshots', 'PUT',
+                    shard.resource_id(resource_ids.SNAPSHOTS, snapshot_name),
+                    SNAPSHOT_API_VERSION, body)
+            else:
+                snapshot_dict = {
+                    'location': shard.location,
+                    'creation_data': {
+                        'create_option': DiskCreateOption.copy,
+                        'source_uri': disk_id
+                    }
+                }
+                async_action = shard.snapshots.create_or_update(
+                    shard.group_for(snapshot_name),
+                    snapshot_name,
+                    snapshot_dict
+                )
             async_action.result()
         except Exception as e:
             message = (_("Create Snapshop %(volume)s in Azure failed. reason: "
@@ -251,15 +542,41 @@ class AzureDriver(driver.VolumeDriver):
         LOG.info(_LI('Created Snapshot: %s in Azure.') % snapshot_name)
         metadata = snapshot['metadata']
         metadata['azure_snapshot_id'] = snapshot_name
-        return dict(metadata=metadata)
+        if base_name:
+            metadata['azure_incremental'] = 'True'
+            metadata['azure_base_snapshot_id'] = base_name
+        return dict(metadata=metadata, provider_location=shard.name)
+
+    def _get_base_snapshot_name(self, snapshot):
+        """Azure snapshot of latest available snapshot of same volume.
+
+        None if volume has no other snapshot, then a full one is made.
+        """
+        try:
+            snapshots = self.db.snapshot_get_all_for_volume(
+                cinder_context.get_admin_context(), snapshot['volume_id'])
+        except Exception as e:
+            LOG.warning(_LW("Unable to get snapshots of volume %(volume)s, "
+                            "make a full snapshot. reason: %(reason)s"),
+                        dict(volume=snapshot['volume_id'],
+                             reason=six.text_type(e)))
+            return None
+        others = [i for i in snapshots
+                  if i['id'] != snapshot['id'] and
+                  i['status'] == 'available']
+        if not others:
+            return None
+        latest = max(others, key=lambda i: i['created_at'])
+        return self._get_name_from_id(SNAPSHOT_PREFIX, latest['id'])
 
     def delete_snapshot(self, snapshot):
         snapshot_name = self._get_name_from_id(
             SNAPSHOT_PREFIX, snapshot['id'])
+        shard = self._get_shard(snapshot)
         LOG.debug('Calling Delet Snapshot: %s in Azure.' % snapshot_name)
         try:
-            async_action = self.snapshots.delete(
-                CONF.azure.resource_group,
+            async_action = shard.snapshots.delete(
+                shard.group_for(snapshot_name),
                 snapshot_name,
             )
             async_action.result()
@@ -277,59 +594,126 @@ class AzureDriver(driver.VolumeDriver):
             raise exception.VolumeBackendAPIException(data=message)
         LOG.info(_LI('Deleted Snapshot: %s in Azure.'), snapshot_name)
 
-    def create_volume_from_snapshot(self, volume, snapshot):
-        azure_type = StorageAccountTypes.premium_lrs \
-            if 'azure_ssd' == volume.volume_type.name \
-            else StorageAccountTypes.standard_lrs
+    def revert_to_snapshot(self, context, volume, snapshot):
+        """Revert volume disk to snapshot in Azure.
+
+        managed disk can't be written in place, so the disk is replaced by a
+        copy of snapshot. original disk is kept in a tmp snapshot until the
+        copy is done, and copied back if it fails. tags of original disk,
+        e.g. volume tag of a pool disk, are kept on the new one.
+        """
+        spec = self.disk_types.get(volume.volume_type)
+        size = volume['size']
+        disk_name = self._get_disk_name(volume)
         snapshot_name = self._get_name_from_id(
             SNAPSHOT_PREFIX, snapshot['id'])
-        disk_name = self._get_name_from_id(
-            VOLUME_PREFIX, volume.id)
+        tmp_name = TMP_PREFIX + '-' + disk_name
+        shard = self._get_shard(volume)
+        snapshot_shard = self._get_shard(snapshot)
+        snapshot_id = snapshot_shard.resource_id(resource_ids.SNAPSHOTS,
+                                                 snapshot_name)
+
+        # 1 snapshot volume disk
         try:
-            snapshot_obj = self.snapshots.get(
-                CONF.azure.resource_group,
-                snapshot_name
-            )
+            tags = shard.disks.get(shard.group_for(disk_name),
+                                   disk_name).tags
         except Exception as e:
-            message = (_("Create Volume from Snapshot %(snapshop)s in Azure"
+            message = (_("Revert Volume: %(volume)s to Snapshot in Azure"
                          " failed. reason: %(reason)s")
-                       % dict(snapshop=snapshot_name,
-                              reason=six.text_type(e)))
+                       % dict(volume=volume.id, reason=six.text_type(e)))
             LOG.exception(message)
             raise exception.VolumeBackendAPIException(data=message)
-        else:
-            self._copy_disk(disk_name, snapshot_obj.id, azure_type,
-                            volume['size'])
+        self._copy_snapshot(tmp_name,
+                            shard.resource_id(resource_ids.DISKS, disk_name),
+                            shard)
 
-    def create_cloned_volume(self, volume, src_vref):
-        azure_type = StorageAccountTypes.premium_lrs \
-            if 'azure_ssd' == src_vref['volume_type']['name'] \
-            else StorageAccountTypes.standard_lrs
-        src_vref_name = self._get_name_from_id(
-            VOLUME_PREFIX, src_vref['id'])
-        disk_name = self._get_name_from_id(
-            VOLUME_PREFIX, volume.id)
+        # 2 delete original disk
         try:
-            src_vref_obj = self.disks.get(
-                CONF.azure.resource_group,
-                src_vref_name
-            )
+            shard.disks.delete(shard.group_for(disk_name),
+                               disk_name).result()
         except Exception as e:
-            message = (_("Create Cloned Volume %(volume)s in Azure"
+            # original disk is still there.
+            self._delete_tmp_snapshot(shard, tmp_name)
+            message = (_("Revert Volume: %(volume)s to Snapshot in Azure"
                          " failed. reason: %(reason)s")
-                       % dict(volume=src_vref_name,
-                              reason=six.text_type(e)))
+                       % dict(volume=volume.id, reason=six.text_type(e)))
+            LOG.exception(message)
+            raise exception.VolumeBackendAPIException(data=message)
+
+        # 3 copy snapshot to volume disk
+        try:
+            self._copy_disk(disk_name, snapshot_id, spec, size, shard, tags)
+        except Exception as e:
+            # roll back
+            try:
+                self._copy_disk(disk_name,
+                                shard.resource_id(resource_ids.SNAPSHOTS,
+                                                  tmp_name),
+                                spec, size, shard, tags)
+            except Exception:
+                # tmp snapshot is the only copy of original disk, kept.
+                message = (_("Revert Volume: %(volume)s to Snapshot in "
+                             "Azure failed, and the original volume is "
+                             "damaged. Original disk is kept in snapshot "
+                             "%(snapshot)s.")
+                           % dict(volume=volume.id, snapshot=tmp_name))
+                LOG.exception(message)
+                raise exception.VolumeBackendAPIException(data=message)
+            self._delete_tmp_snapshot(shard, tmp_name)
+            message = (_("Revert Volume: %(volume)s to Snapshot in Azure"
+                         " failed, rolled back to the original volume. "
+                         "reason: %(reason)s")
+                       % dict(volume=volume.id, reason=six.text_type(e)))
             LOG.exception(message)
-            raise exception.VolumeNotFound(volume_id=src_vref['id'])
-        self._copy_disk(disk_name, src_vref_obj.id, azure_type,
-                        volume['size'])
+            raise exception.VolumeBackendAPIException(data=message)
+        self._delete_tmp_snapshot(shard, tmp_name)
+        self.ledger.record(disk_name, spec.sku, size)
+        LOG.info(_LI("Reverted Volume: %(volume)s to Snapshot: %(snapshot)s "
+                     "in Azure."),
+                 dict(volume=disk_name, snapshot=snapshot_name))
+
+    def _delete_tmp_snapshot(self, shard, tmp_name):
+        try:
+            shard.snapshots.delete(shard.group_for(tmp_name),
+                                   tmp_name).result()
+        except Exception:
+            LOG.exception(_LE("Delete tmp snapshot %s in Azure failed."),
+                          tmp_name)
+
+    def create_volume_from_snapshot(self, volume, snapshot):
+        spec = self.disk_types.get(volume.volume_type)
+        snapshot_name = self._get_name_from_id(
+            SNAPSHOT_PREFIX, snapshot['id'])
+        disk_name = self._get_name_from_id(
+            VOLUME_PREFIX, volume.id)
+        shard = self._get_shard(snapshot)
+        self._copy_disk(disk_name,
+                        shard.resource_id(resource_ids.SNAPSHOTS,
+                                          snapshot_name),
+                        spec, volume['size'], shard)
+        self.ledger.record(disk_name, spec.sku, volume['size'])
+        return dict(provider_location=shard.name)
+
+    def create_cloned_volume(self, volume, src_vref):
+        spec = self.disk_types.get(volume.volume_type)
+        src_vref_name = self._get_disk_name(src_vref)
+        disk_name = self._get_name_from_id(
+            VOLUME_PREFIX, volume.id)
+        shard = self._get_shard(src_vref)
+        self._copy_disk(disk_name,
+                        shard.resource_id(resource_ids.DISKS, src_vref_name),
+                        spec, volume['size'], shard)
+        self.ledger.record(disk_name, spec.sku, volume['size'])
+        return dict(provider_location=shard.name)
 
     def clone_image(self, context, volume,
                     image_location, image_meta,
                     image_service):
-        azure_type = StorageAccountTypes.premium_lrs \
-            if 'azure_ssd' == volume.volume_type.name \
-            else StorageAccountTypes.standard_lrs
+        # only images copied from volumes have disks in Azure, others are
+        # uploaded by copy_image_to_volume.
+        if 'azure_image_size_gb' not in image_meta['properties']:
+            return None, False
+        spec = self.disk_types.get(volume.volume_type)
         # image to create volume must has os_type property.
         os_type = image_meta['properties'].get('os_type')
         if not os_type:
@@ -342,29 +726,85 @@ class AzureDriver(driver.VolumeDriver):
             IMAGE_PREFIX, image_meta['id'])
         disk_name = self._get_name_from_id(
             VOLUME_PREFIX, volume.id)
-        try:
-            image_obj = self.disks.get(
-                CONF.azure.resource_group,
-                image_name
-            )
-        except Exception as e:
-            message = (_("Create Volume from Image %(image_id)s in Azure"
-                         " failed. reason: %(reason)s")
-                       % dict(image_id=image_meta['id'],
-                              reason=six.text_type(e)))
-            LOG.exception(message)
-            raise exception.VolumeBackendAPIException(data=message)
-        self._copy_disk(disk_name, image_obj.id, azure_type)
+        # image disk is in shard of the volume copied to image.
+        image_shard = self.shards.get(
+            image_meta['properties'].get('azure_shard'), self.default_shard)
+        shard = self._place_volume(volume, spec.sku)
+        self._copy_disk(disk_name,
+                        image_shard.resource_id(resource_ids.DISKS,
+                                                image_name),
+                        spec, shard=shard)
+        self.ledger.record(disk_name, spec.sku, volume['size'])
 
         metadata = volume['metadata']
         metadata['os_type'] = os_type
         LOG.info(_LI("Created Volume: %(disk_name)s from Image in Azure."),
                  dict(disk_name=disk_name))
-        return dict(metadata=metadata), True
+        return dict(metadata=metadata, provider_location=shard.name), True
 
     def copy_image_to_volume(self, context, volume, image_service, image_id):
-        """Nothing need to do since we copy image to volume in clone_image."""
-        pass
+        """Upload image to volume disk, for images without disk in Azure.
+
+        empty disk of volume is replaced by a disk to upload to, image is
+        streamed from glance, converted to fixed vhd on the fly and written
+        into its pages, no local file.
+        """
+        image_meta = image_service.show(context, image_id)
+        try:
+            size, stream = vhd.to_fixed_vhd(
+                image_meta.get('disk_format'),
+                image_service.download(context, image_id),
+                image_meta.get('size'))
+        except vhd.ConvertError as e:
+            raise exception.ImageUnacceptable(image_id=image_id,
+                                              reason=six.text_type(e))
+        if size - vhd.FOOTER_SIZE > volume['size'] * units.Gi:
+            raise exception.ImageUnacceptable(
+                image_id=image_id,
+                reason=_("image is larger than volume."))
+        spec = self.disk_types.get(volume.volume_type)
+        disk_name = self._get_disk_name(volume)
+        shard = self._get_shard(volume)
+        disk_id = shard.resource_id(resource_ids.DISKS, disk_name)
+        try:
+            shard.disks.delete(shard.group_for(disk_name),
+                               disk_name).result()
+            disktype.create_disk(shard, disk_name, spec,
+                                 tags={VOLUME_TAG: volume['id']},
+                                 upload_size=size).result()
+            access = shard.azure.request(
+                'disks', 'POST', disk_id + '/beginGetAccess',
+                disktype.DISK_API_VERSION,
+                {'access': 'Write',
+                 'durationInSeconds': CONF.azure.upload_sas_duration}
+            ).result()
+            try:
+                uploader = upload.PageUploader(
+                    access['accessSAS'], CONF.azure.upload_workers,
+                    retry_policy=shard.azure.retry_policy,
+                    skip_zeros=CONF.azure.upload_skip_zeros)
+                uploader.upload(stream)
+            finally:
+                shard.azure.request(
+                    'disks', 'POST', disk_id + '/endGetAccess',
+                    disktype.DISK_API_VERSION).result()
+            if size - vhd.FOOTER_SIZE < volume['size'] * units.Gi:
+                shard.azure.request(
+                    'disks', 'PATCH', disk_id, disktype.DISK_API_VERSION,
+                    {'properties': {'diskSizeGB': volume['size']}}
+                ).result()
+        except Exception as e:
+            message = (_("Copy Image %(image_id)s to Volume %(volume)s in "
+                         "Azure failed. reason: %(reason)s")
+                       % dict(image_id=image_id, volume=volume['id'],
+                              reason=six.text_type(e)))
+            LOG.exception(message)
+            raise exception.VolumeBackendAPIException(data=message)
+        LOG.info(_LI("Uploaded Image %(image_id)s of %(size)s bytes to Volume"
+                     " %(volume)s in Azure, %(skipped)s zero bytes "
+                     "skipped."),
+                 dict(image_id=image_id, size=size, volume=volume['id'],
+                      skipped=uploader.skipped))
 
     def copy_volume_to_image(self, context, volume, image_service, image_meta):
         """Copy the volume to the specified image.
@@ -372,9 +812,7 @@ class AzureDriver(driver.VolumeDriver):
         copy disk to image and disk for image.
         """
         # TODO(haifeng)user delete iamge on openstack, image still in Azure.
-        azure_type = StorageAccountTypes.premium_lrs \
-            if 'azure_ssd' == volume.volume_type.name \
-            else StorageAccountTypes.standard_lrs
+        spec = self.disk_types.get(volume.volume_type)
         metadata = volume.get('volume_metadata', [])
         metadata_dict = {item['key']: item['value'] for item in metadata}
         os_type = metadata_dict.get('os_type')
@@ -387,38 +825,30 @@ class AzureDriver(driver.VolumeDriver):
             LOG.exception(message)
             raise exception.VolumeBackendAPIException(data=message)
 
-        disk_name = self._get_name_from_id(
-            VOLUME_PREFIX, volume['id'])
+        disk_name = self._get_disk_name(volume)
         image_name = self._get_name_from_id(
             IMAGE_PREFIX, image_meta['id'])
-        try:
-            disk_obj = self.disks.get(
-                CONF.azure.resource_group,
-                disk_name
-            )
-        except Exception as e:
-            message = (_("Create Image from Volume %(volume)s in Azure"
-                         " failed. reason: %(reason)s")
-                       % dict(volume=volume['id'],
-                              reason=six.text_type(e)))
-            LOG.exception(message)
-            raise exception.VolumeBackendAPIException(data=message)
-        self._copy_disk(image_name, disk_obj.id, azure_type)
+        shard = self._get_shard(volume)
+        disk_id = shard.resource_id(resource_ids.DISKS, disk_name)
+        # image disk is only a copy source, no provisioned performance.
+        self._copy_disk(image_name, disk_id,
+                        disktype.DiskSpec(spec.sku),
+                        shard=shard)
         try:
             image_dict = {
-                'location': CONF.azure.location,
+                'location': shard.location,
                 'storage_profile': {
                     'os_disk': {
                         'os_type': os_type,
                         'os_state': "Generalized",
                         'managed_disk': {
-                            'id': disk_obj.id
+                            'id': disk_id
                         }
                     }
                 }
             }
-            async_action = self.images.create_or_update(
-                CONF.azure.resource_group,
+            async_action = shard.images.create_or_update(
+                shard.group_for(image_name),
                 image_name,
                 image_dict
             )
@@ -441,51 +871,50 @@ class AzureDriver(driver.VolumeDriver):
         image_meta['disk_format'] = 'vhd'
         image_meta['properties'] = {'os_type': os_type,
                                     'azure_image_size_gb':
-                                        volume.size
+                                        volume.size,
+                                    'azure_shard': shard.name
                                     }
         image_service.update(context, image_meta['id'], image_meta)
 
     def retype(self, context, volume, new_type, diff, host):
-        azure_type = StorageAccountTypes.premium_lrs \
-            if 'azure_ssd' == new_type['name'] \
-            else StorageAccountTypes.standard_lrs
-        disk_name = self._get_name_from_id(
-            VOLUME_PREFIX, volume['id'])
-        try:
-            disk_obj = self.disks.get(
-                CONF.azure.resource_group,
-                disk_name
-            )
-        except Exception as e:
-            message = (_("Retype Volume %(volume)s in Azure"
-                         " failed. reason: %(reason)s")
-                       % dict(volume=volume['id'],
-                              reason=six.text_type(e)))
-            LOG.exception(message)
-            raise exception.VolumeBackendAPIException(data=message)
-        disk_obj.account_type = azure_type
-        try:
-            async_action = self.disks.create_or_update(
-                CONF.azure.resource_group,
-                disk_name,
-                disk_obj
-            )
-            async_action.result()
-        except Exception as e:
-            message = (_("Retype disk %(blob_name)s in Azure"
-                         " failed. reason: %(reason)s")
-                       % dict(blob_name=disk_name,
-                              reason=six.text_type(e)))
-            LOG.exception(message)
-            raise exception.VolumeBackendAPIException(data=message)
+        """Change sku, tier or provisioned performance of disk in place.
+
+        only changed properties are patched, disk and its data stay. types
+        Azure can't change in place return False, cinder migrates volume.
+        """
+        old_spec = self.disk_types.get(volume.volume_type)
+        spec = self.disk_types.get(new_type)
+        body = disktype.update_body(old_spec, spec)
+        if body is None:
+            LOG.info(_LI("Volume %(volume)s can't be retyped to %(type)s in "
+                         "place."),
+                     dict(volume=volume['id'], type=new_type['name']))
+            return False
+        disk_name = self._get_disk_name(volume)
+        if body:
+            shard = self._get_shard(volume)
+            try:
+                async_action = shard.azure.request(
+                    'disks', 'PATCH',
+                    shard.resource_id(resource_ids.DISKS, disk_name),
+                    disktype.DISK_API_VERSION, body)
+                async_action.result()
+            except Exception as e:
+                message = (_("Retype disk %(blob_name)s in Azure"
+                             " failed. reason: %(reason)s")
+                           % dict(blob_name=disk_name,
+                                  reason=six.text_type(e)))
+                LOG.exception(message)
+                raise exception.VolumeBackendAPIException(data=message)
+        self.ledger.record(disk_name, spec.sku, volume['size'])
         return True
 
     def extend_volume(self, volume, new_size):
-        disk_name = self._get_name_from_id(
-            VOLUME_PREFIX, volume['id'])
+        disk_name = self._get_disk_name(volume)
+        shard = self._get_shard(volume)
         try:
-            disk_obj = self.disks.get(
-                CONF.azure.resource_group,
+            disk_obj = shard.disks.get(
+                shard.group_for(disk_name),
                 disk_name
             )
         except Exception as e:
@@ -497,8 +926,8 @@ class AzureDriver(driver.VolumeDriver):
             raise exception.VolumeBackendAPIException(data=message)
         disk_obj.disk_size_gb = new_size
         try:
-            async_action = self.disks.create_or_update(
-                CONF.azure.resource_group,
+            async_action = shard.disks.create_or_update(
+                shard.group_for(disk_name),
                 disk_name,
                 disk_obj
             )
@@ -510,3 +939,110 @@ class AzureDriver(driver.VolumeDriver):
                               reason=six.text_type(e)))
             LOG.exception(message)
             raise exception.VolumeBackendAPIException(data=message)
+        self.ledger.record(disk_name, disk_obj.account_type, new_size)
+
+    def _run_members(self, func, items):
+        """Run func(*item) of all items at once, wait for all of them.
+
+        return (result, exception) of each item, in order of items.
+        """
+        def _run(item):
+            try:
+                return func(*item), None
+            except Exception as e:
+                return None, e
+
+        pool = eventlet.GreenPool(max(len(items), 1))
+        return list(pool.imap(_run, items))
+
+    def create_group(self, context, group):
+        """Group is only a record in cinder, nothing to create in Azure."""
+        return {'status': fields.GroupStatus.AVAILABLE}
+
+    def delete_group(self, context, group, volumes):
+        model_update = {'status': fields.GroupStatus.DELETED}
+        volumes_update = []
+        results = self._run_members(self.delete_volume,
+                                    [(i,) for i in volumes])
+        for volume, (_result, error) in zip(volumes, results):
+            status = 'deleted'
+            if error is not None:
+                status = 'error_deleting'
+                model_update['status'] = fields.GroupStatus.ERROR_DELETING
+            volumes_update.append({'id': volume.id, 'status': status})
+        return model_update, volumes_update
+
+    def update_group(self, context, group, add_volumes=None,
+                     remove_volumes=None):
+        return None, None, None
+
+    def create_group_snapshot(self, context, group_snapshot, snapshots):
+        """Snapshot all volumes of group at once.
+
+        snapshots of members are created concurrently, so skew between them
+        is about time to send one snapshot request, not the sum of all. they
+        are not crash consistent across members.
+        """
+        model_update = {'status': fields.GroupSnapshotStatus.AVAILABLE}
+        snapshots_update = []
+        results = self._run_members(self.create_snapshot,
+                                    [(i,) for i in snapshots])
+        for snapshot, (result, error) in zip(snapshots, results):
+            update = {'id': snapshot.id,
+                      'status': fields.SnapshotStatus.AVAILABLE}
+            if error is not None:
+                update['status'] = fields.SnapshotStatus.ERROR
+                model_update['status'] = fields.GroupSnapshotStatus.ERROR
+            else:
+                update.update(result)
+            snapshots_update.append(update)
+        LOG.info(_LI("Created Group Snapshot: %(group_snapshot)s of "
+                     "%(count)s volumes in Azure."),
+                 dict(group_snapshot=group_snapshot.id, count=len(snapshots)))
+        return model_update, snapshots_update
+
+    def delete_group_snapshot(self, context, group_snapshot, snapshots):
+        model_update = {'status': fields.GroupSnapshotStatus.DELETED}
+        snapshots_update = []
+        results = self._run_members(self.delete_snapshot,
+                                    [(i,) for i in snapshots])
+        for snapshot, (_result, error) in zip(snapshots, results):
+            status = fields.SnapshotStatus.DELETED
+            if error is not None:
+                status = fields.SnapshotStatus.ERROR_DELETING
+                model_update['status'] = \
+                    fields.GroupSnapshotStatus.ERROR_DELETING
+            snapshots_update.append({'id': snapshot.id, 'status': status})
+        return model_update, snapshots_update
+
+    def create_group_from_src(self, context, group, volumes,
+                              group_snapshot=None, snapshots=None,
+                              source_group=None, source_vols=None):
+        """Create volumes of group from group snapshot or source group.
+
+        sources are in same order of volumes, disks are copied concurrently.
+        """
+        if group_snapshot and snapshots:
+            create = self.create_volume_from_snapshot
+            sources = snapshots
+        elif source_group and source_vols:
+            create = self.create_cloned_volume
+            sources = source_vols
+        else:
+            message = (_("Create Group %(group)s from source in Azure "
+                         "failed. reason: no source snapshots or volumes.")
+                       % dict(group=group.id))
+            LOG.error(message)
+            raise exception.VolumeBackendAPIException(data=message)
+        model_update = {'status': fields.GroupStatus.AVAILABLE}
+        volumes_update = []
+        results = self._run_members(create, list(zip(volumes, sources)))
+        for volume, (result, error) in zip(volumes, results):
+            update = {'id': volume.id, 'status': 'available'}
+            if error is not None:
+                update['status'] = 'error'
+                model_update['status'] = fields.GroupStatus.ERROR
+            else:
+                update.update(result)
+            volumes_update.append(update)
+        return model_update, volumes_update
@@ -0,0 +1,155 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import enum
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import six
+from cinder.i18n import _LW
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# operations older than this are not resumed, Azure keeps status for days.
+MAX_AGE = 24 * 3600
+FIELDS = ('name', 'mode', 'status_url', 'final_url', 'model')
+
+
+def _plain(obj):
+    # sdk models and enums as json, same for same content across restarts.
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    return six.text_type(obj)
+
+
+def make_key(subscription_id, endpoint, method, args, kwargs=None):
+    """Key of an operation intent, e.g. sub/virtual_machines.start/rg/vm.
+
+    plain string args(resource group, resource names) are kept readable,
+    other args and kwargs(bodies, parameters) are hashed into the key, so
+    only same request on same resource has same key.
+    """
+    names = [i for i in args if isinstance(i, six.string_types)]
+    params = [i for i in args if not isinstance(i, six.string_types)]
+    key = '/'.join([subscription_id, '{}.{}'.format(endpoint, method)] +
+                   names)
+    if params or kwargs:
+        digest = hashlib.sha1(json.dumps(
+            [params, kwargs or {}], sort_keys=True,
+            default=_plain).encode('utf-8')).hexdigest()
+        key += '#' + digest
+    return key
+
+
+class Journal(object):
+    """Long running operations in flight, persisted in sqlite.
+
+    an operation is recorded once Azure accepted it and removed when it is
+    finished. only operations recorded before this process started are
+    resumed, once each: after service restart, same request on same
+    resource polls the recorded operation instead of sending it again.
+    empty path disables the journal.
+    """
+
+    def __init__(self, path, max_age=MAX_AGE, clock=time.time):
+        self.path = path
+        self.max_age = max_age
+        self._clock = clock
+        self._conn = None
+        self._recovered = set()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS operations ('
+                'key TEXT PRIMARY KEY, name TEXT, mode TEXT, '
+                'status_url TEXT, final_url TEXT, model TEXT, '
+                'created_at REAL)')
+            self._recovered = set(row[0] for row in self._conn.execute(
+                'SELECT key FROM operations WHERE created_at >= ?',
+                (self._clock() - self.max_age,)))
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        if not self.path:
+            return []
+        with self._lock:
+            try:
+                conn = self._connect()
+                with conn:
+                    return conn.execute(sql, params).fetchall()
+            except (sqlite3.Error, OSError) as e:
+                # journal is best effort, never fail the operation itself.
+                LOG.warning(_LW("Operation journal %(path)s failed: "
+                                "%(reason)s"),
+                            dict(path=self.path, reason=e))
+                return []
+
+    def record(self, key, op):
+        self._execute('INSERT OR REPLACE INTO operations VALUES '
+                      '(?, ?, ?, ?, ?, ?, ?)',
+                      (key, op.name, op.mode, op.status_url, op.final_url,
+                       op.model, self._clock()))
+        # a new operation supersedes the one recorded before restart.
+        with self._lock:
+            self._recovered.discard(key)
+
+    def remove(self, key, status_url=None):
+        """Remove operation of key, only if it has status_url if given."""
+        if status_url:
+            self._execute('DELETE FROM operations WHERE key = ? AND '
+                          'status_url = ?', (key, status_url))
+        else:
+            self._execute('DELETE FROM operations WHERE key = ?', (key,))
+
+    def find(self, key):
+        """Operation of key recorded before this process started, as dict.
+
+        None if no, expired or already resumed.
+        """
+        self._execute('DELETE FROM operations WHERE created_at < ?',
+                      (self._clock() - self.max_age,))
+        with self._lock:
+            if key not in self._recovered:
+                return None
+            self._recovered.discard(key)
+        rows = self._execute('SELECT name, mode, status_url, final_url, '
+                             'model FROM operations WHERE key = ?', (key,))
+        if not rows:
+            return None
+        return dict(zip(FIELDS, rows[0]))
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal(conf):
+    """The Journal shared by all Azure clients in this process."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = Journal(conf.azure.operation_journal)
+        return _journal
@@ -0,0 +1,60 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+
+def sku_name(sku):
+    """Name of disk sku, StorageAccountTypes member or its value."""
+    return getattr(sku, 'value', sku)
+
+
+class CapacityLedger(object):
+    """Allocated GB of volume disks of each sku, updated incrementally.
+
+    driver records every disk it creates, extends, retypes or deletes, so
+    stats never list disks. reconcile replaces the whole ledger from a full
+    listing, driver only runs it now and then to fix drift.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._disks = {}
+        self._lock = threading.Lock()
+        self.reconciled_at = 0
+
+    def record(self, name, sku, size_gb):
+        """Disk name is sku and size_gb now, new or changed."""
+        with self._lock:
+            self._disks[name] = (sku_name(sku), size_gb or 0)
+
+    def remove(self, name):
+        with self._lock:
+            self._disks.pop(name, None)
+
+    def allocated(self):
+        """Return {sku: allocated GB}."""
+        totals = {}
+        with self._lock:
+            for sku, size in self._disks.values():
+                totals[sku] = totals.get(sku, 0) + size
+        return totals
+
+    def reconcile(self, disks):
+        """Replace ledger by disks listed, items are (name, sku, size_gb)."""
+        listed = dict((name, (sku_name(sku), size or 0))
+                      for name, sku, size in disks)
+        with self._lock:
+            self._disks = listed
+            self.reconciled_at = self._clock()
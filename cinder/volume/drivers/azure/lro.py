@@ -0,0 +1,278 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import eventlet
+import six
+from msrestazure.azure_exceptions import CloudError
+from cinder.i18n import _LE
+from cinder.volume.drivers.azure import retry
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+ASYNC_HEADER = 'Azure-AsyncOperation'
+LOCATION_HEADER = 'Location'
+SUCCEEDED = 'Succeeded'
+TERMINAL_STATES = (SUCCEEDED, 'Failed', 'Canceled')
+IN_PROGRESS = 'InProgress'
+# how operation status is polled.
+ASYNC = 'async'
+LOCATION = 'location'
+RESOURCE = 'resource'
+
+# long running methods of sdk operations groups.
+LRO_METHODS = frozenset(['create_or_update', 'update', 'delete', 'start',
+                         'power_off', 'restart', 'deallocate', 'redeploy',
+                         'capture', 'grant_access', 'revoke_access',
+                         'convert_to_managed_disks'])
+# same name but answered synchronously.
+SYNC_CALLS = frozenset([('resource_groups', 'create_or_update')])
+
+
+def is_long_running(endpoint, method):
+    return method in LRO_METHODS and (endpoint, method) not in SYNC_CALLS
+
+
+def _json(response):
+    try:
+        return response.json() or {}
+    except ValueError:
+        return {}
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class Operation(object):
+    """Future of a long running operation, polled by LROEngine.
+
+    keeps wait(timeout)/result(timeout)/done() of sdk poller, wait returns
+    after timeout even operation is not finished.
+    """
+
+    def __init__(self, name, get=None, deserialize=None, model=None):
+        self.name = name
+        self.get = get
+        self.deserialize = deserialize
+        self.model = model
+        self.mode = None
+        self.status_url = None
+        self.final_url = None
+        self.interval = 0
+        self.next_poll = 0
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def finish(self, result=None, exception=None):
+        self._result = result
+        self._exception = exception
+        self._done.set()
+        for callback in self._callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        if self.done():
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+
+    def result(self, timeout=None):
+        self.wait(timeout)
+        return self._result
+
+
+class LROEngine(object):
+    """Poll all outstanding long running operations in one loop.
+
+    an operation is polled at its Azure-AsyncOperation or Location url, or
+    the resource url for PUT answered without them. interval starts from
+    min_interval and doubles up to max_interval, Retry-After from ARM
+    overrides it. due operations are polled by a green pool of concurrency,
+    get runs the http call, normally in native thread pool.
+    """
+
+    def __init__(self, min_interval=1.0, max_interval=30.0, concurrency=10,
+                 sleep=time.sleep, clock=time.time, spawn=eventlet.spawn):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._pool = eventlet.GreenPool(concurrency)
+        self._sleep = sleep
+        self._clock = clock
+        self._spawn = spawn
+        self._pending = []
+        self._runner = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_conf(cls, conf):
+        return cls(min_interval=conf.azure.lro_min_poll_interval,
+                   max_interval=conf.azure.lro_max_poll_interval,
+                   concurrency=conf.azure.lro_poll_concurrency)
+
+    def submit(self, name, raw, get, deserialize, model=None):
+        """Track operation started by a raw sdk call, return its future.
+
+        model is given for raw requests without sdk output, result is
+        deserialized from response of it.
+        """
+        response = raw.response
+        output = raw.output
+        if model is None and output is not None:
+            model = type(output).__name__
+        op = Operation(name, get, deserialize, model)
+        method = response.request.method
+        async_url = response.headers.get(ASYNC_HEADER)
+        location = response.headers.get(LOCATION_HEADER)
+        if method in ('PUT', 'PATCH'):
+            op.final_url = response.request.url
+        elif method == 'POST' and async_url and location:
+            op.final_url = location
+        if async_url:
+            op.mode, op.status_url = ASYNC, async_url
+        elif location and response.status_code == 202:
+            op.mode, op.status_url = LOCATION, location
+        elif (method in ('PUT', 'PATCH') and
+                getattr(output, 'provisioning_state', None) not in
+                TERMINAL_STATES + (None,)):
+            op.mode, op.status_url = RESOURCE, response.request.url
+        else:
+            if output is None and model is not None and response.content:
+                output = deserialize(model, response)
+            op.finish(output)
+            return op
+        self._track(op, response)
+        return op
+
+    def resume(self, name, mode, status_url, final_url, model, get,
+               deserialize):
+        """Track operation submitted before, e.g. by last service run."""
+        op = Operation(name, get, deserialize, model)
+        op.mode = mode
+        op.status_url = status_url
+        op.final_url = final_url
+        self._track(op)
+        return op
+
+    def _track(self, op, response=None):
+        op.interval = self.min_interval
+        self._schedule(op, response)
+        with self._lock:
+            self._pending.append(op)
+            if self._runner is None:
+                self._runner = self._spawn(self._run)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _schedule(self, op, response=None):
+        delay = op.interval
+        retry_after = _retry_after(response) if response is not None \
+            else None
+        if retry_after is not None:
+            delay = retry_after
+        op.next_poll = self._clock() + delay
+        op.interval = min(self.max_interval, op.interval * 2)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._pending = [op for op in self._pending if not op.done()]
+                if not self._pending:
+                    self._runner = None
+                    return
+                now = self._clock()
+                due = [op for op in self._pending if op.next_poll <= now]
+                wait = min(op.next_poll for op in self._pending) - now
+            if not due:
+                self._sleep(min(wait, self.min_interval))
+                continue
+            for _ in self._pool.imap(self._poll, due):
+                pass
+
+    def _poll(self, op):
+        try:
+            self._poll_once(op)
+        except Exception as e:
+            LOG.exception(_LE("Poll operation %(name)s failed: %(reason)s"),
+                          dict(name=op.name, reason=six.text_type(e)))
+            op.finish(exception=e)
+
+    def _poll_once(self, op):
+        try:
+            response = op.get(op.status_url)
+        except Exception as e:
+            if not retry.is_transient(e):
+                raise
+            self._schedule(op)
+            return
+        if response.status_code in retry.TRANSIENT_STATUS:
+            self._schedule(op, response)
+            return
+        if response.status_code >= 400:
+            raise CloudError(response)
+
+        if op.mode == ASYNC:
+            state = _json(response).get('status', IN_PROGRESS)
+        elif op.mode == LOCATION:
+            state = IN_PROGRESS if response.status_code == 202 else SUCCEEDED
+        else:
+            properties = _json(response).get('properties') or {}
+            state = properties.get('provisioningState', SUCCEEDED)
+        if state not in TERMINAL_STATES:
+            self._schedule(op, response)
+            return
+        if state != SUCCEEDED:
+            raise CloudError(response)
+
+        final = None
+        if op.mode == RESOURCE or (op.mode == LOCATION and not op.final_url):
+            final = response
+        elif op.final_url:
+            final = op.get(op.final_url)
+            if final.status_code >= 400:
+                raise CloudError(final)
+        result = None
+        if op.model and final is not None and final.content:
+            result = op.deserialize(op.model, final)
+        op.finish(result)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(conf):
+    """The LROEngine shared by all Azure clients in this process."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = LROEngine.from_conf(conf)
+        return _engine
@@ -0,0 +1,79 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sys
+import threading
+
+import six
+from eventlet import tpool
+from msrest.paging import Paged
+from msrestazure.azure_operation import AzureOperationPoller
+
+
+class CompletedOperation(object):
+    """Long running operation already waited, keeps the sdk poller api.
+
+    sdk poller polls in a thread started when the operation is sent, with
+    eventlet monkey patch it's a green thread of the hub of the sending
+    thread. so the operation must be sent and waited in the same native
+    thread, and callers get this completed object instead of the poller.
+    """
+
+    def __init__(self, poller, timeout):
+        self._result = None
+        self._exc_info = None
+        try:
+            self._result = poller.result(timeout)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def _raise(self):
+        if self._exc_info:
+            six.reraise(*self._exc_info)
+
+    def wait(self, timeout=None):
+        self._raise()
+
+    def result(self, timeout=None):
+        self._raise()
+        return self._result
+
+    def done(self):
+        return True
+
+
+def _complete(timeout, func, *args, **kwargs):
+    """Invoke sdk method and finish all its http calls in this thread."""
+    result = func(*args, **kwargs)
+    if isinstance(result, AzureOperationPoller):
+        return CompletedOperation(result, timeout)
+    if isinstance(result, Paged):
+        # paged list sends requests while iterating, do it here.
+        return list(result)
+    return result
+
+
+class NativePool(object):
+    """Run blocking Azure sdk calls in native threads, off eventlet hub.
+
+    at most size calls run at the same time, others wait in green threads.
+    """
+
+    def __init__(self, size, timeout):
+        self.timeout = timeout
+        self._semaphore = threading.Semaphore(size)
+
+    def execute(self, func, *args, **kwargs):
+        with self._semaphore:
+            return tpool.execute(_complete, self.timeout, func,
+                                 *args, **kwargs)
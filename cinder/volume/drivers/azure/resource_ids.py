@@ -0,0 +1,29 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Build ARM resource ids without a GET.
+
+id of a resource is a pure function of subscription, resource group, type
+and name, the write call using it reports if the resource doesn't exist.
+"""
+
+DISKS = 'Microsoft.Compute/disks'
+SNAPSHOTS = 'Microsoft.Compute/snapshots'
+IMAGES = 'Microsoft.Compute/images'
+VIRTUAL_MACHINES = 'Microsoft.Compute/virtualMachines'
+NETWORK_INTERFACES = 'Microsoft.Network/networkInterfaces'
+
+
+def build(subscription_id, resource_group, resource_type, name):
+    return '/subscriptions/{}/resourceGroups/{}/providers/{}/{}'.format(
+        subscription_id, resource_group, resource_type, name)
@@ -0,0 +1,168 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import threading
+import time
+
+from cinder.i18n import _LW
+from msrest.exceptions import ClientRequestError
+from oslo_log import log as logging
+import requests
+
+LOG = logging.getLogger(__name__)
+
+# 408 request timeout, 429 throttled by ARM, 5xx transient server side error.
+TRANSIENT_STATUS = (408, 429, 500, 502, 503, 504)
+THROTTLED = 429
+# seconds for throttle score to decay to half.
+THROTTLE_HALF_LIFE = 60.0
+
+
+def get_status_code(ex):
+    """Status code of an azure exception, None if no http response."""
+    status = getattr(ex, 'status_code', None)
+    if status is None:
+        response = getattr(ex, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status
+
+
+def get_retry_after(ex):
+    """Seconds from Retry-After header of an azure exception, or None."""
+    response = getattr(ex, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(ex):
+    if isinstance(ex, (ClientRequestError, requests.ConnectionError,
+                       requests.Timeout)):
+        # connection reset or timeout, request never got a response. raw
+        # requests errors are from calls without sdk, e.g. page uploads.
+        return True
+    return get_status_code(ex) in TRANSIENT_STATUS
+
+
+class RetryBudget(object):
+    """Token bucket limits retries to a ratio of calls across the service.
+
+    every call deposits ratio token, every retry withdraws one token, and
+    min_per_second tokens are refilled so low traffic still can retry. during
+    an ARM incident retries stop once the bucket is empty, instead of
+    multiplying load on ARM.
+    """
+
+    def __init__(self, ratio, min_per_second=1.0, clock=time.time):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = max(1.0, min_per_second * 10)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + self.min_per_second *
+                          max(0, now - self._last))
+        self._last = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """Retry transient azure failures with decorrelated jitter.
+
+    Retry-After from ARM is honoured, every call has a deadline, and retries
+    are bounded by a shared RetryBudget.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0,
+                 deadline=120, budget=None, sleep=time.sleep,
+                 clock=time.time):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.budget = budget or RetryBudget(0.1, clock=clock)
+        self._sleep = sleep
+        self._clock = clock
+        self._throttle = 0.0
+        self._throttle_at = clock()
+
+    @classmethod
+    def from_conf(cls, conf):
+        return cls(max_attempts=conf.azure.retry_max_attempts,
+                   base_delay=conf.azure.retry_base_delay,
+                   max_delay=conf.azure.retry_max_delay,
+                   deadline=conf.azure.retry_deadline,
+                   budget=RetryBudget(conf.azure.retry_budget_ratio))
+
+    def throttle_score(self):
+        """Recent 429 count with exponential decay, 0 means not throttled."""
+        elapsed = self._clock() - self._throttle_at
+        return self._throttle * 0.5 ** (elapsed / THROTTLE_HALF_LIFE)
+
+    def _record_throttle(self):
+        self._throttle = self.throttle_score() + 1
+        self._throttle_at = self._clock()
+
+    def _next_delay(self, delay, ex):
+        delay = min(self.max_delay,
+                    random.uniform(self.base_delay, delay * 3))
+        retry_after = get_retry_after(ex)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def execute(self, func, *args, **kwargs):
+        deadline = self._clock() + self.deadline
+        delay = self.base_delay
+        attempt = 1
+        self.budget.deposit()
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if get_status_code(e) == THROTTLED:
+                    self._record_throttle()
+                if not is_transient(e) or attempt >= self.max_attempts:
+                    raise
+                delay = self._next_delay(delay, e)
+                if self._clock() + delay > deadline:
+                    raise
+                if not self.budget.withdraw():
+                    raise
+                LOG.warning(_LW("Azure call %(func)s failed with status "
+                                "%(status)s, retry %(attempt)s in %(delay).1f"
+                                " seconds."),
+                            dict(func=getattr(func, '__name__', func),
+                                 status=get_status_code(e),
+                                 attempt=attempt, delay=delay))
+            self._sleep(delay)
+            attempt += 1
@@ -0,0 +1,175 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import hashlib
+import time
+
+import six
+from azure.mgmt.compute.models import StorageAccountTypes
+from cinder import exception
+from cinder.i18n import _, _LW
+from cinder.volume.drivers.azure import resource_ids
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# managed disk count quota in compute usage list.
+DISK_COUNT_USAGE = {
+    StorageAccountTypes.premium_lrs.value: 'PremiumDiskCount',
+    StorageAccountTypes.standard_lrs.value: 'StandardDiskCount',
+}
+
+
+def parse_subscriptions(values):
+    """Parse 'subscription_id:resource_group' items of azure.subscriptions."""
+    subscriptions = []
+    for value in values or []:
+        subscription_id, _sep, resource_group = value.partition(':')
+        if not (subscription_id and resource_group):
+            message = (_("Subscription %s is invalid, should be "
+                         "subscription_id:resource_group.") % value)
+            raise exception.InvalidConfigurationValue(message)
+        subscriptions.append((subscription_id, resource_group))
+    return subscriptions
+
+
+def jump_hash(key, buckets):
+    """Bucket of key by jump consistent hash.
+
+    growing buckets from n to n + 1 only moves 1/(n + 1) keys, all to the
+    new bucket.
+    """
+    seed = int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        seed = (seed * 2862933555777941757 + 1) & 0xffffffffffffffff
+        jump = int((bucket + 1) * (float(1 << 31) / ((seed >> 33) + 1)))
+    return bucket
+
+
+def group_names(resource_group, count):
+    """Resource groups of a shard, resource_group itself is the first."""
+    return [resource_group] + ['{}-{}'.format(resource_group, i)
+                               for i in range(1, max(count, 1))]
+
+
+def build_shards(default_azure, azure_cls, conf):
+    """Shards of default subscription and azure.subscriptions, by name."""
+    count = conf.azure.resource_group_count
+    default = Shard(default_azure, conf.azure.subscription_id,
+                    conf.azure.resource_group, conf.azure.location, count)
+    shards = collections.OrderedDict([(default.name, default)])
+    for subscription_id, resource_group in \
+            parse_subscriptions(conf.azure.subscriptions):
+        name = '{}:{}'.format(subscription_id, resource_group)
+        if name not in shards:
+            shards[name] = Shard(
+                azure_cls(subscription_id=subscription_id,
+                          resource_group=resource_group),
+                subscription_id, resource_group, conf.azure.location,
+                count)
+    return shards
+
+
+class Shard(object):
+    """A subscription and resource group Azure resources placed in.
+
+    name of shard is persisted as provider_location of volume and snapshot,
+    and service_metadata of backup.
+    """
+
+    def __init__(self, azure, subscription_id, resource_group, location,
+                 group_count=1):
+        self.azure = azure
+        self.subscription_id = subscription_id
+        self.resource_group = resource_group
+        self.location = location
+        self.name = '{}:{}'.format(subscription_id, resource_group)
+        self.resource_groups = group_names(resource_group, group_count)
+        self._usages = {}
+        self._usages_at = 0
+
+    @property
+    def compute(self):
+        return self.azure.compute
+
+    @property
+    def disks(self):
+        return self.azure.compute.disks
+
+    @property
+    def snapshots(self):
+        return self.azure.compute.snapshots
+
+    @property
+    def images(self):
+        return self.azure.compute.images
+
+    def get_usage(self, usage_name, ttl=60):
+        """Return (limit, current_value) of usage, cached for ttl seconds."""
+        if time.time() - self._usages_at > ttl:
+            page = self.compute.usage.list(self.location)
+            self._usages = dict((i.name.value, (i.limit, i.current_value))
+                                for i in page)
+            self._usages_at = time.time()
+        return self._usages.get(usage_name, (0, 0))
+
+    def group_for(self, key=None):
+        """Resource group of resources of key, e.g. uuid of instance.
+
+        placed by consistent hash of key, no lookup needed. resources
+        without key are in resource_group.
+        """
+        if key is None or len(self.resource_groups) == 1:
+            return self.resource_group
+        return self.resource_groups[
+            jump_hash(key, len(self.resource_groups))]
+
+    def resource_id(self, resource_type, name, key=None):
+        return resource_ids.build(self.subscription_id,
+                                  self.group_for(key or name),
+                                  resource_type, name)
+
+    def throttle_score(self):
+        return self.azure.retry_policy.throttle_score()
+
+
+def choose_shard(shards, usage_name, amount=1, ttl=60):
+    """Choose shard with most quota headroom, less throttled is preferred.
+
+    score is remaining quota divided by recent throttle count, shards can't
+    hold amount are skipped. if no shard fits, return the first one and let
+    Azure report quota exceeded.
+    """
+    if len(shards) == 1:
+        return shards[0]
+    best = None
+    best_score = None
+    for shard in shards:
+        try:
+            limit, current = shard.get_usage(usage_name, ttl)
+        except Exception as e:
+            LOG.warning(_LW("Unable to get usage of %(shard)s because "
+                            "%(reason)s"),
+                        dict(shard=shard.name, reason=six.text_type(e)))
+            continue
+        headroom = limit - current - amount
+        if headroom < 0:
+            continue
+        score = headroom / (1.0 + shard.throttle_score())
+        if best is None or score > best_score:
+            best = shard
+            best_score = score
+    return best or shards[0]
@@ -0,0 +1,147 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+from oslo_utils import units
+import requests
+
+# pages of a page blob are 512 bytes, writes must be aligned to them.
+PAGE_SIZE = 512
+# largest range one put page call writes.
+MAX_RANGE = 4 * units.Mi
+STORAGE_VERSION = '2019-02-02'
+# zeros are compared a block at a time, pages only in blocks with data.
+ZERO_BLOCK = 64 * units.Ki
+# zero gaps shorter than this are written, not worth another put.
+MIN_SKIP = 64 * units.Ki
+_ZEROS = memoryview(bytes(bytearray(ZERO_BLOCK)))
+
+
+def _is_zero(view):
+    # memoryview compare is a memcmp, no python loop over bytes.
+    return view == _ZEROS[:len(view)]
+
+
+def data_runs(offset, data, min_skip=MIN_SKIP):
+    """(offset, data) of parts of a range with data, zero pages skipped.
+
+    zero pages at both ends are always skipped, inside the range only zero
+    gaps of min_skip bytes or longer are.
+    """
+    view = memoryview(data)
+    runs = []
+    start = None
+    for block in range(0, len(view), ZERO_BLOCK):
+        block_end = min(block + ZERO_BLOCK, len(view))
+        if _is_zero(view[block:block_end]):
+            if start is not None:
+                runs.append([start, block])
+                start = None
+            continue
+        for page in range(block, block_end, PAGE_SIZE):
+            if _is_zero(view[page:page + PAGE_SIZE]):
+                if start is not None:
+                    runs.append([start, page])
+                    start = None
+            elif start is None:
+                start = page
+    if start is not None:
+        runs.append([start, len(view)])
+    merged = []
+    for run in runs:
+        if merged and run[0] - merged[-1][1] < min_skip:
+            merged[-1][1] = run[1]
+        else:
+            merged.append(run)
+    return [(offset + begin, view[begin:end].tobytes())
+            for begin, end in merged]
+
+
+def iter_ranges(chunks, range_size=MAX_RANGE):
+    """Cut chunks of a byte stream into (offset, data) of range_size.
+
+    last range is padded with zeros to a whole page. only one range is
+    buffered, memory doesn't grow with the stream.
+    """
+    buf = bytearray()
+    offset = 0
+    for chunk in chunks:
+        buf.extend(chunk)
+        while len(buf) >= range_size:
+            yield offset, bytes(buf[:range_size])
+            del buf[:range_size]
+            offset += range_size
+    if buf:
+        buf.extend(b'\0' * (-len(buf) % PAGE_SIZE))
+        yield offset, bytes(buf)
+
+
+class PageUploader(object):
+    """Write a byte stream to a page blob by its SAS url, ranges at once.
+
+    at most workers ranges are written at the same time, reading the stream
+    waits for a free worker, so memory is about workers ranges. blob must
+    be new, its pages are zeros, so zero pages are skipped if skip_zeros.
+    """
+
+    def __init__(self, sas_url, workers=8, range_size=MAX_RANGE,
+                 retry_policy=None, session=None, skip_zeros=True):
+        self.url = sas_url + '&comp=page'
+        self.workers = workers
+        self.range_size = range_size
+        self.retry_policy = retry_policy
+        self.session = session or requests.Session()
+        self.skip_zeros = skip_zeros
+        self.written = 0
+        self.skipped = 0
+
+    def _put(self, offset, data):
+        headers = {'x-ms-version': STORAGE_VERSION,
+                   'x-ms-page-write': 'update',
+                   'x-ms-range': 'bytes={}-{}'.format(
+                       offset, offset + len(data) - 1)}
+        response = self.session.put(self.url, data=data, headers=headers)
+        response.raise_for_status()
+
+    def put_page(self, offset, data):
+        if self.retry_policy:
+            self.retry_policy.execute(self._put, offset, data)
+        else:
+            self._put(offset, data)
+        self.written += len(data)
+
+    def upload(self, chunks):
+        """Write chunks from offset 0, raise first failure of any range."""
+        errors = []
+
+        def _write(offset, data):
+            try:
+                self.put_page(offset, data)
+            except Exception as e:
+                errors.append(e)
+
+        pool = eventlet.GreenPool(self.workers)
+        for offset, data in iter_ranges(chunks, self.range_size):
+            if errors:
+                break
+            runs = [(offset, data)]
+            if self.skip_zeros:
+                runs = data_runs(offset, data)
+                self.skipped += len(data) - sum(len(i[1]) for i in runs)
+            for run_offset, run in runs:
+                # blocks until a worker is free.
+                pool.spawn_n(_write, run_offset, run)
+        pool.waitall()
+        if errors:
+            raise errors[0]
+        return self.written
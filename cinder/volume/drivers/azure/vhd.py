@@ -0,0 +1,223 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import heapq
+import struct
+import time
+import uuid
+
+from oslo_utils import units
+
+FOOTER_SIZE = 512
+# Azure takes fixed vhd of whole MBs.
+ALIGN = units.Mi
+# seconds from unix epoch to vhd epoch 2000-01-01.
+VHD_EPOCH = 946684800
+FIXED_DISK = 2
+FOOTER_FORMAT = '>8sIIQI4sI4sQQHBBII16sB427s'
+# zeros emitted at a time for holes.
+ZERO_CHUNK = units.Mi
+_ZEROS = bytes(bytearray(ZERO_CHUNK))
+
+QCOW2_MAGIC = b'QFI\xfb'
+QCOW2_HEADER_FORMAT = '>4sIQIIQIIQQIIQ'
+QCOW2_OFFSET_MASK = 0x00fffffffffffe00
+QCOW2_COMPRESSED = 1 << 62
+QCOW2_ZERO = 1
+_L1, _L2, _DATA = 0, 1, 2
+
+
+class ConvertError(ValueError):
+    pass
+
+
+def geometry(size):
+    """(cylinders, heads, sectors per track) of disk size, by vhd spec."""
+    sectors = min(size // 512, 65535 * 16 * 255)
+    if sectors >= 65535 * 16 * 63:
+        per_track, heads = 255, 16
+        cylinder_heads = sectors // per_track
+    else:
+        per_track = 17
+        cylinder_heads = sectors // per_track
+        heads = max((cylinder_heads + 1023) // 1024, 4)
+        if cylinder_heads >= heads * 1024 or heads > 16:
+            per_track, heads = 31, 16
+            cylinder_heads = sectors // per_track
+        if cylinder_heads >= heads * 1024:
+            per_track, heads = 63, 16
+            cylinder_heads = sectors // per_track
+    return cylinder_heads // heads, heads, per_track
+
+
+def footer(size, clock=time.time):
+    """Footer of fixed vhd of size data bytes."""
+    cylinders, heads, sectors = geometry(size)
+    fields = [b'conectix', 2, 0x10000, 0xffffffffffffffff,
+              (int(clock()) - VHD_EPOCH) & 0xffffffff, b'win ', 0xa0000,
+              b'Wi2k', size, size, cylinders, heads, sectors, FIXED_DISK, 0,
+              uuid.uuid4().bytes, 0, b'']
+    data = struct.pack(FOOTER_FORMAT, *fields)
+    checksum = ~sum(bytearray(data)) & 0xffffffff
+    fields[14] = checksum
+    return struct.pack(FOOTER_FORMAT, *fields)
+
+
+def aligned(size):
+    return -(-size // ALIGN) * ALIGN
+
+
+def _zeros(count):
+    while count > 0:
+        chunk = min(count, ZERO_CHUNK)
+        yield _ZEROS[:chunk]
+        count -= chunk
+
+
+class _Reader(object):
+    """Sequential reads of a chunk stream, only a chunk is buffered."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b''
+        self.pos = 0
+
+    def read(self, count):
+        parts = []
+        while count > 0:
+            if not self._buf:
+                self._buf = next(self._chunks, b'')
+                if not self._buf:
+                    raise ConvertError('image ends at %s' % self.pos)
+            part = self._buf[:count]
+            self._buf = self._buf[count:]
+            parts.append(part)
+            count -= len(part)
+            self.pos += len(part)
+        return b''.join(parts)
+
+    def skip_to(self, offset):
+        if offset < self.pos:
+            raise ConvertError('image is not in streaming order, %s is '
+                               'before %s' % (offset, self.pos))
+        while self.pos < offset:
+            self.read(min(offset - self.pos, ZERO_CHUNK))
+
+
+def _raw(chunks, size):
+    written = 0
+    for chunk in chunks:
+        written += len(chunk)
+        yield chunk
+    if written != size:
+        raise ConvertError('image is %s bytes, not %s' % (written, size))
+    for chunk in _zeros(aligned(size) - size):
+        yield chunk
+    yield footer(aligned(size))
+
+
+class Qcow2Reader(object):
+    """Read guest data of a qcow2 stream in one pass, no seek.
+
+    tables and clusters are read in order of their offsets in the file,
+    so data clusters must be in guest order, as qemu-img convert writes
+    them. only clusters of tables read but not yet reached are tracked.
+    """
+
+    def __init__(self, chunks):
+        self._reader = _Reader(chunks)
+        header = self._reader.read(struct.calcsize(QCOW2_HEADER_FORMAT))
+        (magic, version, backing_offset, _backing_size, cluster_bits,
+         self.size, crypt, l1_size, l1_offset, _refcount_offset,
+         _refcount_clusters, _snapshots,
+         _snapshots_offset) = struct.unpack(QCOW2_HEADER_FORMAT, header)
+        if magic != QCOW2_MAGIC or version not in (2, 3):
+            raise ConvertError('not a qcow2 v2 or v3 image')
+        if backing_offset or crypt:
+            raise ConvertError('qcow2 with backing file or encryption')
+        self.cluster_size = 1 << cluster_bits
+        self._l2_entries = self.cluster_size // 8
+        self._pending = [(l1_offset, _L1, l1_size)]
+
+    def _add(self, offset, kind, info):
+        heapq.heappush(self._pending, (offset, kind, info))
+
+    def __iter__(self):
+        """Yield guest data from offset 0 to size, holes are zeros."""
+        out = 0
+        while self._pending:
+            offset, kind, info = heapq.heappop(self._pending)
+            self._reader.skip_to(offset)
+            if kind == _L1:
+                table = struct.unpack('>%dQ' % info,
+                                      self._reader.read(info * 8))
+                for index, entry in enumerate(table):
+                    if entry & QCOW2_OFFSET_MASK:
+                        self._add(entry & QCOW2_OFFSET_MASK, _L2, index)
+            elif kind == _L2:
+                table = struct.unpack(
+                    '>%dQ' % self._l2_entries,
+                    self._reader.read(self.cluster_size))
+                base = info * self._l2_entries
+                for index, entry in enumerate(table):
+                    guest = (base + index) * self.cluster_size
+                    if entry & QCOW2_COMPRESSED:
+                        raise ConvertError('compressed qcow2 cluster')
+                    if (entry & QCOW2_ZERO or guest >= self.size or
+                            not entry & QCOW2_OFFSET_MASK):
+                        continue
+                    self._add(entry & QCOW2_OFFSET_MASK, _DATA, guest)
+            else:
+                if info < out:
+                    raise ConvertError('qcow2 clusters are not in guest '
+                                       'order')
+                for chunk in _zeros(info - out):
+                    yield chunk
+                data = self._reader.read(min(self.cluster_size,
+                                             self.size - info))
+                yield data
+                out = info + len(data)
+        for chunk in _zeros(self.size - out):
+            yield chunk
+
+
+def _qcow2(reader):
+    for chunk in reader:
+        yield chunk
+    for chunk in _zeros(aligned(reader.size) - reader.size):
+        yield chunk
+    yield footer(aligned(reader.size))
+
+
+def to_fixed_vhd(disk_format, chunks, image_size=None):
+    """Return (size, stream) of image as fixed vhd, converted on the fly.
+
+    raw is padded to whole MBs and followed by a footer, qcow2 clusters
+    are put at their guest offsets, fixed vhd is passed as is. memory is
+    about a chunk or a qcow2 cluster, nothing is staged on disk.
+    """
+    if disk_format == 'vhd':
+        if (not image_size or image_size <= FOOTER_SIZE or
+                (image_size - FOOTER_SIZE) % ALIGN):
+            raise ConvertError('vhd of %s bytes is not a fixed vhd of '
+                               'whole MBs' % image_size)
+        return image_size, iter(chunks)
+    if disk_format == 'raw':
+        if not image_size:
+            raise ConvertError('raw image size unknown')
+        return aligned(image_size) + FOOTER_SIZE, _raw(chunks, image_size)
+    if disk_format == 'qcow2':
+        reader = Qcow2Reader(chunks)
+        return aligned(reader.size) + FOOTER_SIZE, _qcow2(reader)
+    raise ConvertError('disk format %s can not be converted to vhd'
+                       % disk_format)
@@ -47,3 +47,16 @@ class AzureTestCase(test.NoDBTestCase):
         self.assertTrue(hasattr(azure, 'compute'))
         self.assertTrue(hasattr(azure, 'network'))
         self.assertTrue(hasattr(azure, 'storage'))
+
+
+class ClientProxyTestCase(test.NoDBTestCase):
+
+    def test_operations_invoke_through_invoker(self):
+        client = mock.Mock()
+        invoker = mock.Mock(return_value='vm')
+        proxy = adapter.ClientProxy(client, invoker)
+        ret = proxy.virtual_machines.get('rg', 'name')
+        self.assertEqual('vm', ret)
+        invoker.assert_called_once_with(
+            'virtual_machines', 'get', client.virtual_machines.get,
+            'rg', 'name')
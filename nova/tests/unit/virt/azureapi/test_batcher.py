@@ -0,0 +1,40 @@
+import eventlet
+import mock
+
+from nova import test
+from nova.virt.azureapi import batcher
+
+
+class BatcherTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(BatcherTestCase, self).setUp()
+        self.apply = mock.Mock(return_value={})
+        self.batcher = batcher.Batcher(self.apply, window=0,
+                                       sleep=lambda s: eventlet.sleep(0))
+
+    def test_concurrent_changes_one_apply(self):
+        threads = [eventlet.spawn(self.batcher.submit, 'vm', 'instance', i)
+                   for i in range(3)]
+        for t in threads:
+            t.wait()
+        self.apply.assert_called_once_with('instance', [0, 1, 2])
+
+    def test_each_change_own_error(self):
+        self.apply.return_value = {1: ValueError('no lun')}
+        threads = [eventlet.spawn(self.batcher.submit, 'vm', 'instance', i)
+                   for i in range(2)]
+        self.assertIsNone(threads[0].wait())
+        self.assertRaises(ValueError, threads[1].wait)
+
+    def test_apply_raise_fail_all(self):
+        self.apply.side_effect = ValueError('update failed')
+        threads = [eventlet.spawn(self.batcher.submit, 'vm', 'instance', i)
+                   for i in range(2)]
+        for t in threads:
+            self.assertRaises(ValueError, t.wait)
+
+    def test_different_keys_not_merged(self):
+        self.batcher.submit('vm1', 'instance1', 0)
+        self.batcher.submit('vm2', 'instance2', 1)
+        self.assertEqual(2, self.apply.call_count)
@@ -17,6 +17,8 @@ from nova.virt.azureapi.driver import AzureDriver
 from nova.virt.azureapi.driver import power_state
 from nova.virt.azureapi.driver import time
 from nova.virt.azureapi import exception
+from nova.virt.azureapi import resource_ids
+from nova.virt.azureapi import sharding
 from nova.virt import fake
 
 
@@ -57,7 +59,7 @@ class AzureDriverTestCase(test.NoDBTestCase):
                    storage_account='storage_account', location='location',
                    resource_group='resource_group', vnet_name='vnet_name',
                    vsubnet_id='vsubnet_id', vsubnet_name='vsubnet_name',
-                   cleanup_span=60)
+                   cleanup_span=60, volume_batch_window=0)
 
         self.drvr = AzureDriver(fake.FakeVirtAPI())
         self.drvr._image_api = mock.Mock()
@@ -185,10 +187,18 @@ class AzureDriverTestCase(test.NoDBTestCase):
             self.drvr.network.virtual_networks.delete.assert_called_with(
                 CONF.azure.resource_group, CONF.azure.vnet_name)
 
+    @mock.patch.object(loopingcall, 'FixedIntervalLoopingCall')
     @mock.patch.object(driver.AzureDriver, '_precreate_network')
-    def test_init_host(self, mock_precreate_network):
+    def test_init_host(self, mock_precreate_network, mock_timer):
         self.drvr.init_host('host')
         mock_precreate_network.assert_called()
+        mock_timer.return_value.start.assert_called_once_with(
+            interval=CONF.azure.usage_cache_ttl)
+
+    def test_refresh_usages_failed(self):
+        self.drvr.compute.usage.list.side_effect = Exception
+        self.drvr._refresh_usages()
+        self.assertFalse(self.drvr.default_shard.refreshed)
 
     def test_init_host_register_riase(self):
         self.drvr.blob.create_container.side_effect = \
@@ -197,6 +207,27 @@ class AzureDriverTestCase(test.NoDBTestCase):
                           self.drvr.init_host,
                           'host')
 
+    def test_get_shard_default(self):
+        shard = self.drvr._get_shard(self.fake_instance)
+        self.assertIs(self.drvr.default_shard, shard)
+
+    def test_place_instance(self):
+        self.fake_instance.save = mock.Mock()
+        shard = self.drvr._place_instance(self.fake_instance)
+        self.assertEqual(
+            shard.name,
+            self.fake_instance.system_metadata[sharding.SHARD_KEY])
+        self.assertIs(shard, self.drvr._get_shard(self.fake_instance))
+
+    def test_place_instance_node(self):
+        self.fake_instance.save = mock.Mock()
+        node_shard = sharding.Shard(mock.Mock(), 'sub', 'rg1', 'eastus',
+                                    'azure-eastus-rg1')
+        self.drvr.nodes['azure-eastus-rg1'] = [node_shard]
+        self.fake_instance.node = 'azure-eastus-rg1'
+        shard = self.drvr._place_instance(self.fake_instance)
+        self.assertIs(node_shard, shard)
+
     def test_get_host_ip_addr(self):
         ret = self.drvr.get_host_ip_addr()
         self.assertEqual(CONF.my_ip, ret)
@@ -205,6 +236,12 @@ class AzureDriverTestCase(test.NoDBTestCase):
         ret = self.drvr.get_available_nodes()
         self.assertEqual(['azure-' + CONF.azure.location], ret)
 
+    def test_get_available_nodes_multiple(self):
+        self.drvr.nodes['azure-eastus-rg1'] = []
+        ret = self.drvr.get_available_nodes()
+        self.assertEqual(['azure-' + CONF.azure.location,
+                          'azure-eastus-rg1'], ret)
+
     def test_list_instances_raise(self):
         self.drvr.compute.virtual_machines.list.side_effect = \
             Exception
@@ -221,6 +258,16 @@ class AzureDriverTestCase(test.NoDBTestCase):
         ret = self.drvr.list_instances()
         self.assertEqual([page_name, page_name], ret)
 
+    def test_list_instances_groups(self):
+        self.drvr.default_shard.resource_groups = ['rg', 'rg-1']
+        page = FakeObj()
+        page.name = 'page_name'
+        self.drvr.compute.virtual_machines.list.return_value = [page]
+        ret = self.drvr.list_instances()
+        self.assertEqual(['page_name', 'page_name'], ret)
+        self.drvr.compute.virtual_machines.list.assert_has_calls(
+            [mock.call('rg'), mock.call('rg-1')], any_order=True)
+
     @mock.patch.object(AzureDriver, 'list_instances')
     def test_list_instance_uuids(self, mock_list):
         instances = ['instance-1', 'instance-2']
@@ -319,9 +366,20 @@ class AzureDriverTestCase(test.NoDBTestCase):
         self.drvr.compute.usage.list.return_value = [
             azcpumodels.Usage(2, 8, azcpumodels.UsageName('cores')),
             azcpumodels.Usage(1, 4, azcpumodels.UsageName(usage_family))]
+        self.drvr.compute.virtual_machine_sizes.list.return_value = [
+            azcpumodels.VirtualMachineSize(
+                name='Basic_A2', number_of_cores=2,
+                resource_disk_size_in_mb=61440, memory_in_mb=3584)]
         available_resource = self.drvr.get_available_resource('node_name')
         self.assertEqual(4, available_resource['vcpus'])
         self.assertEqual(1, available_resource['vcpus_used'])
+        self.assertEqual(7168, available_resource['memory_mb'])
+        self.assertEqual(1792, available_resource['memory_mb_used'])
+        self.assertEqual(120, available_resource['local_gb'])
+        self.assertEqual(30, available_resource['local_gb_used'])
+        # later ticks use cached usages.
+        self.drvr.get_available_resource('node_name')
+        self.drvr.compute.usage.list.assert_called_once_with('location')
 
     def test_prepare_network_profile_raise(self):
         self.drvr.network.network_interfaces.create_or_update.side_effect = \
@@ -422,6 +480,59 @@ class AzureDriverTestCase(test.NoDBTestCase):
         vm = self.drvr._create_vm_parameters('', '', '', 'os_profile')
         self.assertIn('os_profile', vm)
 
+    def test_create_vm_parameters_data_disks(self):
+        vm = self.drvr._create_vm_parameters({}, '', '', None, ['disk'])
+        self.assertEqual(['disk'], vm['storage_profile']['data_disks'])
+
+    def test_prepare_data_disks(self):
+        bdm = [dict(mount_device='/dev/sda',
+                    connection_info=dict(data=dict(disk_name='root'))),
+               dict(mount_device='/dev/sdc',
+                    connection_info=dict(data=dict(disk_name='vol1'))),
+               dict(mount_device='/dev/sdd',
+                    connection_info=dict(data=dict(
+                        disk_name='vol2', subscription_id='subscription_id',
+                        resource_group='rg')))]
+        block_device_info = dict(block_device_mapping=bdm,
+                                 root_device_name='/dev/sda')
+        shard = self.drvr.default_shard
+        disks = self.drvr._prepare_data_disks(
+            self.fake_instance, block_device_info, shard)
+        self.assertEqual([1, 2], [i['lun'] for i in disks])
+        self.assertEqual(['vol1', 'vol2'], [i['name'] for i in disks])
+        self.assertEqual('attach', disks[0]['create_option'])
+        self.assertEqual(shard.resource_id(resource_ids.DISKS, 'vol1'),
+                         disks[0]['managed_disk']['id'])
+        self.assertIn('/subscriptions/subscription_id/resourceGroups/rg/',
+                      disks[1]['managed_disk']['id'])
+
+    def test_prepare_data_disks_other_subscription(self):
+        bdm = [dict(mount_device='/dev/sdc',
+                    connection_info=dict(data=dict(
+                        disk_name='vol1', volume_id='vol_id',
+                        subscription_id='sub', resource_group='rg')))]
+        block_device_info = dict(block_device_mapping=bdm,
+                                 root_device_name='/dev/sda')
+        self.assertRaises(nova_ex.VolumeAttachFailed,
+                          self.drvr._prepare_data_disks,
+                          self.fake_instance, block_device_info,
+                          self.drvr.default_shard)
+
+    def test_prepare_data_disks_too_many(self):
+        bdm = [dict(mount_device='/dev/sd%s' % i,
+                    connection_info=dict(data=dict(disk_name=str(i))))
+               for i in range(16)]
+        block_device_info = dict(block_device_mapping=bdm,
+                                 root_device_name='/dev/sda')
+        self.assertRaises(nova_ex.NovaException,
+                          self.drvr._prepare_data_disks,
+                          self.fake_instance, block_device_info,
+                          self.drvr.default_shard)
+
+    def test_prepare_data_disks_none(self):
+        self.assertEqual([], self.drvr._prepare_data_disks(
+            self.fake_instance, None, self.drvr.default_shard))
+
     @mock.patch.object(AzureDriver, '_get_image_from_mapping')
     def test_prepare_storage_profile_from_exported_image(
             self, mock_image_mapping):
@@ -609,6 +720,54 @@ class AzureDriverTestCase(test.NoDBTestCase):
             self.drvr._get_instance,
             self.fake_instance.uuid)
 
+    def test_get_instance_raw(self):
+        raw = mock.Mock(output='vm')
+        raw.response.headers = {'ETag': 'etag'}
+        self.drvr.compute.virtual_machines.get.return_value = raw
+        self.assertEqual(('vm', 'etag'), self.drvr._get_instance(
+            self.fake_instance.uuid, raw=True))
+
+    @mock.patch.object(AzureDriver, '_get_instance')
+    def test_update_instance_conflict_retry(self, mo_get):
+        mo_get.side_effect = [('vm1', 'etag1'), ('vm2', 'etag2')]
+        response = mock.Mock(status_code=412)
+        request = self.drvr.default_shard.azure.request
+        request.side_effect = [
+            exception.CloudError(response, error='PreconditionFailed'),
+            FakeAction]
+        mutate = mock.Mock(return_value={'properties': {}})
+        self.drvr._update_instance(self.fake_instance, mutate)
+        mutate.assert_has_calls([mock.call('vm1'), mock.call('vm2')])
+        self.assertEqual({'If-Match': 'etag2'}, request.call_args[0][5])
+
+    @mock.patch.object(driver.LOG, 'warning')
+    @mock.patch.object(AzureDriver, '_get_instance')
+    def test_update_instance_no_etag(self, mo_get, mo_warning):
+        mo_get.return_value = ('vm', None)
+        request = self.drvr.default_shard.azure.request
+        request.return_value = FakeAction
+        mutate = mock.Mock(return_value={'properties': {}})
+        self.drvr._update_instance(self.fake_instance, mutate)
+        self.drvr._update_instance(self.fake_instance, mutate)
+        # no precondition, and it is logged once.
+        self.assertIsNone(request.call_args[0][5])
+        mo_warning.assert_called_once()
+
+    @mock.patch.object(AzureDriver, '_get_instance')
+    def test_update_instance_nothing_changed(self, mo_get):
+        mo_get.return_value = ('vm', 'etag')
+        self.drvr._update_instance(self.fake_instance,
+                                   mock.Mock(return_value=None))
+        self.drvr.default_shard.azure.request.assert_not_called()
+
+    @mock.patch.object(AzureDriver, '_get_instance')
+    def test_update_instance_raise(self, mo_get):
+        mo_get.return_value = ('vm', None)
+        self.drvr.default_shard.azure.request.side_effect = Exception
+        self.assertRaises(exception.InstanceCreateUpdateFailure,
+                          self.drvr._update_instance, self.fake_instance,
+                          mock.Mock(return_value={'properties': {}}))
+
     def test_get_instance_raise(self):
         # raise test
         self.drvr.compute.virtual_machines.get.side_effect = Exception
@@ -809,8 +968,7 @@ class AzureDriverTestCase(test.NoDBTestCase):
 
     @mock.patch.object(AzureDriver, '_get_new_size')
     @mock.patch.object(AzureDriver, '_get_instance')
-    @mock.patch.object(AzureDriver, '_create_update_instance')
-    def test_migrate_disk_and_power_off(self, mo_create, mo_get, mo_size):
+    def test_migrate_disk_and_power_off(self, mo_get, mo_size):
         # not raise
         size_old = 'size_old'
         size_new = 'size_new'
@@ -819,11 +977,16 @@ class AzureDriverTestCase(test.NoDBTestCase):
         vm_size_obj.vm_size = size_old
         vm_ojb.hardware_profile = vm_size_obj
         mo_size.return_value = size_new
-        mo_get.return_value = vm_ojb
+        mo_get.return_value = (vm_ojb, 'etag')
         flag = self.drvr.migrate_disk_and_power_off(
             'cont', self.fake_instance, 'dest', 'flavor', 'net')
         self.assertEqual(True, flag)
         self.assertEqual(size_new, vm_ojb.hardware_profile.vm_size)
+        request = self.drvr.default_shard.azure.request
+        body = request.call_args[0][4]
+        self.assertEqual({'properties': {'hardwareProfile': {
+            'vmSize': size_new}}}, body)
+        self.assertEqual({'If-Match': 'etag'}, request.call_args[0][5])
 
     def test_get_volume_connector(self):
         ret = self.drvr.get_volume_connector(self.fake_instance)
@@ -844,9 +1007,8 @@ class AzureDriverTestCase(test.NoDBTestCase):
         ret = self.drvr._check_password(password)
         self.assertEqual(True, ret)
 
-    @mock.patch.object(AzureDriver, '_get_instance')
-    @mock.patch.object(AzureDriver, '_create_update_instance')
-    def test_attach_volume_raise(self, mo_create, mo_get):
+    @mock.patch.object(AzureDriver, '_update_instance')
+    def test_attach_volume_raise(self, mo_update):
         vm_ojb = FakeObj()
         luns = [FakeObj() for i in range(16)]
         for i in range(16):
@@ -854,8 +1016,8 @@ class AzureDriverTestCase(test.NoDBTestCase):
         data_disks_obj = FakeObj()
         data_disks_obj.data_disks = luns
         vm_ojb.storage_profile = data_disks_obj
-        mo_get.return_value = vm_ojb
-        conn_info = dict(data=dict(vhd_name='vhd_name',
+        mo_update.side_effect = lambda instance, mutate: mutate(vm_ojb)
+        conn_info = dict(data=dict(disk_name='vhd_name',
                                    vhd_uri='vhd_uri',
                                    vhd_size_gb='vhd_size_gb'))
         # raise
@@ -864,9 +1026,8 @@ class AzureDriverTestCase(test.NoDBTestCase):
             self.drvr.attach_volume,
             *('cont', conn_info, self.fake_instance, 'mp'))
 
-    @mock.patch.object(AzureDriver, '_get_instance')
-    @mock.patch.object(AzureDriver, '_create_update_instance')
-    def test_attach_volume(self, mo_create, mo_get):
+    @mock.patch.object(AzureDriver, '_update_instance')
+    def test_attach_volume(self, mo_update):
         # not raise
         lun_ojb = FakeObj()
         lun_ojb.lun = 1
@@ -874,8 +1035,8 @@ class AzureDriverTestCase(test.NoDBTestCase):
         data_disks_obj.data_disks = [lun_ojb]
         vm_ojb = FakeObj()
         vm_ojb.storage_profile = data_disks_obj
-        mo_get.return_value = vm_ojb
-        conn_info = dict(data=dict(vhd_name='vhd_name',
+        mo_update.side_effect = lambda instance, mutate: mutate(vm_ojb)
+        conn_info = dict(data=dict(disk_name='vhd_name',
                                    vhd_uri='vhd_uri',
                                    vhd_size_gb='vhd_size_gb'))
         self.drvr.attach_volume(
@@ -883,9 +1044,19 @@ class AzureDriverTestCase(test.NoDBTestCase):
         self.assertEqual(2, len(data_disks_obj.data_disks))
         self.assertEqual(2, data_disks_obj.data_disks[1]['lun'])
 
-    @mock.patch.object(AzureDriver, '_get_instance')
-    @mock.patch.object(AzureDriver, '_create_update_instance')
-    def test_detach_volume_not_found(self, mo_create, mo_get):
+    @mock.patch.object(AzureDriver, '_update_instance')
+    def test_attach_volume_other_subscription(self, mo_update):
+        conn_info = dict(data=dict(disk_name='vhd_name', volume_id='vol_id',
+                                   subscription_id='sub',
+                                   resource_group='rg'))
+        self.assertRaises(
+            nova_ex.VolumeAttachFailed,
+            self.drvr.attach_volume,
+            'cont', conn_info, self.fake_instance, 'mp')
+        mo_update.assert_not_called()
+
+    @mock.patch.object(AzureDriver, '_update_instance')
+    def test_detach_volume_not_found(self, mo_update):
         disk_name = 'disk_name'
         vm_ojb = FakeObj()
         disk = FakeObj()
@@ -893,17 +1064,17 @@ class AzureDriverTestCase(test.NoDBTestCase):
         data_disks_obj = FakeObj()
         data_disks_obj.data_disks = [disk]
         vm_ojb.storage_profile = data_disks_obj
-        mo_get.return_value = vm_ojb
-        conn_info = dict(data=dict(vhd_name=disk_name,
+        mo_update.side_effect = lambda instance, mutate: mutate(vm_ojb)
+        conn_info = dict(data=dict(disk_name=disk_name,
                                    vhd_uri='vhd_uri',
                                    vhd_size_gb='vhd_size_gb'))
         # not found, no raise
         self.drvr.detach_volume(conn_info, self.fake_instance, 'mp')
-        self.assertEqual(0, mo_create.call_count)
+        self.assertEqual([disk], data_disks_obj.data_disks)
+        self.assertIsNone(mo_update.call_args[0][1](vm_ojb))
 
-    @mock.patch.object(AzureDriver, '_get_instance')
-    @mock.patch.object(AzureDriver, '_create_update_instance')
-    def test_detach_volume(self, mo_create, mo_get):
+    @mock.patch.object(AzureDriver, '_update_instance')
+    def test_detach_volume(self, mo_update):
         # not raise
         disk_name = 'disk_name'
         disk = FakeObj()
@@ -912,14 +1083,34 @@ class AzureDriverTestCase(test.NoDBTestCase):
         data_disks_obj.data_disks = [disk]
         vm_ojb = FakeObj()
         vm_ojb.storage_profile = data_disks_obj
-        mo_get.return_value = vm_ojb
-        conn_info = dict(data=dict(vhd_name=disk_name,
+        mo_update.side_effect = lambda instance, mutate: mutate(vm_ojb)
+        conn_info = dict(data=dict(disk_name=disk_name,
                                    vhd_uri='vhd_uri',
                                    vhd_size_gb='vhd_size_gb'))
         self.drvr.detach_volume(conn_info, self.fake_instance, 'mp')
-        self.assertEqual(1, mo_create.call_count)
+        self.assertEqual(1, mo_update.call_count)
         self.assertEqual(0, len(data_disks_obj.data_disks))
 
+    @mock.patch.object(AzureDriver, '_update_instance')
+    def test_apply_volume_changes_one_update(self, mo_update):
+        detached = FakeObj()
+        detached.name = 'volume-1'
+        detached.lun = 1
+        data_disks_obj = FakeObj()
+        data_disks_obj.data_disks = [detached]
+        vm_ojb = FakeObj()
+        vm_ojb.storage_profile = data_disks_obj
+        mo_update.side_effect = lambda instance, mutate: mutate(vm_ojb)
+        changes = [driver.VolumeChange(driver.ATTACH, 'volume-2', 'id2'),
+                   driver.VolumeChange(driver.DETACH, 'volume-1', None),
+                   driver.VolumeChange(driver.ATTACH, 'volume-3', 'id3')]
+        errors = self.drvr._apply_volume_changes(self.fake_instance, changes)
+        self.assertEqual({}, errors)
+        mo_update.assert_called_once_with(self.fake_instance, mock.ANY)
+        self.assertEqual([('volume-2', 2), ('volume-3', 1)],
+                         [(i['name'], i['lun'])
+                          for i in data_disks_obj.data_disks])
+
     @mock.patch.object(AzureDriver, '_copy_blob')
     @mock.patch.object(AzureDriver, '_cleanup_deleted_snapshots')
     def test_snapshot(self, mock_cleanup_snpshot, mock_copy):
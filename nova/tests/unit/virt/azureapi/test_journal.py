@@ -0,0 +1,87 @@
+import os
+
+import fixtures
+import mock
+
+from nova import test
+from nova.virt.azureapi import journal
+
+STATUS_URL = 'https://management.azure.com/operations/1'
+
+
+class JournalTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(JournalTestCase, self).setUp()
+        path = self.useFixture(fixtures.TempDir()).path
+        self.now = 0
+        self.journal = journal.Journal(os.path.join(path, 'ops.sqlite'),
+                                       max_age=100, clock=lambda: self.now)
+        self.op = mock.Mock(mode='async', status_url=STATUS_URL,
+                            final_url=None, model='VirtualMachine')
+        self.op.name = 'virtual_machines.create_or_update'
+
+    def _reopen(self):
+        return journal.Journal(self.journal.path, max_age=100,
+                               clock=lambda: self.now)
+
+    def test_make_key(self):
+        key = journal.make_key('sub', 'virtual_machines', 'start',
+                               ('rg', 'vm'))
+        self.assertEqual('sub/virtual_machines.start/rg/vm', key)
+
+    def test_make_key_hash_body(self):
+        def key(body, **kwargs):
+            return journal.make_key('sub', 'disks', 'create_or_update',
+                                    ('rg', 'disk', body), kwargs)
+        self.assertTrue(key({'disk_size_gb': 10}).startswith(
+            'sub/disks.create_or_update/rg/disk#'))
+        self.assertEqual(key({'disk_size_gb': 10, 'location': 'westus'}),
+                         key({'location': 'westus', 'disk_size_gb': 10}))
+        self.assertNotEqual(key({'disk_size_gb': 10}),
+                            key({'disk_size_gb': 20}))
+        self.assertNotEqual(key({'disk_size_gb': 10}),
+                            key({'disk_size_gb': 10}, polling=False))
+
+    def test_record_find_remove(self):
+        self.journal.record('key', self.op)
+        # recorded by this process, sent again instead of resumed.
+        self.assertIsNone(self.journal.find('key'))
+        reopened = self._reopen()
+        self.assertEqual(dict(name='virtual_machines.create_or_update',
+                              mode='async', status_url=STATUS_URL,
+                              final_url=None, model='VirtualMachine'),
+                         reopened.find('key'))
+        # resumed once only.
+        self.assertIsNone(reopened.find('key'))
+        reopened.remove('key')
+        self.assertIsNone(self._reopen().find('key'))
+
+    def test_remove_superseded(self):
+        self.journal.record('key', self.op)
+        reopened = self._reopen()
+        new_op = mock.Mock(mode='async', status_url=STATUS_URL + '0',
+                           final_url=None, model='VirtualMachine')
+        new_op.name = self.op.name
+        reopened.record('key', new_op)
+        self.assertIsNone(reopened.find('key'))
+        # old operation finished, record of new one is kept.
+        reopened.remove('key', STATUS_URL)
+        self.assertEqual(STATUS_URL + '0',
+                         self._reopen().find('key')['status_url'])
+
+    def test_find_expired(self):
+        self.journal.record('key', self.op)
+        self.now = 101
+        self.assertIsNone(self._reopen().find('key'))
+
+    def test_survive_restart(self):
+        self.journal.record('key', self.op)
+        reopened = journal.Journal(self.journal.path,
+                                   clock=lambda: self.now)
+        self.assertEqual(STATUS_URL, reopened.find('key')['status_url'])
+
+    def test_disabled(self):
+        disabled = journal.Journal('')
+        disabled.record('key', self.op)
+        self.assertIsNone(disabled.find('key'))
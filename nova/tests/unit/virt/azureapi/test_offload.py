@@ -0,0 +1,41 @@
+import mock
+from msrestazure.azure_operation import AzureOperationPoller
+
+from nova import test
+from nova.virt.azureapi import offload
+
+
+class NativePoolTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(NativePoolTestCase, self).setUp()
+        self.pool = offload.NativePool(2, 600)
+
+    @mock.patch.object(offload.tpool, 'execute')
+    def test_execute_in_tpool(self, mock_execute):
+        func = mock.Mock()
+        mock_execute.return_value = 'vm'
+        self.assertEqual('vm', self.pool.execute(func, 'rg', 'vm'))
+        mock_execute.assert_called_once_with(offload._complete, 600, func,
+                                             'rg', 'vm')
+
+    def test_complete_plain_result(self):
+        func = mock.Mock(return_value='vm')
+        self.assertEqual('vm', offload._complete(600, func, 'rg'))
+        func.assert_called_once_with('rg')
+
+    def test_complete_waits_poller(self):
+        poller = mock.Mock(spec=AzureOperationPoller)
+        poller.result.return_value = 'vm'
+        op = offload._complete(600, mock.Mock(return_value=poller))
+        poller.result.assert_called_once_with(600)
+        self.assertTrue(op.done())
+        self.assertEqual('vm', op.result())
+        op.wait(10)
+
+    def test_completed_operation_reraise(self):
+        poller = mock.Mock(spec=AzureOperationPoller)
+        poller.result.side_effect = ValueError('failed')
+        op = offload.CompletedOperation(poller, 600)
+        self.assertRaises(ValueError, op.wait)
+        self.assertRaises(ValueError, op.result)
@@ -0,0 +1,84 @@
+import mock
+
+from msrest.exceptions import ClientRequestError
+from nova import test
+from nova.virt.azureapi import retry
+
+
+class FakeHttpError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super(FakeHttpError, self).__init__(status_code)
+        self.status_code = status_code
+        self.response = mock.Mock(headers={})
+        if retry_after is not None:
+            self.response.headers['Retry-After'] = str(retry_after)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RetryPolicyTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(RetryPolicyTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.budget = retry.RetryBudget(0.1, clock=self.clock)
+        self.policy = retry.RetryPolicy(
+            max_attempts=4, base_delay=1, max_delay=30, deadline=120,
+            budget=self.budget, sleep=self.clock.sleep, clock=self.clock)
+
+    def test_is_transient(self):
+        self.assertTrue(retry.is_transient(FakeHttpError(429)))
+        self.assertTrue(retry.is_transient(FakeHttpError(503)))
+        self.assertTrue(retry.is_transient(ClientRequestError('reset')))
+        self.assertFalse(retry.is_transient(FakeHttpError(404)))
+        self.assertFalse(retry.is_transient(Exception()))
+
+    def test_execute_retry_transient(self):
+        func = mock.Mock(side_effect=[FakeHttpError(500), 'vm'])
+        self.assertEqual('vm', self.policy.execute(func, 'rg', 'name'))
+        func.assert_called_with('rg', 'name')
+        self.assertEqual(2, func.call_count)
+
+    def test_execute_no_retry_non_transient(self):
+        func = mock.Mock(side_effect=FakeHttpError(404))
+        self.assertRaises(FakeHttpError, self.policy.execute, func)
+        self.assertEqual(1, func.call_count)
+
+    def test_execute_max_attempts(self):
+        func = mock.Mock(side_effect=FakeHttpError(503))
+        self.assertRaises(FakeHttpError, self.policy.execute, func)
+        self.assertEqual(4, func.call_count)
+
+    def test_execute_honour_retry_after(self):
+        func = mock.Mock(side_effect=[FakeHttpError(429, 17), 'vm'])
+        self.policy.execute(func)
+        self.assertGreaterEqual(self.clock.now, 17)
+
+    def test_execute_retry_after_beyond_deadline(self):
+        func = mock.Mock(side_effect=[FakeHttpError(429, 600), 'vm'])
+        self.assertRaises(FakeHttpError, self.policy.execute, func)
+        self.assertEqual(1, func.call_count)
+
+    def test_execute_budget_exhausted(self):
+        self.budget.tokens = 0
+        self.budget.min_per_second = 0
+        func = mock.Mock(side_effect=[FakeHttpError(503), 'vm'])
+        self.assertRaises(FakeHttpError, self.policy.execute, func)
+        self.assertEqual(1, func.call_count)
+
+    def test_throttle_score_decay(self):
+        func = mock.Mock(side_effect=[FakeHttpError(429, 0), 'vm'])
+        self.policy.execute(func)
+        score = self.policy.throttle_score()
+        self.assertGreater(score, 0.9)
+        self.clock.now += retry.THROTTLE_HALF_LIFE
+        self.assertAlmostEqual(score / 2, self.policy.throttle_score())
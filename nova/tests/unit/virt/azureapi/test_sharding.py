@@ -0,0 +1,177 @@
+import mock
+
+from nova import conf
+from nova import test
+from nova.virt.azureapi import exception
+from nova.virt.azureapi import resource_ids
+from nova.virt.azureapi import sharding
+
+CONF = conf.CONF
+
+
+class FakeUsage(object):
+    def __init__(self, name, limit, current_value):
+        self.name = mock.Mock(value=name)
+        self.limit = limit
+        self.current_value = current_value
+
+
+def _fake_shard(name, limit, current, throttle=0):
+    azure = mock.Mock()
+    azure.compute.usage.list.return_value = [
+        FakeUsage(sharding.CORES_USAGE, limit, current)]
+    azure.compute.virtual_machine_sizes.list.return_value = []
+    azure.retry_policy.throttle_score.return_value = throttle
+    return sharding.Shard(azure, name, 'rg', 'westus')
+
+
+class ShardingTestCase(test.NoDBTestCase):
+
+    def test_parse_subscriptions(self):
+        ret = sharding.parse_subscriptions(['sub1:rg1', 'sub2:rg2'])
+        self.assertEqual([('sub1', 'rg1'), ('sub2', 'rg2')], ret)
+
+    def test_parse_subscriptions_invalid(self):
+        self.assertRaises(exception.SubscriptionInvalid,
+                          sharding.parse_subscriptions, ['sub1'])
+
+    def test_build_shards(self):
+        self.flags(group='azure', subscription_id='sub0',
+                   resource_group='rg0',
+                   subscriptions=['sub0:rg0', 'sub1:rg1'])
+        azure_cls = mock.Mock()
+        shards = sharding.build_shards('default', azure_cls, CONF)
+        self.assertEqual(['sub0:rg0', 'sub1:rg1'], list(shards.keys()))
+        self.assertEqual('default', shards['sub0:rg0'].azure)
+        azure_cls.assert_called_once_with('sub1', 'rg1')
+
+    def test_parse_nodes(self):
+        ret = sharding.parse_nodes(['eastus:rg1', 'westus:rg2'])
+        self.assertEqual([('eastus', 'rg1'), ('westus', 'rg2')], ret)
+
+    def test_parse_nodes_invalid(self):
+        self.assertRaises(exception.NodeInvalid,
+                          sharding.parse_nodes, ['eastus'])
+
+    def test_build_shards_nodes(self):
+        self.flags(group='azure', subscription_id='sub0',
+                   resource_group='rg0', location='westus',
+                   subscriptions=['sub1:rg1'], nodes=['eastus:rg2'])
+        azure_cls = mock.Mock()
+        shards = sharding.build_shards('default', azure_cls, CONF)
+        self.assertEqual(['sub0:rg0', 'sub1:rg1', 'sub0:rg2'],
+                         list(shards.keys()))
+        self.assertEqual('eastus', shards['sub0:rg2'].location)
+        azure_cls.assert_called_with('sub0', 'rg2', 'eastus')
+        nodes = sharding.group_nodes(shards.values())
+        self.assertEqual(['azure-westus', 'azure-eastus-rg2'],
+                         list(nodes.keys()))
+        self.assertEqual(2, len(nodes['azure-westus']))
+        self.assertEqual([1, 1, 1], [i.quota_shares for i in shards.values()])
+
+    @mock.patch.object(sharding.LOG, 'warning')
+    def test_build_shards_duplicate(self, mo_warning):
+        self.flags(group='azure', subscription_id='sub0',
+                   resource_group='rg0', location='westus',
+                   subscriptions=['sub1:rg1', 'sub1:rg1'],
+                   nodes=['eastus:rg2', 'centralus:rg2', 'eastus:rg0'])
+        shards = sharding.build_shards('default', mock.Mock(), CONF)
+        self.assertEqual(['sub0:rg0', 'sub1:rg1', 'sub0:rg2'],
+                         list(shards.keys()))
+        self.assertEqual('eastus', shards['sub0:rg2'].location)
+        self.assertEqual(3, mo_warning.call_count)
+
+    def test_build_shards_share_quota(self):
+        self.flags(group='azure', subscription_id='sub0',
+                   resource_group='rg0', location='westus',
+                   subscriptions=['sub1:rg1'],
+                   nodes=['westus:rg2', 'westus:rg3'])
+        shards = sharding.build_shards('default', mock.Mock(), CONF)
+        # default node and two nodes in westus of sub0.
+        self.assertEqual(3, shards['sub0:rg0'].quota_shares)
+        self.assertEqual(3, shards['sub0:rg3'].quota_shares)
+        self.assertEqual(1, shards['sub1:rg1'].quota_shares)
+
+    def test_shard_resource_id(self):
+        shard = sharding.Shard(mock.Mock(), 'sub', 'rg', 'westus')
+        self.assertEqual(
+            '/subscriptions/sub/resourceGroups/rg/providers/'
+            'Microsoft.Compute/disks/volume-1',
+            shard.resource_id(resource_ids.DISKS, 'volume-1'))
+
+    def test_shard_usage_cached(self):
+        shard = _fake_shard('sub', 10, 2)
+        self.assertEqual((10, 2), shard.get_usage(sharding.CORES_USAGE))
+        self.assertEqual((10, 2), shard.get_usage(sharding.CORES_USAGE))
+        shard.compute.usage.list.assert_called_once_with('westus')
+
+    def test_size_family(self):
+        for name, family in (('Basic_A0', 'basicAFamily'),
+                             ('Standard_DS2_v2', 'standardDSv2Family'),
+                             ('Standard_D2s_v3', 'standardDSv3Family'),
+                             ('Standard_F4', 'standardFFamily'),
+                             ('unknown', None)):
+            self.assertEqual(family, sharding.size_family(name))
+
+    def test_shard_capacity(self):
+        shard = _fake_shard('sub', 10, 2)
+        shard.compute.usage.list.return_value += [
+            FakeUsage('basicAFamily', 20, 4),
+            FakeUsage('standardDSv2Family', 10, 2)]
+        shard.compute.virtual_machine_sizes.list.return_value = [
+            mock.Mock(number_of_cores=1, memory_in_mb=768,
+                      resource_disk_size_in_mb=20480),
+            mock.Mock(number_of_cores=2, memory_in_mb=7168,
+                      resource_disk_size_in_mb=14336)]
+        sizes = shard.compute.virtual_machine_sizes.list.return_value
+        sizes[0].name = 'Basic_A0'
+        sizes[1].name = 'Standard_DS2_v2'
+        shard.refresh()
+        capacity = shard.capacity(['Basic_A0', 'Standard_DS2_v2'])
+        # 30 family cores bounded by 10 regional cores.
+        self.assertEqual(10, capacity['vcpus'])
+        self.assertEqual(6, capacity['vcpus_used'])
+        self.assertEqual((20 * 768 + 10 * 3584) // 3,
+                         capacity['memory_mb'])
+        self.assertEqual(4 * 768 + 2 * 3584, capacity['memory_mb_used'])
+        shard.quota_shares = 2
+        capacity = shard.capacity(['Basic_A0', 'Standard_DS2_v2'])
+        self.assertEqual(5, capacity['vcpus'])
+        self.assertEqual(3, capacity['vcpus_used'])
+
+    def test_jump_hash_consistent(self):
+        keys = ['key-%d' % i for i in range(200)]
+        before = [sharding.jump_hash(k, 4) for k in keys]
+        after = [sharding.jump_hash(k, 5) for k in keys]
+        self.assertEqual(set(range(4)), set(before))
+        for old, new in zip(before, after):
+            self.assertIn(new, (old, 4))
+
+    def test_shard_group_for(self):
+        shard = sharding.Shard(mock.Mock(), 'sub', 'rg', 'westus',
+                               group_count=3)
+        self.assertEqual(['rg', 'rg-1', 'rg-2'], shard.resource_groups)
+        self.assertEqual('rg', shard.group_for())
+        group = shard.group_for('volume-1')
+        self.assertIn(group, shard.resource_groups)
+        self.assertEqual(group, shard.group_for('volume-1'))
+        self.assertEqual(
+            '/subscriptions/sub/resourceGroups/{}/providers/'
+            'Microsoft.Compute/disks/volume-1'.format(group),
+            shard.resource_id(resource_ids.DISKS, 'volume-1'))
+
+    def test_choose_shard_most_headroom(self):
+        shards = [_fake_shard('sub1', 10, 8), _fake_shard('sub2', 10, 2)]
+        self.assertIs(shards[1],
+                      sharding.choose_shard(shards, sharding.CORES_USAGE, 1))
+
+    def test_choose_shard_less_throttled(self):
+        shards = [_fake_shard('sub1', 10, 2, throttle=5),
+                  _fake_shard('sub2', 10, 4)]
+        self.assertIs(shards[1],
+                      sharding.choose_shard(shards, sharding.CORES_USAGE, 1))
+
+    def test_choose_shard_no_fit(self):
+        shards = [_fake_shard('sub1', 4, 4), _fake_shard('sub2', 4, 4)]
+        self.assertIs(shards[0],
+                      sharding.choose_shard(shards, sharding.CORES_USAGE, 2))
@@ -0,0 +1,65 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+
+class _Batch(object):
+    def __init__(self):
+        self.changes = []
+        self.errors = {}
+        self.done = threading.Event()
+
+
+class Batcher(object):
+    """Merge concurrent changes of the same key into one apply call.
+
+    the first submitter of a key waits window seconds to collect changes
+    submitted by others, then calls apply(target, changes) once. apply
+    returns {index: exception} of changes failed alone, if apply raises all
+    changes fail with it. every submitter gets the result of its own change.
+    """
+
+    def __init__(self, apply, window=0.5, sleep=time.sleep):
+        self.window = window
+        self._apply = apply
+        self._sleep = sleep
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, target, change):
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[key] = _Batch()
+            index = len(batch.changes)
+            batch.changes.append(change)
+
+        if leader:
+            self._sleep(self.window)
+            with self._lock:
+                del self._batches[key]
+            try:
+                batch.errors = self._apply(target, batch.changes) or {}
+            except Exception as e:
+                batch.errors = dict((i, e) for i in range(len(batch.changes)))
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        error = batch.errors.get(index)
+        if error is not None:
+            raise error
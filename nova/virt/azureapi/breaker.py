@@ -0,0 +1,126 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+import time
+
+from nova.i18n import _LI, _LW
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+READ = 'read'
+WRITE = 'write'
+
+
+def get_op_class(method_name):
+    """get/list calls are reads, others(create, delete, power...) writes."""
+    if method_name.startswith('get') or method_name.startswith('list'):
+        return READ
+    return WRITE
+
+
+class CircuitBreaker(object):
+    """Fail fast when calls to an Azure endpoint keep failing.
+
+    closed: calls pass, open once error rate in window exceed error_rate.
+    open: calls rejected until cooldown passed, then half open.
+    half_open: one probe call at a time, success close, failure reopen.
+    """
+
+    def __init__(self, name, error_rate=0.5, min_calls=10, window=60,
+                 cooldown=30, clock=time.time):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._clock = clock
+        self._calls = collections.deque()
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        return max(0, int(self._opened_at + self.cooldown - self._clock()))
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if self._clock() - self._opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                LOG.info(_LI('Circuit %s half open, probing Azure.'),
+                         self.name)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def _trip(self):
+        self.state = OPEN
+        self._opened_at = self._clock()
+        self._calls.clear()
+        LOG.warning(_LW('Circuit %(name)s open, fail fast for %(cooldown)s '
+                        'seconds.'), dict(name=self.name,
+                                          cooldown=self.cooldown))
+
+    def record(self, success):
+        with self._lock:
+            now = self._clock()
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if success:
+                    self.state = CLOSED
+                    LOG.info(_LI('Circuit %s closed.'), self.name)
+                else:
+                    self._trip()
+                return
+            self._calls.append((now, success))
+            while self._calls and now - self._calls[0][0] > self.window:
+                self._calls.popleft()
+            failures = len([i for i in self._calls if not i[1]])
+            if (len(self._calls) >= self.min_calls and
+                    failures >= self.error_rate * len(self._calls)):
+                self._trip()
+
+
+class BreakerRegistry(object):
+    """One CircuitBreaker per endpoint(operations group) and op class."""
+
+    def __init__(self, error_rate=0.5, min_calls=10, window=60, cooldown=30):
+        self._kwargs = dict(error_rate=error_rate, min_calls=min_calls,
+                            window=window, cooldown=cooldown)
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_conf(cls, conf):
+        return cls(error_rate=conf.azure.breaker_error_rate,
+                   min_calls=conf.azure.breaker_min_calls,
+                   window=conf.azure.breaker_window,
+                   cooldown=conf.azure.breaker_cooldown)
+
+    def get(self, endpoint, op_class):
+        key = (endpoint, op_class)
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(
+                    '{}:{}'.format(endpoint, op_class), **self._kwargs)
+            return self._breakers[key]
@@ -55,7 +55,85 @@ azure_opts = [
                     'in Azure.'),
     cfg.IntOpt('async_timeout',
                default=600,
-               help='Timeout for async api invoke.')
+               help='Timeout for async api invoke.'),
+    cfg.IntOpt('retry_max_attempts',
+               default=4,
+               help='Max attempts of an Azure api call on throttling or '
+                    'server side errors, include the first attempt.'),
+    cfg.FloatOpt('retry_base_delay',
+                 default=1.0,
+                 help='Min delay in seconds between retries of Azure api.'),
+    cfg.FloatOpt('retry_max_delay',
+                 default=30.0,
+                 help='Max delay in seconds between retries of Azure api, '
+                      'unless Azure asks for longer with Retry-After.'),
+    cfg.IntOpt('retry_deadline',
+               default=120,
+               help='Seconds an Azure api call may spend on retries.'),
+    cfg.FloatOpt('retry_budget_ratio',
+                 default=0.1,
+                 help='Retries allowed per Azure api call across the service,'
+                      ' avoid retry storm during Azure incident.'),
+    cfg.FloatOpt('breaker_error_rate',
+                 default=0.5,
+                 help='Error rate of Azure api calls to open the circuit, '
+                      'then calls fail fast instead of waiting timeout.'),
+    cfg.IntOpt('breaker_min_calls',
+               default=10,
+               help='Min calls in window before circuit can be opened.'),
+    cfg.IntOpt('breaker_window',
+               default=60,
+               help='Window in seconds to calculate error rate.'),
+    cfg.IntOpt('breaker_cooldown',
+               default=30,
+               help='Seconds an open circuit fail fast before probing Azure'
+                    ' again.'),
+    cfg.ListOpt('subscriptions',
+                default=[],
+                help='Extra subscriptions to place instances in, items are '
+                     'subscription_id:resource_group. New instance placed '
+                     'by remaining cores quota and throttling.'),
+    cfg.ListOpt('nodes',
+                default=[],
+                help='Extra nodes exposed by this compute service, items are '
+                     'location:resource_group in the default subscription. '
+                     'Each node has its own network and resources, nodes '
+                     'in the same location share subscription quota.'),
+    cfg.IntOpt('resource_group_count',
+               default=1,
+               min=1,
+               help='Resource groups to spread instances of each subscription '
+                    'over, chosen by consistent hash of instance uuid. Groups '
+                    'are resource_group and resource_group-1 to -N-1. '
+                    'Existing resources are not moved, set it before use.'),
+    cfg.IntOpt('usage_cache_ttl',
+               default=60,
+               help='Seconds to cache compute usage of subscription.'),
+    cfg.IntOpt('sdk_thread_pool_size',
+               default=20,
+               help='Max Azure sdk calls run in native threads at the same '
+                    'time.'),
+    cfg.FloatOpt('lro_min_poll_interval',
+                 default=1.0,
+                 help='Seconds before first poll of long running operation, '
+                      'doubled every poll, Retry-After from Azure overrides '
+                      'it.'),
+    cfg.FloatOpt('lro_max_poll_interval',
+                 default=30.0,
+                 help='Max seconds between polls of long running '
+                      'operation.'),
+    cfg.IntOpt('lro_poll_concurrency',
+               default=10,
+               help='Max long running operations polled at the same time.'),
+    cfg.StrOpt('operation_journal',
+               default='$state_path/azure_operations.sqlite',
+               help='Sqlite file of Azure operations in flight, resumed '
+                    'after service restart instead of sent again. Empty '
+                    'disables it.'),
+    cfg.FloatOpt('volume_batch_window',
+                 default=0.5,
+                 help='Seconds to collect concurrent attach/detach of an '
+                      'instance, applied in one vm update.')
 ]
 
 
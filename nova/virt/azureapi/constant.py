@@ -64,8 +64,8 @@ vm size in azure:
 {'name': u'Basic_A4', 'number_of_cores': 8, 'resource_disk_size_in_mb': 245760,
  'memory_in_mb': 14336, 'max_data_disk_count': 16,'os_disk_size_in_mb':1047552}
 
-if mapping to other flavor family in azure, need to change "usage_family" in
- "get_available_resource" method.
+capacity reported in "get_available_resource" is quota of families of sizes
+here, memory and disk of it follow the vm size catalog of location.
 Note: flavor details are not exactly same between 2 sides of mapping.
 """
 FLAVOR_MAPPING = {
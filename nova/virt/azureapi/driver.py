@@ -11,6 +11,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import eventlet
 import netaddr
 import re
 import six
@@ -23,10 +25,14 @@ from nova.compute import vm_mode
 from nova import conf
 from nova import exception as nova_ex
 from nova import image
-from nova.i18n import _LW, _LE, _LI
+from nova.i18n import _, _LW, _LE, _LI
 from nova.virt.azureapi.adapter import Azure
+from nova.virt.azureapi import batcher
 from nova.virt.azureapi import constant
 from nova.virt.azureapi import exception
+from nova.virt.azureapi import resource_ids
+from nova.virt.azureapi import retry
+from nova.virt.azureapi import sharding
 from nova.virt import driver
 from nova.virt.hardware import InstanceInfo
 from nova.volume import cinder
@@ -54,6 +60,41 @@ WINDOWS_OFFER = ['WindowsServerEssentials']
 LINUX_OS = 'linux'
 WINDOWS_OS = 'windows'
 
+ATTACH = 'attach'
+DETACH = 'detach'
+VolumeChange = collections.namedtuple('VolumeChange',
+                                      ['action', 'disk_name', 'disk_id'])
+
+
+# vm PATCH is newer than the pinned sdk, sent as raw request.
+VM_API_VERSION = '2017-12-01'
+# etag mismatch or concurrent operation on vm, retry with a fresh read.
+UPDATE_CONFLICT = (409, 412)
+UPDATE_ATTEMPTS = 3
+
+
+def _disk_attr(disk, name, default=None):
+    # data disks from Azure are models, disks appended by driver are dicts.
+    if isinstance(disk, dict):
+        return disk.get(name, default)
+    return getattr(disk, name, default)
+
+
+def _data_disk_body(disk):
+    """REST body of a data disk, PATCH replaces the whole data disk list."""
+    body = {
+        'lun': _disk_attr(disk, 'lun'),
+        'name': _disk_attr(disk, 'name'),
+        'createOption': 'Attach',
+        'managedDisk': {
+            'id': _disk_attr(_disk_attr(disk, 'managed_disk'), 'id')
+        }
+    }
+    caching = _disk_attr(disk, 'caching')
+    if caching:
+        body['caching'] = getattr(caching, 'value', caching)
+    return body
+
 
 class AzureDriver(driver.ComputeDriver):
     capabilities = {
@@ -70,6 +111,9 @@ class AzureDriver(driver.ComputeDriver):
             self.azure = Azure()
             self.disks = self.azure.compute.disks
             self.images = self.azure.compute.images
+            self.shards = sharding.build_shards(self.azure, Azure, CONF)
+            self.default_shard = list(self.shards.values())[0]
+            self.nodes = sharding.group_nodes(self.shards.values())
         except Exception as e:
             msg = (_LI("Initialize Azure Adapter failed. reason: %"),
                    six.text_type(e))
@@ -86,11 +130,37 @@ class AzureDriver(driver.ComputeDriver):
 
         self.cleanup_time = time.time()
         self.residual_nics = []
+        self.usage_timer = None
+        self.volume_batcher = batcher.Batcher(
+            self._apply_volume_changes, CONF.azure.volume_batch_window)
+        self._no_etag_logged = False
 
     # def _get_blob_name(self, name):
     #     """Get blob name from volume name"""
     #     return '{}.{}'.format(name, VHD_EXT)
 
+    def _get_shard(self, instance):
+        """Get shard instance placed in, default shard if not placed."""
+        name = instance.system_metadata.get(sharding.SHARD_KEY)
+        return self.shards.get(name, self.default_shard)
+
+    def _get_node_shards(self, nodename):
+        """Shards of node, shards of default node if node is unknown."""
+        return self.nodes.get(nodename) or self.nodes[self.default_shard.node]
+
+    def _place_instance(self, instance):
+        """Choose shard for new instance and persist it in instance.
+
+        only shards of the node scheduler picked for instance are chosen.
+        """
+        shard = sharding.choose_shard(
+            self._get_node_shards(instance.node), sharding.CORES_USAGE,
+            instance.flavor.vcpus, CONF.azure.usage_cache_ttl)
+        instance.system_metadata[sharding.SHARD_KEY] = shard.name
+        instance.save()
+        LOG.info(_LI("Place instance in %s"), shard.name, instance=instance)
+        return shard
+
     def _is_valid_cidr(self, address):
         """Verify that address represents a valid CIDR address.
 
@@ -116,8 +186,9 @@ class AzureDriver(driver.ComputeDriver):
 
         return True
 
-    def _precreate_network(self):
+    def _precreate_network(self, shard=None):
         """Pre Create Network info in Azure."""
+        shard = shard or self.default_shard
         # check cidr format
         net_cidr = CONF.azure.vnet_cidr
         subnet_cidr = CONF.azure.vsubnet_cidr
@@ -129,20 +200,20 @@ class AzureDriver(driver.ComputeDriver):
             raise exception.NetworkCreateFailure(reason=msg)
         # Creaet Network
         try:
-            nets = self.network.virtual_networks.list(
-                CONF.azure.resource_group)
+            nets = shard.network.virtual_networks.list(
+                shard.resource_group)
             net_exist = False
             for i in nets:
                 if i.name == CONF.azure.vnet_name:
                     net_exist = True
                     break
             if not net_exist:
-                network_info = dict(location=CONF.azure.location,
+                network_info = dict(location=shard.location,
                                     address_space=dict(
                                         address_prefixes=[net_cidr]))
                 async_vnet_creation = \
-                    self.network.virtual_networks.create_or_update(
-                        CONF.azure.resource_group,
+                    shard.network.virtual_networks.create_or_update(
+                        shard.resource_group,
                         CONF.azure.vnet_name,
                         network_info)
                 async_vnet_creation.wait(CONF.azure.async_timeout)
@@ -156,8 +227,8 @@ class AzureDriver(driver.ComputeDriver):
         # Create Subnet
         try:
             # subnet can't recreate, check existing before create.
-            subnets = self.network.subnets.list(
-                CONF.azure.resource_group,
+            subnets = shard.network.subnets.list(
+                shard.resource_group,
                 CONF.azure.vnet_name)
             subnet_exist = False
             subnet_details = None
@@ -168,8 +239,8 @@ class AzureDriver(driver.ComputeDriver):
                     break
             if not subnet_exist:
                 subnet_info = {'address_prefix': subnet_cidr}
-                async_subnet_creation = self.network.subnets.create_or_update(
-                    CONF.azure.resource_group,
+                async_subnet_creation = shard.network.subnets.create_or_update(
+                    shard.resource_group,
                     CONF.azure.vnet_name,
                     CONF.azure.vsubnet_name,
                     subnet_info
@@ -178,8 +249,8 @@ class AzureDriver(driver.ComputeDriver):
         except Exception as e:
             # delete network if subnet create fail.
             try:
-                async_vm_action = self.network.virtual_networks.delete(
-                    CONF.azure.resource_group, CONF.azure.vnet_name)
+                async_vm_action = shard.network.virtual_networks.delete(
+                    shard.resource_group, CONF.azure.vnet_name)
                 async_vm_action.wait(CONF.azure.async_timeout)
                 LOG.info(_LI("Deleted Network %s after Subnet create "
                              "failed."), CONF.azure.vnet_name)
@@ -190,8 +261,10 @@ class AzureDriver(driver.ComputeDriver):
             ex = exception.SubnetCreateFailure(reason=msg)
             LOG.exception(msg)
             raise ex
-        CONF.set_override('vsubnet_id', subnet_details.id, 'azure')
-        LOG.info(_LI("Create/Update Subnet: %s"), CONF.azure.vsubnet_id)
+        shard.vsubnet_id = subnet_details.id
+        if shard is self.default_shard:
+            CONF.set_override('vsubnet_id', subnet_details.id, 'azure')
+        LOG.info(_LI("Create/Update Subnet: %s"), shard.vsubnet_id)
 
     def init_host(self, host):
         """All resources initial for driver can be repeate create, so no check
@@ -199,14 +272,28 @@ class AzureDriver(driver.ComputeDriver):
         exist needed, and no roll back needed, as anyway we need to create
         these resources.
         """
-        self._precreate_network()
+        for shard in self.shards.values():
+            self._precreate_network(shard)
         LOG.info(_LI("Create/Update Ntwork and Subnet, Done."))
+        self.usage_timer = loopingcall.FixedIntervalLoopingCall(
+            self._refresh_usages)
+        self.usage_timer.start(interval=CONF.azure.usage_cache_ttl)
+
+    def _refresh_usages(self):
+        """Refresh cached usages of shards, stale ones kept if failed."""
+        for shard in self.shards.values():
+            try:
+                shard.refresh()
+            except Exception as e:
+                LOG.warning(_LW("Unable to refresh usage of %(shard)s "
+                                "because %(reason)s"),
+                            dict(shard=shard.name, reason=six.text_type(e)))
 
     def get_host_ip_addr(self):
         return CONF.my_ip
 
     def get_available_nodes(self, refresh=False):
-        return ['azure-{}'.format(CONF.azure.location)]
+        return list(self.nodes.keys())
 
     def list_instances(self):
         """Return the names of all the instances known to the virtualization
@@ -214,20 +301,38 @@ class AzureDriver(driver.ComputeDriver):
         layer, as a list.
         """
         instances = []
-        try:
-            pages = self.compute.virtual_machines.list(
-                CONF.azure.resource_group)
-        except Exception as e:
-            msg = six.text_type(e)
-            LOG.exception(msg)
-            ex = exception.InstanceListFailure(reason=six.text_type(e))
-            raise ex
-        else:
+        for _shard, _group, pages in self._list_groups(
+                self.shards.values(),
+                lambda shard, group:
+                shard.compute.virtual_machines.list(group)):
+            if isinstance(pages, Exception):
+                msg = six.text_type(pages)
+                LOG.error(msg)
+                ex = exception.InstanceListFailure(reason=msg)
+                raise ex
             if pages:
                 for i in pages:
                     instances.append(i.name)
         return instances
 
+    def _list_groups(self, shards, list_func):
+        """Call list_func(shard, resource_group) of all groups in parallel.
+
+        return [(shard, resource_group, result)], result is the exception
+        if list_func raised.
+        """
+        def _list(args):
+            shard, group = args
+            try:
+                return shard, group, list_func(shard, group)
+            except Exception as e:
+                return shard, group, e
+
+        groups = [(shard, group) for shard in shards
+                  for group in shard.resource_groups]
+        pool = eventlet.GreenPool(CONF.azure.sdk_thread_pool_size)
+        return list(pool.imap(_list, groups))
+
     def list_instance_uuids(self):
         """Return the UUIDS of all the instances known to the virtualization
 
@@ -247,9 +352,11 @@ class AzureDriver(driver.ComputeDriver):
         instance_id = instance.uuid
         state = power_state.NOSTATE
         status = 'Unkown'
+        shard = self._get_shard(instance)
         try:
-            vm = self.compute.virtual_machines.get(
-                CONF.azure.resource_group, instance_id, expand='instanceView')
+            vm = shard.compute.virtual_machines.get(
+                shard.group_for(instance_id), instance_id,
+                expand='instanceView')
         # azure may raise msrestazure.azure_exceptions CloudError
         except exception.CloudError as e:
             msg = six.text_type(e)
@@ -289,32 +396,31 @@ class AzureDriver(driver.ComputeDriver):
         curent_time = time.time()
         if curent_time - self.cleanup_time > CONF.azure.cleanup_span:
             self.cleanup_time = curent_time
-            self._cleanup_deleted_os_disks()
-            self._cleanup_deleted_nics()
-        usage_family = 'basicAFamily'
-        try:
-            page = self.compute.usage.list(CONF.azure.location)
-        except Exception as e:
-            msg = six.text_type(e)
-            LOG.exception(msg)
-            ex = exception.ComputeUsageListFailure(reason=six.text_type(e))
-            raise ex
-        usages = [i for i in page]
-        cores = 0
-        cores_used = 0
-        for i in usages:
-            if hasattr(i, 'name') and hasattr(i.name, 'value'):
-                if usage_family == i.name.value:
-                    cores = i.limit if hasattr(i, 'limit') else 0
-                    cores_used = i.current_value \
-                        if hasattr(i, 'current_value') else 0
-                    break
-        return {'vcpus': cores,
-                'memory_mb': 100000000,
-                'local_gb': 100000000,
-                'vcpus_used': cores_used,
-                'memory_mb_used': 0,
-                'local_gb_used': 0,
+            for shard in self.shards.values():
+                self._cleanup_deleted_os_disks(shard)
+                self._cleanup_deleted_nics(shard)
+        sizes = set(constant.FLAVOR_MAPPING.values())
+        resource = dict(vcpus=0, vcpus_used=0, memory_mb=0, memory_mb_used=0,
+                        local_gb=0, local_gb_used=0)
+        for shard in self._get_node_shards(nodename):
+            # usages are refreshed by timer, only first tick lists them.
+            if not shard.refreshed:
+                try:
+                    shard.refresh()
+                except Exception as e:
+                    msg = six.text_type(e)
+                    LOG.exception(msg)
+                    ex = exception.ComputeUsageListFailure(
+                        reason=six.text_type(e))
+                    raise ex
+            for key, value in shard.capacity(sizes).items():
+                resource[key] += value
+        return {'vcpus': resource['vcpus'],
+                'memory_mb': resource['memory_mb'],
+                'local_gb': resource['local_gb'],
+                'vcpus_used': resource['vcpus_used'],
+                'memory_mb_used': resource['memory_mb_used'],
+                'local_gb_used': resource['local_gb_used'],
                 'hypervisor_type': hv_type.HYPERV,
                 'hypervisor_version': 300,
                 'hypervisor_hostname': nodename,
@@ -328,21 +434,22 @@ class AzureDriver(driver.ComputeDriver):
                 'numa_topology': None
                 }
 
-    def _prepare_network_profile(self, instance_uuid):
+    def _prepare_network_profile(self, instance_uuid, shard=None):
         """Create a Network Interface for a VM."""
+        shard = shard or self.default_shard
         network_interface = {
-            'location': CONF.azure.location,
+            'location': shard.location,
             'ip_configurations': [{
                 'name': instance_uuid,
                 'subnet': {
-                    'id': CONF.azure.vsubnet_id
+                    'id': shard.vsubnet_id or CONF.azure.vsubnet_id
                 }
             }]
         }
         try:
             async_nic_creation = \
-                self.network.network_interfaces.create_or_update(
-                    CONF.azure.resource_group,
+                shard.network.network_interfaces.create_or_update(
+                    shard.group_for(instance_uuid),
                     instance_uuid,
                     network_interface)
             nic = async_nic_creation.result()
@@ -437,13 +544,16 @@ class AzureDriver(driver.ComputeDriver):
         return os_profile
 
     def _create_vm_parameters(self, storage_profile, vm_size,
-                              network_profile, os_profile):
+                              network_profile, os_profile, data_disks=None,
+                              location=None):
         """Create the VM parameters structure, including all info to create
 
         an instance.
         """
+        if data_disks:
+            storage_profile['data_disks'] = data_disks
         vm_parameters = {
-            'location': CONF.azure.location,
+            'location': location or CONF.azure.location,
             'os_profile': os_profile,
             'hardware_profile': {
                 'vm_size': vm_size
@@ -570,24 +680,58 @@ class AzureDriver(driver.ComputeDriver):
 
         return storage_profile
 
-    def _attach_block_device(self, context, instance, block_device_info):
+    def _prepare_data_disks(self, instance, block_device_info, shard):
+        """Data disks of non root volumes, attached when vm is created.
+
+        luns are assigned from 1 in block device order, root device is
+        attached automatically when boot.
+        """
         block_device_mapping = []
         if block_device_info is not None:
             block_device_mapping = driver.block_device_info_get_mapping(
                 block_device_info)
-        if block_device_mapping:
-            msg = "Block device information present: %s" % block_device_info
-            LOG.debug(msg, instance=instance)
-
-            root_device_name = \
-                driver.block_device_info_get_root(block_device_info)
-            for disk in block_device_mapping:
-                connection_info = disk['connection_info']
-                # if non root device, do attach. root device will automatic
-                # attach when boot.
-                if root_device_name != disk['mount_device']:
-                    self.attach_volume(context, connection_info,
-                                       instance, None)
+        if not block_device_mapping:
+            return []
+        msg = "Block device information present: %s" % block_device_info
+        LOG.debug(msg, instance=instance)
+        root_device_name = \
+            driver.block_device_info_get_root(block_device_info)
+        data_disks = []
+        for disk in block_device_mapping:
+            if root_device_name == disk['mount_device']:
+                continue
+            data = disk['connection_info']['data']
+            lun = len(data_disks) + 1
+            # azure allow upto 16 extra datadisk, 1 os disk + 1 ephemeral
+            # disk, ephemeral disk will always be sdb for linux.
+            if lun >= 16:
+                msg = 'Can not attach volume, exist volume amount upto 16.'
+                LOG.error(msg, instance=instance)
+                raise nova_ex.NovaException(msg)
+            disk_id = self._get_volume_disk_id(data, shard)
+            data_disks.append(dict(lun=lun,
+                                   name=data['disk_name'],
+                                   managed_disk=dict(id=disk_id),
+                                   create_option='attach'))
+        return data_disks
+
+    def _get_volume_disk_id(self, data, shard):
+        """Id of volume disk in connection data, to attach to vm of shard.
+
+        volume disk must be in same subscription with vm, otherwise Azure
+        rejects the vm update with an unclear error.
+        """
+        subscription_id = data.get('subscription_id', shard.subscription_id)
+        if subscription_id != shard.subscription_id:
+            raise nova_ex.VolumeAttachFailed(
+                volume_id=data.get('volume_id', data['disk_name']),
+                reason=_("volume disk is in subscription %(volume)s, "
+                         "instance is in subscription %(instance)s.")
+                % dict(volume=subscription_id,
+                       instance=shard.subscription_id))
+        return resource_ids.build(
+            subscription_id, data.get('resource_group', shard.resource_group),
+            resource_ids.DISKS, data['disk_name'])
 
     def _is_booted_from_volume(self, instance, disk_mapping=None):
         """Determines whether the VM is booting from volume
@@ -607,19 +751,24 @@ class AzureDriver(driver.ComputeDriver):
         instance_uuid = instance.uuid
         try:
             vm_size = self._get_size_from_flavor(instance.get_flavor())
-            network_profile = self._prepare_network_profile(instance_uuid)
+            shard = self._place_instance(instance)
+            network_profile = self._prepare_network_profile(instance_uuid,
+                                                            shard)
             storage_profile = self._prepare_storage_profile(
                 context, image_meta, instance, block_device_info)
             os_profile = self._prepare_os_profile(
                 instance, storage_profile, admin_password)
+            # volumes are attached in the vm create, not one update each.
+            data_disks = self._prepare_data_disks(
+                instance, block_device_info, shard)
             vm_parameters = self._create_vm_parameters(
-                storage_profile, vm_size, network_profile, os_profile)
+                storage_profile, vm_size, network_profile, os_profile,
+                data_disks, shard.location)
 
             self._create_update_instance(instance, vm_parameters)
             LOG.info(_LI("Create Instance in Azure Finish."),
                      instance=instance)
 
-            self._attach_block_device(context, instance, block_device_info)
             self._delete_boot_from_volume_tmp_blob(instance)
 
         except Exception as e:
@@ -652,10 +801,12 @@ class AzureDriver(driver.ComputeDriver):
                 LOG.info(_LI("Delete volume tmp lv: %s blob in"
                              " Azure"), instance.uuid)
 
-    def _get_instance(self, instance_uuid):
+    def _get_instance(self, instance_uuid, shard=None, raw=False):
+        """Get vm, with raw return (vm, etag) for optimistic update."""
+        shard = shard or self.default_shard
         try:
-            vm = self.compute.virtual_machines.get(
-                CONF.azure.resource_group, instance_uuid)
+            vm = shard.compute.virtual_machines.get(
+                shard.group_for(instance_uuid), instance_uuid, raw=raw)
         except exception.AzureMissingResourceHttpError:
             ex = nova_ex.InstanceNotFound(instance_id=instance_uuid)
             msg = six.text_type(ex)
@@ -667,12 +818,15 @@ class AzureDriver(driver.ComputeDriver):
             msg = six.text_type(ex)
             LOG.exception(msg)
             raise ex
+        if raw:
+            return vm.output, vm.response.headers.get('ETag')
         return vm
 
     def _create_update_instance(self, instance, vm_parameters):
+        shard = self._get_shard(instance)
         try:
-            async_vm_action = self.compute.virtual_machines.create_or_update(
-                CONF.azure.resource_group, instance.uuid, vm_parameters)
+            async_vm_action = shard.compute.virtual_machines.create_or_update(
+                shard.group_for(instance.uuid), instance.uuid, vm_parameters)
             LOG.debug("Calling Create/Update Instance in Azure "
                       "...", instance=instance)
             async_vm_action.wait(CONF.azure.async_timeout)
@@ -690,6 +844,52 @@ class AzureDriver(driver.ComputeDriver):
                 reason=msg, instance_uuid=instance.uuid)
             raise ex
 
+    def _update_instance(self, instance, mutate):
+        """PATCH changed fields of vm, If-Match ETag of the read if any.
+
+        mutate(vm) changes vm got from Azure and returns the changed fields
+        as PATCH body, None if nothing to change. vm api versions the sdk
+        and VM_API_VERSION speak return no ETag, then the PATCH is sent
+        without precondition and a concurrent update by others may be lost;
+        updates from this driver are merged per vm by volume_batcher. on
+        conflict, e.g. another operation in progress, retry with a fresh
+        read.
+        """
+        shard = self._get_shard(instance)
+        vm_id = shard.resource_id(resource_ids.VIRTUAL_MACHINES,
+                                  instance.uuid)
+        for attempt in range(1, UPDATE_ATTEMPTS + 1):
+            vm, etag = self._get_instance(instance.uuid, shard, raw=True)
+            body = mutate(vm)
+            if body is None:
+                return
+            headers = {'If-Match': etag} if etag else None
+            if not etag and not self._no_etag_logged:
+                self._no_etag_logged = True
+                LOG.warning(_LW("Azure returns no ETag of vm, updates of vm "
+                                "are not guarded against concurrent "
+                                "changes."), instance=instance)
+            try:
+                async_vm_action = shard.azure.request(
+                    'virtual_machines', 'PATCH', vm_id, VM_API_VERSION,
+                    body, headers)
+                LOG.debug("Calling Update Instance in Azure ...",
+                          instance=instance)
+                async_vm_action.wait(CONF.azure.async_timeout)
+            except Exception as e:
+                if (retry.get_status_code(e) in UPDATE_CONFLICT and
+                        attempt < UPDATE_ATTEMPTS):
+                    LOG.warning(_LW("Instance updated by others, retry "
+                                    "with a fresh read."), instance=instance)
+                    continue
+                msg = six.text_type(e)
+                LOG.exception(msg)
+                raise exception.InstanceCreateUpdateFailure(
+                    reason=msg, instance_uuid=instance.uuid)
+            LOG.info(_LI("Update Instance in Azure Finish."),
+                     instance=instance)
+            return
+
     def _get_name_from_id(self, prefix, resource_id):
         return '{}-{}'.format(prefix, resource_id)
 
@@ -734,9 +934,10 @@ class AzureDriver(driver.ComputeDriver):
     #                                        source_blob=source_uri)
     #         raise ex
 
-    def _delete_disk(self, disk_name):
+    def _delete_disk(self, disk_name, shard=None, key=None):
+        shard = shard or self.default_shard
         try:
-            self.disks.delete(CONF.azure.resource_group, disk_name)
+            shard.disks.delete(shard.group_for(key), disk_name)
         except exception.AzureMissingResourceHttpError:
             # refer lvm driver, if volume to delete doesn't exist, return True.
             message = (_LI("Volume disk: %s does not exist.") % disk_name)
@@ -758,9 +959,10 @@ class AzureDriver(driver.ComputeDriver):
         # vm = self._get_instance(instance.uuid)
         # os_blob_uri = vm.storage_profile.os_disk.vhd.uri
         # os_blob_name = instance.uuid
+        shard = self._get_shard(instance)
         disk_name = self._get_name_from_id(instance.uuid)
         try:
-            self._delete_disk(disk_name)
+            self._delete_disk(disk_name, shard, instance.uuid)
             LOG.info(_LI("Delete instance's Volume"), instance=instance)
         except Exception as e:
             LOG.warning(_LW("Unable to delete blob for instance"
@@ -770,8 +972,8 @@ class AzureDriver(driver.ComputeDriver):
 
         # 2 clean network interface
         try:
-            async_vm_action = self.network.network_interfaces.delete(
-                CONF.azure.resource_group, instance.uuid
+            async_vm_action = shard.network.network_interfaces.delete(
+                shard.group_for(instance.uuid), instance.uuid
             )
             async_vm_action.wait(CONF.azure.async_timeout)
             LOG.info(_LI("Delete instance's Interface"), instance=instance)
@@ -784,9 +986,10 @@ class AzureDriver(driver.ComputeDriver):
     def destroy(self, context, instance, network_info, block_device_info=None,
                 destroy_disks=True, migrate_data=None):
         LOG.debug("Calling Delete Instance in Azure ...", instance=instance)
+        shard = self._get_shard(instance)
         try:
-            async_vm_action = self.compute.virtual_machines.delete(
-                CONF.azure.resource_group, instance.uuid)
+            async_vm_action = shard.compute.virtual_machines.delete(
+                shard.group_for(instance.uuid), instance.uuid)
             async_vm_action.wait(CONF.azure.async_timeout)
             LOG.info(_LI("Delete Instance in Azure Finish."),
                      instance=instance)
@@ -803,9 +1006,10 @@ class AzureDriver(driver.ComputeDriver):
 
     def reboot(self, context, instance, network_info, reboot_type,
                block_device_info=None, bad_volumes_callback=None):
+        shard = self._get_shard(instance)
         try:
-            async_vm_action = self.compute.virtual_machines.restart(
-                CONF.azure.resource_group, instance.uuid)
+            async_vm_action = shard.compute.virtual_machines.restart(
+                shard.group_for(instance.uuid), instance.uuid)
             async_vm_action.wait(CONF.azure.async_timeout)
             LOG.info(_LI("Restart Instance in Azure Finish."),
                      instance=instance)
@@ -816,9 +1020,10 @@ class AzureDriver(driver.ComputeDriver):
             raise ex
 
     def power_off(self, instance, timeout=0, retry_interval=0):
+        shard = self._get_shard(instance)
         try:
-            async_vm_action = self.compute.virtual_machines.power_off(
-                CONF.azure.resource_group, instance.uuid)
+            async_vm_action = shard.compute.virtual_machines.power_off(
+                shard.group_for(instance.uuid), instance.uuid)
             async_vm_action.wait(CONF.azure.async_timeout)
             LOG.info(_LI("Power off Instance in Azure Finish."),
                      instance=instance)
@@ -830,9 +1035,10 @@ class AzureDriver(driver.ComputeDriver):
 
     def power_on(self, context, instance, network_info,
                  block_device_info=None):
+        shard = self._get_shard(instance)
         try:
-            async_vm_action = self.compute.virtual_machines.start(
-                CONF.azure.resource_group, instance.uuid)
+            async_vm_action = shard.compute.virtual_machines.start(
+                shard.group_for(instance.uuid), instance.uuid)
             async_vm_action.wait(CONF.azure.async_timeout)
             LOG.info(_LI("Power On Instance in Azure Finish."),
                      instance=instance)
@@ -848,9 +1054,10 @@ class AzureDriver(driver.ComputeDriver):
                 recreate=False, block_device_info=None,
                 preserve_ephemeral=False):
 
+        shard = self._get_shard(instance)
         try:
-            async_vm_action = self.compute.virtual_machines.redeploy(
-                CONF.azure.resource_group, instance.uuid)
+            async_vm_action = shard.compute.virtual_machines.redeploy(
+                shard.group_for(instance.uuid), instance.uuid)
             instance.task_state = task_states.REBUILD_SPAWNING
             instance.save()
             LOG.debug("Calling Rebuild Instance in Azure"
@@ -872,8 +1079,9 @@ class AzureDriver(driver.ComputeDriver):
 
     def _get_new_size(self, instance, flavor):
         """get size from mapping, return None if no mapping match."""
-        sizes = self.compute.virtual_machines.list_available_sizes(
-            CONF.azure.resource_group, instance.uuid)
+        shard = self._get_shard(instance)
+        sizes = shard.compute.virtual_machines.list_available_sizes(
+            shard.group_for(instance.uuid), instance.uuid)
         try:
             vm_size = self._get_size_from_flavor(flavor)
         except exception.FlavorAzureMappingNotFound:
@@ -899,9 +1107,12 @@ class AzureDriver(driver.ComputeDriver):
             msg = six.text_type(e)
             LOG.error(msg)
             raise e
-        vm = self._get_instance(instance.uuid)
-        vm.hardware_profile.vm_size = size_obj
-        self._create_update_instance(instance, vm)
+
+        def _mutate(vm):
+            vm.hardware_profile.vm_size = size_obj
+            return {'properties': {'hardwareProfile': {'vmSize': size_obj}}}
+
+        self._update_instance(instance, _mutate)
         LOG.info(_LI('Resized Instance in Azure.'), instance=instance)
         return True
 
@@ -931,32 +1142,64 @@ class AzureDriver(driver.ComputeDriver):
         disallowed = constant.password_disallowed
         return password not in disallowed
 
+    def _apply_volume_changes(self, instance, changes):
+        """Apply attach/detach of an instance in one vm update.
+
+        return {index: exception} of changes can't be applied alone.
+        """
+        errors = {}
+
+        def _mutate(vm):
+            errors.clear()
+            data_disks = vm.storage_profile.data_disks
+            updated = False
+            for index, change in enumerate(changes):
+                attached = [i for i in data_disks
+                            if _disk_attr(i, 'name') == change.disk_name]
+                if change.action == DETACH:
+                    if not attached:
+                        LOG.info(_LI('Volume: %s was not attached to '
+                                     'Instance!'), change.disk_name,
+                                 instance=instance)
+                        continue
+                    data_disks.remove(attached[0])
+                    updated = True
+                    continue
+                if attached:
+                    continue
+                luns = [_disk_attr(i, 'lun') for i in data_disks]
+                # azure allow upto 16 extra datadisk, 1 os disk + 1
+                # ephemeral disk, ephemeral disk will always be sdb for
+                # linux.
+                free_luns = [i for i in range(1, 16) if i not in luns]
+                if not free_luns:
+                    msg = 'Can not attach volume, exist volume amount upto 16.'
+                    LOG.error(msg)
+                    errors[index] = nova_ex.NovaException(msg)
+                    continue
+                data_disks.append(dict(lun=free_luns[0],
+                                       name=change.disk_name,
+                                       managed_disk=dict(id=change.disk_id),
+                                       create_option='attach'))
+                updated = True
+            if not updated:
+                return None
+            return {'properties': {'storageProfile': {
+                'dataDisks': [_data_disk_body(i) for i in data_disks]}}}
+
+        self._update_instance(instance, _mutate)
+        return errors
+
     def attach_volume(self, context, connection_info, instance, mountpoint,
                       disk_bus=None, device_type=None, encryption=None):
         """Attach volume, append volume info into vm parameters."""
         data = connection_info['data']
-        vm = self._get_instance(instance.uuid)
-        data_disks = vm.storage_profile.data_disks
-        luns = [i.lun for i in data_disks]
-        new_lun = 1
-        # azure allow upto 16 extra datadisk, 1 os disk + 1 ephemeral disk
-        # ephemeral disk will always be sdb for linux.
-        for i in range(1, 16):
-            if i not in luns:
-                new_lun = i
-                break
-        else:
-            msg = 'Can not attach volume, exist volume amount upto 16.'
-            LOG.error(msg)
-            raise nova_ex.NovaException(msg)
-        disk = self.disks.get(CONF.azure.resource_group, data['disk_name'])
-        managed_disk = dict(id=disk.id)
-        data_disk = dict(lun=new_lun,
-                         name=data['disk_name'],
-                         managed_disk=managed_disk,
-                         create_option='attach')
-        data_disks.append(data_disk)
-        self._create_update_instance(instance, vm)
+        shard = self._get_shard(instance)
+        disk_id = self._get_volume_disk_id(data, shard)
+        # concurrent attach/detach of the instance are merged in one update.
+        self.volume_batcher.submit(
+            instance.uuid, instance,
+            VolumeChange(ATTACH, data['disk_name'], disk_id))
         LOG.info(_LI("Attach Volume to Instance in Azure finish"),
                  instance=instance)
 
@@ -964,19 +1207,8 @@ class AzureDriver(driver.ComputeDriver):
                       encryption=None):
         """Dettach volume, remove volume info from vm parameters."""
         vhd_name = connection_info['data']['disk_name']
-        vm = self._get_instance(instance.uuid)
-        data_disks = vm.storage_profile.data_disks
-        not_found = True
-        for i in range(len(data_disks)):
-            if vhd_name == data_disks[i].name:
-                del data_disks[i]
-                not_found = False
-                break
-        if not_found:
-            LOG.info(_LI('Volume: %s was not attached to Instance!'),
-                     vhd_name, instance=instance)
-            return
-        self._create_update_instance(instance, vm)
+        self.volume_batcher.submit(instance.uuid, instance,
+                                   VolumeChange(DETACH, vhd_name, None))
         LOG.info(_LI("Detach Volume to Instance in Azure finish"),
                  instance=instance)
 
@@ -1082,21 +1314,25 @@ class AzureDriver(driver.ComputeDriver):
     #     else:
     #         LOG.info(_LI('Delete all residual snapshots in Azure'))
 
-    def _cleanup_deleted_nics(self):
+    def _cleanup_deleted_nics(self, shard=None):
         """cleanup deleted resources in silent mode
 
         add residual nics into self.residual_nics list, and delete residual
         nics addded last check, inorder to avoid new created nic for instance
         spawning.
         """
-        try:
-            nics = self.network.network_interfaces.list(
-                CONF.azure.resource_group)
-        except Exception as e:
-            msg = six.text_type(e)
-            LOG.exception(msg)
-            return
-        residual_ids = [i.name for i in nics if not i.virtual_machine]
+        shard = shard or self.default_shard
+        nic_groups = {}
+        for _shard, group, nics in self._list_groups(
+                [shard],
+                lambda shard, group:
+                shard.network.network_interfaces.list(group)):
+            if isinstance(nics, Exception):
+                LOG.error(six.text_type(nics))
+                return
+            nic_groups.update((i.name, group) for i in nics
+                              if not i.virtual_machine)
+        residual_ids = list(nic_groups)
         to_delete_ids = set(self.residual_nics) & set(residual_ids)
         self.residual_nics = list(set(self.residual_nics) | set(residual_ids))
         if not to_delete_ids:
@@ -1104,8 +1340,8 @@ class AzureDriver(driver.ComputeDriver):
             return
         for i in to_delete_ids:
             try:
-                self.network.network_interfaces.delete(
-                    CONF.azure.resource_group, i
+                shard.network.network_interfaces.delete(
+                    nic_groups[i], i
                 )
             except Exception as e:
                 LOG.warning(_LW("Unable to delete network_interfaces "
@@ -1121,28 +1357,31 @@ class AzureDriver(driver.ComputeDriver):
     def _is_os_disk(self, name):
         return INSTANCE_PREFIX == name[:7]
 
-    def _cleanup_deleted_os_disks(self):
+    def _cleanup_deleted_os_disks(self, shard=None):
         """cleanup deleted resources in silent mode
 
         cleanup os disk by check properties.lease.status and
         properties.lease.state of blob.
         """
-        try:
-            disks = self.disks.list_by_resource_group(
-                CONF.azure.resource_group)
-        except Exception as e:
-            LOG.warning(_LW("Unable to delete disks"
-                            " in Azure because %(reason)s"),
-                        dict(reason=six.text_type(e)))
-            return
-        # blobs is and iterable obj, although it's empty.
+        shard = shard or self.default_shard
+        disks = []
+        for _shard, group, items in self._list_groups(
+                [shard],
+                lambda shard, group:
+                shard.disks.list_by_resource_group(group)):
+            if isinstance(items, Exception):
+                LOG.warning(_LW("Unable to delete disks"
+                                " in Azure because %(reason)s"),
+                            dict(reason=six.text_type(items)))
+                return
+            disks.extend((group, i) for i in items or [])
         if not disks:
             LOG.info(_LI('No residual Disk in Azure'))
             return
-        for i in disks:
+        for group, i in disks:
             if self._is_os_disk(i.name) and not i.owner_id:
                 try:
-                    self.disks.delete(CONF.azure.resource_group, i.name)
+                    shard.disks.delete(group, i.name)
                 except Exception as e:
                     LOG.warning(_LW("Unable to delete os disk %(disk)s"
                                     "in Azure because %(reason)s"),
@@ -21,6 +21,11 @@ AzureMissingResourceHttpError = AzureMissingResourceHttpError
 CloudError = CloudError
 
 
+class AzureCircuitOpen(exception.NovaException):
+    msg_fmt = _("Azure calls of %(circuit)s are failing, fail fast until "
+                "circuit half open after %(retry_after)s seconds.")
+
+
 class ImageAzureMappingNotFound(exception.NotFound):
     msg_fmt = _("Image %(image_name)s could not be found in Azure Mapping.")
 
@@ -39,6 +44,16 @@ class PasswordInvalid(exception.Invalid):
                 "%(instance_uuid)s in Azure.")
 
 
+class SubscriptionInvalid(exception.Invalid):
+    msg_fmt = _("Subscription %(value)s is invalid, should be "
+                "subscription_id:resource_group.")
+
+
+class NodeInvalid(exception.Invalid):
+    msg_fmt = _("Node %(value)s is invalid, should be "
+                "location:resource_group.")
+
+
 class OSTypeNotFound(exception.NotFound):
     msg_fmt = _("Unabled to decide OS type %(os_type)s of instance.")
 
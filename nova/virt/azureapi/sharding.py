@@ -0,0 +1,291 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import hashlib
+import re
+import time
+
+import six
+from nova.i18n import _LW
+from nova.virt.azureapi import exception
+from nova.virt.azureapi import resource_ids
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# key in instance system_metadata to persist shard of instance.
+SHARD_KEY = 'azure_shard'
+# regional total vcpu quota in compute usage list.
+CORES_USAGE = 'cores'
+# tier, series, premium storage suffix and version of a vm size name.
+SIZE_REGEX = re.compile(r'^(Basic|Standard)_([A-Z]+)\d+([a-z]*)(?:_(v\d+))?')
+
+
+def size_family(size_name):
+    """Usage family of vm size, e.g. Standard_DS2_v2 is standardDSv2Family."""
+    match = SIZE_REGEX.match(size_name or '')
+    if not match:
+        return None
+    tier, series, suffix, version = match.groups()
+    if 's' in suffix and not series.endswith('S'):
+        series += 'S'
+    return '{}{}{}Family'.format(tier.lower(), series, version or '')
+
+
+def parse_subscriptions(values):
+    """Parse 'subscription_id:resource_group' items of azure.subscriptions."""
+    subscriptions = []
+    for value in values or []:
+        subscription_id, _sep, resource_group = value.partition(':')
+        if not (subscription_id and resource_group):
+            raise exception.SubscriptionInvalid(value=value)
+        subscriptions.append((subscription_id, resource_group))
+    return subscriptions
+
+
+def parse_nodes(values):
+    """Parse 'location:resource_group' items of azure.nodes."""
+    nodes = []
+    for value in values or []:
+        location, _sep, resource_group = value.partition(':')
+        if not (location and resource_group):
+            raise exception.NodeInvalid(value=value)
+        nodes.append((location, resource_group))
+    return nodes
+
+
+def node_name(location, resource_group=None):
+    if resource_group is None:
+        return 'azure-{}'.format(location)
+    return 'azure-{}-{}'.format(location, resource_group)
+
+
+def jump_hash(key, buckets):
+    """Bucket of key by jump consistent hash.
+
+    growing buckets from n to n + 1 only moves 1/(n + 1) keys, all to the
+    new bucket.
+    """
+    seed = int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        seed = (seed * 2862933555777941757 + 1) & 0xffffffffffffffff
+        jump = int((bucket + 1) * (float(1 << 31) / ((seed >> 33) + 1)))
+    return bucket
+
+
+def group_names(resource_group, count):
+    """Resource groups of a shard, resource_group itself is the first."""
+    return [resource_group] + ['{}-{}'.format(resource_group, i)
+                               for i in range(1, max(count, 1))]
+
+
+def _warn_duplicate(option, value, shard):
+    LOG.warning(_LW("Item %(value)s of azure.%(option)s is ignored, its "
+                    "subscription and resource group are already shard "
+                    "%(shard)s in %(location)s."),
+                dict(value=value, option=option, shard=shard.name,
+                     location=shard.location))
+
+
+def build_shards(default_azure, azure_cls, conf):
+    """Shards of default subscription, azure.subscriptions and azure.nodes.
+
+    shards of subscriptions are in the default node of azure.location, each
+    item of azure.nodes is a node of its own shard. shards of same
+    subscription and location share its quota equally. items of same
+    subscription and resource group as a shard before are ignored.
+    """
+    count = conf.azure.resource_group_count
+    default = Shard(default_azure, conf.azure.subscription_id,
+                    conf.azure.resource_group, conf.azure.location,
+                    group_count=count)
+    shards = collections.OrderedDict([(default.name, default)])
+    for subscription_id, resource_group in \
+            parse_subscriptions(conf.azure.subscriptions):
+        name = '{}:{}'.format(subscription_id, resource_group)
+        if name in shards:
+            _warn_duplicate('subscriptions', name, shards[name])
+            continue
+        shards[name] = Shard(azure_cls(subscription_id, resource_group),
+                             subscription_id, resource_group,
+                             conf.azure.location, group_count=count)
+    subscription_id = conf.azure.subscription_id
+    for location, resource_group in parse_nodes(conf.azure.nodes):
+        name = '{}:{}'.format(subscription_id, resource_group)
+        if name in shards:
+            _warn_duplicate('nodes', '{}:{}'.format(location, resource_group),
+                            shards[name])
+            continue
+        shards[name] = Shard(
+            azure_cls(subscription_id, resource_group, location),
+            subscription_id, resource_group, location,
+            node_name(location, resource_group), count)
+    quotas = collections.Counter((shard.subscription_id, shard.location)
+                                 for shard in shards.values())
+    for shard in shards.values():
+        shard.quota_shares = quotas[(shard.subscription_id, shard.location)]
+    return shards
+
+
+def group_nodes(shards):
+    """Shards of each node, by node name, default node first."""
+    nodes = collections.OrderedDict()
+    for shard in shards:
+        nodes.setdefault(shard.node, []).append(shard)
+    return nodes
+
+
+class Shard(object):
+    """A subscription and resource group Azure resources placed in."""
+
+    def __init__(self, azure, subscription_id, resource_group, location,
+                 node=None, group_count=1):
+        self.azure = azure
+        self.subscription_id = subscription_id
+        self.resource_group = resource_group
+        self.location = location
+        self.name = '{}:{}'.format(subscription_id, resource_group)
+        self.resource_groups = group_names(resource_group, group_count)
+        self.node = node or node_name(location)
+        self.vsubnet_id = None
+        # shards quota of subscription and location is divided among.
+        self.quota_shares = 1
+        self._usages = {}
+        self._usages_at = 0
+        self._sizes = None
+
+    @property
+    def compute(self):
+        return self.azure.compute
+
+    @property
+    def network(self):
+        return self.azure.network
+
+    @property
+    def resource(self):
+        return self.azure.resource
+
+    @property
+    def disks(self):
+        return self.azure.compute.disks
+
+    @property
+    def refreshed(self):
+        return self._usages_at > 0
+
+    def refresh(self):
+        """Refresh cached compute usages, and vm sizes catalog once."""
+        page = self.compute.usage.list(self.location)
+        usages = dict((i.name.value, (i.limit, i.current_value))
+                      for i in page)
+        if self._sizes is None:
+            self._sizes = dict(
+                (i.name, i) for i in
+                self.compute.virtual_machine_sizes.list(self.location))
+        self._usages = usages
+        self._usages_at = time.time()
+
+    def get_usage(self, usage_name, ttl=60):
+        """Return (limit, current_value) of usage, cached for ttl seconds."""
+        if time.time() - self._usages_at > ttl:
+            self.refresh()
+        return self._usages.get(usage_name, (0, 0))
+
+    def capacity(self, size_names):
+        """Capacity for vm sizes from cached usages, no Azure call.
+
+        vcpus are quota of families of the sizes, bounded by regional cores
+        quota. memory and disk are vcpus multiplied by the largest per core
+        memory and resource disk of sizes in the family. all is divided by
+        quota_shares, so nodes of a location don't report same quota twice.
+        """
+        ratios = {}
+        for name in size_names:
+            family = size_family(name)
+            size = (self._sizes or {}).get(name)
+            if family is None or size is None or not size.number_of_cores:
+                continue
+            memory, disk = ratios.get(family, (0, 0))
+            ratios[family] = (
+                max(memory, size.memory_in_mb / float(size.number_of_cores)),
+                max(disk, size.resource_disk_size_in_mb /
+                    1024.0 / size.number_of_cores))
+        total = dict(vcpus=0, vcpus_used=0, memory_mb=0, memory_mb_used=0,
+                     local_gb=0, local_gb_used=0)
+        for family, (memory, disk) in ratios.items():
+            limit, current = self._usages.get(family, (0, 0))
+            total['vcpus'] += limit
+            total['vcpus_used'] += current
+            total['memory_mb'] += limit * memory
+            total['memory_mb_used'] += current * memory
+            total['local_gb'] += limit * disk
+            total['local_gb_used'] += current * disk
+        cores, _current = self._usages.get(CORES_USAGE, (0, 0))
+        if cores and total['vcpus'] > cores:
+            scale = float(cores) / total['vcpus']
+            for key in ('vcpus', 'memory_mb', 'local_gb'):
+                total[key] *= scale
+        return dict((k, int(v / self.quota_shares))
+                    for k, v in total.items())
+
+    def group_for(self, key=None):
+        """Resource group of resources of key, e.g. uuid of instance.
+
+        placed by consistent hash of key, no lookup needed. resources
+        without key are in resource_group.
+        """
+        if key is None or len(self.resource_groups) == 1:
+            return self.resource_group
+        return self.resource_groups[
+            jump_hash(key, len(self.resource_groups))]
+
+    def resource_id(self, resource_type, name, key=None):
+        return resource_ids.build(self.subscription_id,
+                                  self.group_for(key or name),
+                                  resource_type, name)
+
+    def throttle_score(self):
+        return self.azure.retry_policy.throttle_score()
+
+
+def choose_shard(shards, usage_name, amount=1, ttl=60):
+    """Choose shard with most quota headroom, less throttled is preferred.
+
+    score is remaining quota divided by recent throttle count, shards can't
+    hold amount are skipped. if no shard fits, return the first one and let
+    Azure report quota exceeded.
+    """
+    if len(shards) == 1:
+        return shards[0]
+    best = None
+    best_score = None
+    for shard in shards:
+        try:
+            limit, current = shard.get_usage(usage_name, ttl)
+        except Exception as e:
+            LOG.warning(_LW("Unable to get usage of %(shard)s because "
+                            "%(reason)s"),
+                        dict(shard=shard.name, reason=six.text_type(e)))
+            continue
+        headroom = limit - current - amount
+        if headroom < 0:
+            continue
+        score = headroom / (1.0 + shard.throttle_score())
+        if best is None or score > best_score:
+            best = shard
+            best_score = score
+    return best or shards[0]